@@ -0,0 +1,141 @@
+"""Asyncio runner for the hourly pipeline (`python main.py --engine async`).
+
+Drives the same fetch -> weather enrichment -> validate -> write flow as the
+sync runner, with provider HTTP calls and Supabase writes running as coroutines
+under a concurrency semaphore. Normalization, validation and outcome
+classification are shared with the sync runner so both produce the same summary.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+
+from airvisual_api import fetch_air_quality_data_async as fetch_airvisual_air_quality_data_async
+from city_outcomes import build_skipped_city_outcome, build_updated_city_outcome, defer_weather_enrichment
+from reading_dedupe import dedupe_fetch_result
+from scheduler import RunBudget, build_deferred_city_outcome, record_outcome_latency
+from supabase_client import get_async_supabase_client
+from update_city import update_city_async
+from utils import check_if_update_needed
+from waqi_api import fetch_air_quality_data_async as fetch_waqi_air_quality_data_async
+from weather_context import enrich_with_weather_context_async
+from weather_enrichment import is_weather_enrichment_deferred
+
+ASYNC_CONCURRENCY_ENV_VAR = "PIPELINE_ASYNC_CONCURRENCY"
+DEFAULT_ASYNC_CONCURRENCY = 5
+
+
+def get_async_concurrency() -> int:
+    raw_value = os.getenv(ASYNC_CONCURRENCY_ENV_VAR, str(DEFAULT_ASYNC_CONCURRENCY)).strip()
+    try:
+        concurrency = int(raw_value)
+    except ValueError:
+        concurrency = 0
+
+    if concurrency < 1:
+        raise EnvironmentError(
+            f"{ASYNC_CONCURRENCY_ENV_VAR} invalido: {raw_value}. Usa un entero >= 1."
+        )
+    return concurrency
+
+
+async def fetch_provider_air_quality_async(
+    client: httpx.AsyncClient,
+    provider: str,
+    city: dict,
+    env: dict[str, str],
+) -> dict:
+    if provider == "waqi":
+        return await fetch_waqi_air_quality_data_async(
+            client,
+            api_name=city["api_name"],
+            city_id=city["id"],
+            waqi_api_token=env["WAQI_API_TOKEN"],
+        )
+
+    return await fetch_airvisual_air_quality_data_async(
+        client,
+        api_name=city["api_name"],
+        city_id=city["id"],
+        state="Nuevo Leon",
+        country="Mexico",
+        AIRVISUAL_API_KEY=env["AIRVISUAL_API_KEY"],
+    )
+
+
+async def process_city_async(
+    client: httpx.AsyncClient,
+    supabase,
+    semaphore: asyncio.Semaphore,
+    provider: str,
+    city: dict,
+    env: dict[str, str],
+    force_update: bool,
+    budget: RunBudget | None = None,
+) -> dict:
+    async with semaphore:
+        outcome = await run_city_pipeline_async(client, supabase, provider, city, env, force_update, budget)
+        if budget is not None:
+            record_outcome_latency(budget, outcome)
+        return outcome
+
+
+async def run_city_pipeline_async(
+    client: httpx.AsyncClient,
+    supabase,
+    provider: str,
+    city: dict,
+    env: dict[str, str],
+    force_update: bool,
+    budget: RunBudget | None = None,
+) -> dict:
+    city_started_at = time.perf_counter()
+    check_result = check_if_update_needed(city, force_update)
+    if not check_result["needsUpdate"]:
+        return build_skipped_city_outcome(city, check_result, city_started_at)
+    if budget is not None and not budget.can_start_city():
+        return build_deferred_city_outcome(city)
+
+    logging.info("[UPDATE] Ciudad %s necesita actualizacion.", city["api_name"])
+    fetch_result = await fetch_provider_air_quality_async(client, provider, city, env)
+    fetch_result["city_id"] = city["id"]
+    fetch_result = dedupe_fetch_result(fetch_result)
+    deferred_weather = is_weather_enrichment_deferred()
+    if not deferred_weather:
+        fetch_result = await enrich_with_weather_context_async(
+            client,
+            fetch_result,
+            canonical_lat=city.get("latitude"),
+            canonical_lon=city.get("longitude"),
+        )
+    update_result = await update_city_async(fetch_result, supabase)
+    if deferred_weather:
+        defer_weather_enrichment(city, fetch_result, update_result)
+    return build_updated_city_outcome(city, fetch_result, update_result, city_started_at)
+
+
+async def run_cities_async(
+    provider: str,
+    cities: list[dict],
+    env: dict[str, str],
+    force_update: bool,
+    concurrency: int,
+    budget: RunBudget | None = None,
+) -> list[dict]:
+    """Return one outcome per city, in input order, for `main.apply_city_outcome`."""
+    semaphore = asyncio.Semaphore(concurrency)
+    supabase = await get_async_supabase_client()
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+
+    async with httpx.AsyncClient(limits=limits) as client:
+        return await asyncio.gather(
+            *(
+                process_city_async(
+                    client, supabase, semaphore, provider, city, env, force_update, budget
+                )
+                for city in cities
+            )
+        )
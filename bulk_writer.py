@@ -0,0 +1,278 @@
+"""Buffered Supabase writer for `PIPELINE_WRITE_MODE=bulk`.
+
+Collects the write plans built by `update_city.build_city_update_plan` and
+flushes them in batched PostgREST calls: one `raw_payloads` store for new
+payloads (see `raw_payload_store`), one multi-row upsert into
+`air_quality_readings` that ignores already stored readings and returns the
+keys it inserted, one `cities` upsert by `id` per distinct column set and one
+`pipeline_logs` insert with `returning=minimal`. Each submitted city gets a
+result dict that is filled in on flush, so per-city success/failure (and
+readings skipped as duplicates) still reaches the run summary.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any
+
+from postgrest.types import ReturnMethod
+
+from raw_payload_store import store_raw_payloads
+from reading_dedupe import parse_reading_timestamp
+from supabase_client import build_pipeline_log_payload, get_supabase_client
+
+BATCH_SIZE_ENV_VAR = "PIPELINE_WRITE_BATCH_SIZE"
+FLUSH_SECONDS_ENV_VAR = "PIPELINE_WRITE_FLUSH_SECONDS"
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_FLUSH_SECONDS = 30.0
+# Unique index on air_quality_readings; repeated readings are ignored.
+READING_CONFLICT_COLUMNS = "city_id,reading_timestamp"
+# Only the key comes back, so inserted rows can be told apart from ignored duplicates.
+READING_RETURN_COLUMNS = "city_id, reading_timestamp"
+# Columns a cities upsert must carry so the INSERT half of ON CONFLICT passes NOT NULL.
+CITY_IDENTITY_COLUMNS = ("name", "api_name")
+
+_active_writer_lock = threading.Lock()
+_active_writer: "BulkWriter | None" = None
+
+
+def _read_positive(env_var: str, default: float, cast: type) -> Any:
+    raw_value = os.getenv(env_var, str(default)).strip()
+    try:
+        value = cast(raw_value)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise EnvironmentError(f"{env_var} invalido: {raw_value}. Usa un numero > 0.")
+    return value
+
+
+def reading_key(row: dict) -> tuple[int, Any] | None:
+    timestamp = parse_reading_timestamp(row.get("reading_timestamp"))
+    if row.get("city_id") is None or timestamp is None:
+        return None
+    return int(row["city_id"]), timestamp
+
+
+def get_write_batch_size() -> int:
+    return _read_positive(BATCH_SIZE_ENV_VAR, DEFAULT_BATCH_SIZE, int)
+
+
+def get_write_flush_seconds() -> float:
+    return _read_positive(FLUSH_SECONDS_ENV_VAR, DEFAULT_FLUSH_SECONDS, float)
+
+
+class BulkWriter:
+    def __init__(
+        self,
+        supabase: Any = None,
+        batch_size: int | None = None,
+        flush_seconds: float | None = None,
+    ):
+        self._supabase = supabase
+        self.batch_size = batch_size or get_write_batch_size()
+        self.flush_seconds = flush_seconds or get_write_flush_seconds()
+        self._pending: list[tuple[dict, dict]] = []
+        self._oldest_pending_at: float | None = None
+        self._city_identity: dict[int, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.flushes = 0
+
+    @property
+    def supabase(self) -> Any:
+        if self._supabase is None:
+            self._supabase = get_supabase_client()
+        return self._supabase
+
+    def register_cities(self, cities: list[dict]) -> None:
+        """Remember name/api_name per city id for the `cities` upsert."""
+        with self._lock:
+            for city in cities:
+                if all(city.get(column) for column in CITY_IDENTITY_COLUMNS):
+                    self._city_identity[city["id"]] = {
+                        column: city[column] for column in CITY_IDENTITY_COLUMNS
+                    }
+
+    def submit(self, plan: dict, result: dict) -> dict:
+        """Queue one city's writes; `result` is filled in when the batch flushes."""
+        result["pendingWrite"] = True
+        with self._lock:
+            if not self._pending:
+                self._oldest_pending_at = time.perf_counter()
+            self._pending.append((plan, result))
+        return result
+
+    def flush_due(self) -> bool:
+        with self._lock:
+            if not self._pending:
+                return False
+            if len(self._pending) >= self.batch_size:
+                return True
+            return time.perf_counter() - self._oldest_pending_at >= self.flush_seconds
+
+    def flush_if_due(self) -> None:
+        if self.flush_due():
+            self.flush()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+                self._oldest_pending_at = None
+            if not batch:
+                return
+
+            logging.info("[BULK] Escribiendo lote de %s ciudades.", len(batch))
+            self._write_readings(batch)
+            self._write_city_statuses(batch)
+            self._write_logs(batch)
+            for _, result in batch:
+                result.pop("pendingWrite", None)
+            self.flushes += 1
+
+    def _write_readings(self, batch: list[tuple[dict, dict]]) -> None:
+        entries = [(plan, result) for plan, result in batch if plan["reading"]]
+        if not entries:
+            return
+
+        # One raw_payloads lookup/insert per batch; shared stations store once.
+        store_raw_payloads([plan["reading"] for plan, _ in entries], self.supabase)
+        try:
+            response = (
+                self.supabase.table("air_quality_readings")
+                .upsert(
+                    [plan["reading"] for plan, _ in entries],
+                    on_conflict=READING_CONFLICT_COLUMNS,
+                    ignore_duplicates=True,
+                    returning=ReturnMethod.representation,
+                    default_to_null=False,
+                )
+                .select(READING_RETURN_COLUMNS)
+                .execute()
+            )
+        except Exception as error:
+            # A single bad row fails the whole statement; retry row by row so the
+            # error is attributed to the right city.
+            logging.warning("[BULK] Insert multi-row fallo (%s); reintentando por fila.", error)
+            for plan, result in entries:
+                self._insert_single_reading(plan, result)
+            return
+
+        # ignore_duplicates=True returns no row for a reading that was already stored.
+        inserted = {reading_key(row) for row in response.data or [] if isinstance(row, dict)}
+        for plan, result in entries:
+            mark_reading_written(result, reading_key(plan["reading"]) in inserted)
+
+    def _insert_single_reading(self, plan: dict, result: dict) -> None:
+        try:
+            response = (
+                self.supabase.table("air_quality_readings")
+                .upsert(
+                    plan["reading"],
+                    on_conflict=READING_CONFLICT_COLUMNS,
+                    ignore_duplicates=True,
+                    returning=ReturnMethod.representation,
+                    default_to_null=False,
+                )
+                .select(READING_RETURN_COLUMNS)
+                .execute()
+            )
+        except Exception as error:
+            result["insertError"] = str(error)
+            logging.error(f"Error al insertar lectura: {error}")
+            return
+        mark_reading_written(result, bool(response.data))
+
+    def _write_city_statuses(self, batch: list[tuple[dict, dict]]) -> None:
+        groups: dict[tuple[str, ...], list[tuple[dict, dict, dict]]] = {}
+        for plan, result in batch:
+            if not plan["city_status"]:
+                continue
+            identity = self._city_identity.get(plan["city_id"])
+            if identity is None:
+                self._update_single_city(plan, result)
+                continue
+            row = {"id": plan["city_id"], **identity, **plan["city_status"]}
+            # Rows in one PostgREST upsert must share columns, otherwise missing
+            # keys would overwrite e.g. last_successful_update_at with NULL.
+            groups.setdefault(tuple(sorted(row)), []).append((row, plan, result))
+
+        for rows in groups.values():
+            try:
+                self.supabase.table("cities").upsert(
+                    [row for row, _, _ in rows],
+                    on_conflict="id",
+                    returning=ReturnMethod.minimal,
+                ).execute()
+            except Exception as error:
+                logging.warning("[BULK] Upsert de cities fallo (%s); reintentando por ciudad.", error)
+                for _, plan, result in rows:
+                    self._update_single_city(plan, result)
+                continue
+            for _, _, result in rows:
+                result["cityStatusUpdated"] = True
+
+    def _update_single_city(self, plan: dict, result: dict) -> None:
+        try:
+            self.supabase.table("cities").update(
+                plan["city_status"],
+                returning=ReturnMethod.minimal,
+            ).eq("id", plan["city_id"]).execute()
+            result["cityStatusUpdated"] = True
+        except Exception as error:
+            result["updateError"] = str(error)
+            logging.error(f"Error al actualizar ciudad: {error}")
+
+    def _write_logs(self, batch: list[tuple[dict, dict]]) -> None:
+        # Imported lazily: update_city imports this module for the bulk path.
+        from update_city import build_update_log_event
+
+        payloads = [
+            build_pipeline_log_payload(
+                build_update_log_event(plan, {key: value for key, value in result.items() if key != "pendingWrite"})
+            )
+            for plan, result in batch
+        ]
+        try:
+            self.supabase.table("pipeline_logs").insert(payloads, returning=ReturnMethod.minimal).execute()
+        except Exception as error:
+            logging.warning(f"Could not persist pipeline logs: {error}")
+
+
+def mark_reading_written(result: dict, inserted: bool) -> None:
+    if inserted:
+        result["readingInserted"] = True
+    else:
+        result["readingDuplicate"] = True
+        logging.info("[BULK] Lectura ya almacenada para City ID %s; sin insert.", result.get("city_id"))
+
+
+def start_bulk_writer(cities: list[dict], supabase: Any = None) -> BulkWriter:
+    """Install the run's writer; `update_city` routes writes to it while active."""
+    global _active_writer
+
+    writer = BulkWriter(supabase)
+    writer.register_cities(cities)
+    with _active_writer_lock:
+        _active_writer = writer
+    return writer
+
+
+def get_active_bulk_writer() -> BulkWriter | None:
+    with _active_writer_lock:
+        return _active_writer
+
+
+def finish_bulk_writer() -> BulkWriter | None:
+    """Flush and uninstall the active writer (end of run)."""
+    global _active_writer
+
+    with _active_writer_lock:
+        writer = _active_writer
+        _active_writer = None
+    if writer is not None:
+        writer.flush()
+    return writer
@@ -0,0 +1,140 @@
+"""Per-city outcomes shared by every engine.
+
+A city run (sequential, threaded or async) ends in an outcome dict: summary
+counter increments, the `city_results` entry and whether it was a fatal
+failure. `main.apply_city_outcome` folds outcomes into the run summary, so
+every engine produces the same counters for the same city results.
+"""
+
+import logging
+import time
+
+from weather_enrichment import enqueue_weather_job
+
+NON_FATAL_FETCH_ERROR_TYPES = {"station_not_mapped"}
+
+
+def build_updated_city_outcome(
+    city: dict,
+    fetch_result: dict,
+    update_result: dict,
+    city_started_at: float,
+    elapsed_seconds: float | None = None,
+) -> dict:
+    """Classify one attempted update into summary counters and a city result.
+
+    Shared by every engine so sequential, threaded and async runs produce
+    identical counters and city results. Writes still queued in the bulk
+    writer yield a pending outcome that `main.finalize_city_outcomes` reclassifies.
+    """
+    if elapsed_seconds is None:
+        elapsed_seconds = time.perf_counter() - city_started_at
+
+    if update_result.get("pendingWrite"):
+        return {
+            "city": city,
+            "counters": {},
+            "result": {"needed_update": True, "pending_write": True},
+            "fatal_failure": False,
+            "elapsed_seconds": elapsed_seconds,
+            "pending_write": {"fetch_result": fetch_result, "update_result": update_result},
+        }
+
+    counters: dict[str, int] = {"updates_attempted": 1}
+    fatal_failure = False
+    weather_context = fetch_result.get("weather_context") or {}
+    if weather_context.get("status") == "success":
+        counters["weather_context_success"] = 1
+    elif weather_context:
+        counters["weather_context_errors"] = 1
+
+    successful_insert = (
+        fetch_result.get("status") == "success"
+        and update_result.get("readingInserted")
+        and not update_result.get("insertError")
+        and not update_result.get("updateError")
+        and not update_result.get("validationErrors")
+    )
+
+    if successful_insert:
+        counters["readings_inserted"] = 1
+        logging.info("[OK] Update realizado para %s: %s", city["api_name"], update_result)
+    elif (
+        fetch_result.get("status") == "skipped"
+        or (fetch_result.get("status") == "success" and update_result.get("readingDuplicate"))
+    ) and not update_result.get("updateError"):
+        # Duplicates rejected by the (city_id, reading_timestamp) index are
+        # unchanged upstream readings caught at write time.
+        counters["skipped_unchanged_upstream"] = 1
+    else:
+        error_type = fetch_result.get("errorType")
+        non_fatal_fetch_error = error_type in NON_FATAL_FETCH_ERROR_TYPES
+
+        if non_fatal_fetch_error:
+            counters["skipped_unmapped"] = 1
+            logging.warning(
+                "[NEEDS_MAPPING] Ciudad %s sin mapping verificado: %s",
+                city["api_name"],
+                update_result,
+            )
+        else:
+            fatal_failure = True
+            counters["failed_updates"] = 1
+
+        if fetch_result.get("status") == "error" and not non_fatal_fetch_error:
+            counters["fetch_errors"] = 1
+        if update_result.get("validationErrors"):
+            counters["validation_failures"] = 1
+        if update_result.get("insertError"):
+            counters["insert_errors"] = 1
+        if update_result.get("updateError"):
+            counters["update_errors"] = 1
+
+        if not non_fatal_fetch_error:
+            logging.warning("[WARN] Update con alertas para %s: %s", city["api_name"], update_result)
+
+    return {
+        "city": city,
+        "counters": counters,
+        "result": {
+            "needed_update": True,
+            "fetch_status": fetch_result.get("status"),
+            "fetch_error_type": fetch_result.get("errorType"),
+            "fetch_skip_reason": fetch_result.get("skipReason"),
+            "weather_context_status": weather_context.get("status"),
+            "weather_context_error_type": weather_context.get("errorType"),
+            "weather_provider": weather_context.get("weather_provider"),
+            "reading_inserted": bool(update_result.get("readingInserted")),
+            "reading_timestamp": fetch_result.get("reading_timestamp_iso"),
+            "provider_station_id": fetch_result.get("provider_station_id"),
+            "shared_fetch_city_id": fetch_result.get("sharedFetchCityId"),
+            "city_status_updated": bool(update_result.get("cityStatusUpdated")),
+            "insert_error": update_result.get("insertError"),
+            "update_error": update_result.get("updateError"),
+            "validation_errors": update_result.get("validationErrors"),
+        },
+        "fatal_failure": fatal_failure,
+        "elapsed_seconds": elapsed_seconds,
+    }
+
+
+def build_skipped_city_outcome(city: dict, check_result: dict, city_started_at: float) -> dict:
+    logging.info("[SKIP] Ciudad %s no necesita actualizacion.", city["api_name"])
+    return {
+        "city": city,
+        "counters": {"skipped_up_to_date": 1},
+        "result": {
+            "needed_update": False,
+            "reason": check_result.get("errorMessage") or "up_to_date",
+        },
+        "fatal_failure": False,
+        "elapsed_seconds": time.perf_counter() - city_started_at,
+    }
+
+
+def defer_weather_enrichment(city: dict, fetch_result: dict, update_result: dict) -> None:
+    """Queue weather for a reading that was written (or handed to the bulk writer) without it."""
+    if fetch_result.get("status") != "success":
+        return
+    if update_result.get("readingInserted") or update_result.get("pendingWrite"):
+        enqueue_weather_job(fetch_result, canonical_lat=city.get("latitude"), canonical_lon=city.get("longitude"))
@@ -0,0 +1,175 @@
+"""Shared HTTP transport for provider adapters and backfill scripts.
+
+Keeps one keep-alive `requests.Session` per host so a run pays one TCP/TLS
+handshake per host and pool slot instead of one per request. Connections are
+timed at the urllib3 level: handshake (connect + TLS) and time to first byte
+are aggregated per host for the run summary.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+POOL_SIZE_ENV_VAR = "PIPELINE_HTTP_POOL_SIZE"
+CONNECT_TIMEOUT_ENV_VAR = "PIPELINE_HTTP_CONNECT_TIMEOUT_SECONDS"
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 10.0
+DEFAULT_READ_TIMEOUT_SECONDS = 45.0
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_host_stats: dict[str, dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(host: str, **increments: float) -> None:
+    with _stats_lock:
+        stats = _host_stats.setdefault(
+            host,
+            {"requests": 0, "connections_opened": 0, "handshake_seconds": 0.0, "ttfb_seconds": 0.0},
+        )
+        for key, value in increments.items():
+            stats[key] += value
+
+
+class _TimedConnectionMixin:
+    """Record handshake and TTFB per host on top of urllib3's connection classes."""
+
+    def connect(self) -> None:
+        started_at = time.perf_counter()
+        super().connect()
+        _record(self.host, connections_opened=1, handshake_seconds=time.perf_counter() - started_at)
+
+    def request(self, *args: Any, **kwargs: Any) -> None:
+        self._request_started_at = time.perf_counter()
+        super().request(*args, **kwargs)
+
+    def getresponse(self, *args: Any, **kwargs: Any) -> Any:
+        response = super().getresponse(*args, **kwargs)
+        started_at = getattr(self, "_request_started_at", None)
+        if started_at is not None:
+            _record(self.host, requests=1, ttfb_seconds=time.perf_counter() - started_at)
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, connections: int, maxsize: int, block: bool = False, **pool_kwargs: Any) -> None:
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+def _read_positive_number(env_var: str, default: float, cast: type) -> Any:
+    raw_value = os.getenv(env_var, str(default)).strip()
+    try:
+        value = cast(raw_value)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise EnvironmentError(f"{env_var} invalido: {raw_value}. Usa un numero > 0.")
+    return value
+
+
+def get_pool_size() -> int:
+    return _read_positive_number(POOL_SIZE_ENV_VAR, DEFAULT_POOL_SIZE, int)
+
+
+def get_connect_timeout() -> float:
+    return _read_positive_number(CONNECT_TIMEOUT_ENV_VAR, DEFAULT_CONNECT_TIMEOUT_SECONDS, float)
+
+
+def build_session() -> requests.Session:
+    pool_size = get_pool_size()
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """Return the shared session for the URL's scheme and host."""
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = build_session()
+            _sessions[key] = session
+        return session
+
+
+def http_get(url: str, params: Any = None, timeout: float | None = None, **kwargs: Any) -> requests.Response:
+    """GET through the pooled session; `timeout` is the read timeout."""
+    read_timeout = DEFAULT_READ_TIMEOUT_SECONDS if timeout is None else timeout
+    return get_session(url).get(
+        url,
+        params=params,
+        timeout=(get_connect_timeout(), read_timeout),
+        **kwargs,
+    )
+
+
+def get_transport_snapshot() -> dict[str, dict[str, Any]]:
+    """Per-host request/connection counts with average handshake and TTFB in ms."""
+    with _stats_lock:
+        stats = {host: dict(values) for host, values in _host_stats.items()}
+
+    snapshot = {}
+    for host, values in sorted(stats.items()):
+        connections = values["connections_opened"]
+        requests_sent = values["requests"]
+        snapshot[host] = {
+            "requests": int(requests_sent),
+            "connections_opened": int(connections),
+            "avg_handshake_ms": round(values["handshake_seconds"] / connections * 1000, 1) if connections else None,
+            "avg_ttfb_ms": round(values["ttfb_seconds"] / requests_sent * 1000, 1) if requests_sent else None,
+        }
+    return snapshot
+
+
+def log_transport_snapshot(prefix: str = "[HTTP]") -> None:
+    for host, stats in get_transport_snapshot().items():
+        logging.info("%s %s: %s", prefix, host, stats)
+
+
+def reset_transport_stats() -> None:
+    with _stats_lock:
+        _host_stats.clear()
+
+
+def close_sessions() -> None:
+    """Close pooled sessions; used by tests and long-lived callers."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -1,18 +1,60 @@
+import argparse
+import asyncio
 import logging
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from dotenv import load_dotenv
 
 from airvisual_api import fetch_air_quality_data as fetch_airvisual_air_quality_data
 from airvisual_api import fetch_cities as fetch_airvisual_cities
+from async_engine import get_async_concurrency, run_cities_async
+from bulk_writer import finish_bulk_writer, start_bulk_writer
+from city_outcomes import build_skipped_city_outcome, build_updated_city_outcome, defer_weather_enrichment
+from http_transport import get_transport_snapshot, reset_transport_stats
+from raw_payload_store import get_raw_payload_store_snapshot, reset_raw_payload_store
+from reading_dedupe import dedupe_fetch_result, prepare_reading_dedupe
+from rate_limiter import (
+    get_rate_control_mode,
+    get_rate_limiter_snapshot,
+    reset_provider_limiters,
+    save_rate_limiter_state,
+)
+from rollups import refresh_rollups
+from scheduler import (
+    RunBudget,
+    build_deferred_city_outcome,
+    get_max_runtime_seconds,
+    order_cities_by_staleness,
+    record_outcome_latency,
+)
 from supabase_client import get_existing_cities
 from sync_cities import sync_cities
-from update_city import update_city
+from update_city import get_write_mode, update_city
 from utils import check_if_update_needed, compute_inter_city_delay, delay, setup_logging
 from waqi_api import fetch_air_quality_data as fetch_waqi_air_quality_data
-from weather_context import enrich_with_weather_context
+from waqi_api import (
+    get_shared_fetch_city_ids,
+    prepare_bounds_snapshot,
+    prepare_station_fetch_plan,
+    record_station_detail_fetched,
+    save_station_state,
+)
+from weather_cache import get_weather_cache_stats
+from weather_context import (
+    enrich_with_weather_context,
+    get_weather_cache_snapshot,
+    get_weather_health_snapshot,
+    prefetch_weather_contexts,
+)
+from weather_enrichment import (
+    drain_weather_queue,
+    get_enriched_readings,
+    is_weather_enrichment_deferred,
+    reset_weather_enrichment,
+)
 
 setup_logging()
 load_dotenv()
@@ -25,7 +67,11 @@ BASE_REQUIRED_ENV_VARS = (
 
 PROVIDER_ENV_VAR = "AIR_QUALITY_PROVIDER"
 DEFAULT_PROVIDER = "waqi"
-NON_FATAL_FETCH_ERROR_TYPES = {"station_not_mapped"}
+MAX_WORKERS_ENV_VAR = "PIPELINE_MAX_WORKERS"
+DEFAULT_MAX_WORKERS = 1
+ENGINE_ENV_VAR = "PIPELINE_ENGINE"
+ENGINES = ("sync", "async")
+DEFAULT_ENGINE = "sync"
 
 
 class PipelineRunError(RuntimeError):
@@ -41,6 +87,20 @@ def get_provider() -> str:
     return provider
 
 
+def get_max_workers() -> int:
+    raw_value = os.getenv(MAX_WORKERS_ENV_VAR, str(DEFAULT_MAX_WORKERS)).strip()
+    try:
+        max_workers = int(raw_value)
+    except ValueError:
+        max_workers = 0
+
+    if max_workers < 1:
+        raise EnvironmentError(
+            f"{MAX_WORKERS_ENV_VAR} invalido: {raw_value}. Usa un entero >= 1."
+        )
+    return max_workers
+
+
 def get_required_env(provider: str | None = None) -> dict[str, str]:
     selected_provider = provider or get_provider()
     required_env_vars = list(BASE_REQUIRED_ENV_VARS)
@@ -75,6 +135,7 @@ def build_summary(force_update: bool, provider: str) -> dict:
         "readings_inserted": 0,
         "skipped_up_to_date": 0,
         "skipped_unmapped": 0,
+        "skipped_unchanged_upstream": 0,
         "failed_updates": 0,
         "fetch_errors": 0,
         "validation_failures": 0,
@@ -82,8 +143,31 @@ def build_summary(force_update: bool, provider: str) -> dict:
         "update_errors": 0,
         "weather_context_success": 0,
         "weather_context_errors": 0,
+        "deferred_for_budget": 0,
         "city_results": [],
         "sync_summary": None,
+        "waqi_bounds": None,
+        "waqi_station_plan": None,
+        "reading_dedupe": None,
+        "weather_prefetch": None,
+        "weather_cache": None,
+        "weather_health": None,
+        "weather_enrichment": None,
+        "rollups": None,
+        "raw_payload_store": None,
+        "timing": {
+            "engine": "sequential",
+            "max_workers": 1,
+            "wall_clock_seconds": 0.0,
+            "summed_city_seconds": 0.0,
+            "rate_limits": {},
+            "max_runtime_seconds": None,
+            "p95_city_seconds": None,
+            "budget_exhausted": False,
+            "http": {},
+            "write_mode": "per_city",
+            "write_flushes": 0,
+        },
     }
 
 
@@ -107,6 +191,7 @@ def log_pipeline_summary(summary: dict) -> None:
     logging.info("Lecturas insertadas: %s", safe_summary["readings_inserted"])
     logging.info("Ciudades sin actualizar por intervalo: %s", safe_summary["skipped_up_to_date"])
     logging.info("Ciudades sin mapping WAQI: %s", safe_summary["skipped_unmapped"])
+    logging.info("Ciudades sin lectura nueva upstream: %s", safe_summary["skipped_unchanged_upstream"])
     logging.info("Updates fallidos: %s", safe_summary["failed_updates"])
     logging.info("Errores de fetch: %s", safe_summary["fetch_errors"])
     logging.info("Fallos de validacion: %s", safe_summary["validation_failures"])
@@ -114,9 +199,48 @@ def log_pipeline_summary(summary: dict) -> None:
     logging.info("Errores de update status: %s", safe_summary["update_errors"])
     logging.info("Weather context exitoso: %s", safe_summary["weather_context_success"])
     logging.info("Weather context errores: %s", safe_summary["weather_context_errors"])
+    logging.info("Ciudades diferidas por presupuesto: %s", safe_summary["deferred_for_budget"])
+
+    timing = safe_summary["timing"]
+    logging.info(
+        "Timing (%s, workers=%s): wall-clock %.2fs vs suma por ciudad %.2fs",
+        timing["engine"],
+        timing["max_workers"],
+        timing["wall_clock_seconds"],
+        timing["summed_city_seconds"],
+    )
+    for provider_name, limiter_stats in timing["rate_limits"].items():
+        logging.info("Rate limit %s: %s", provider_name, limiter_stats)
+    for host, transport_stats in timing["http"].items():
+        logging.info("HTTP %s: %s", host, transport_stats)
+    if timing["max_runtime_seconds"] is not None:
+        logging.info(
+            "Presupuesto: %ss, p95 por ciudad %ss, agotado=%s",
+            timing["max_runtime_seconds"],
+            timing["p95_city_seconds"],
+            timing["budget_exhausted"],
+        )
 
     if safe_summary.get("sync_summary") is not None:
         logging.info("Sync summary: %s", safe_summary["sync_summary"])
+    if safe_summary.get("waqi_bounds") is not None:
+        logging.info("WAQI bounds: %s", safe_summary["waqi_bounds"])
+    if safe_summary.get("waqi_station_plan") is not None:
+        logging.info("WAQI station plan: %s", safe_summary["waqi_station_plan"])
+    if safe_summary.get("reading_dedupe") is not None:
+        logging.info("Reading dedupe: %s", safe_summary["reading_dedupe"])
+    if safe_summary.get("weather_prefetch") is not None:
+        logging.info("Weather prefetch: %s", safe_summary["weather_prefetch"])
+    if safe_summary.get("weather_cache") is not None:
+        logging.info("Weather cache: %s", safe_summary["weather_cache"])
+    if safe_summary.get("weather_health") is not None:
+        logging.info("Weather health: %s", safe_summary["weather_health"])
+    if safe_summary.get("weather_enrichment") is not None:
+        logging.info("Weather enrichment: %s", safe_summary["weather_enrichment"])
+    if safe_summary.get("rollups") is not None:
+        logging.info("Rollups: %s", safe_summary["rollups"])
+    if safe_summary.get("raw_payload_store") is not None:
+        logging.info("Raw payload store: %s", safe_summary["raw_payload_store"])
 
     for city_result in safe_summary["city_results"]:
         logging.info("City result: %s", city_result)
@@ -126,7 +250,9 @@ def assert_healthy_summary(summary: dict) -> None:
     if summary["active_cities"] == 0:
         raise PipelineRunError("No hay ciudades activas para actualizar.")
 
-    if summary["updates_attempted"] > 0 and summary["readings_inserted"] == 0:
+    # Stations that published nothing new since the last run are not a failure.
+    fetched_updates = summary["updates_attempted"] - summary["skipped_unchanged_upstream"]
+    if fetched_updates > 0 and summary["readings_inserted"] == 0:
         raise PipelineRunError(
             "El pipeline intento actualizar ciudades pero no inserto ninguna lectura."
         )
@@ -139,6 +265,11 @@ def assert_healthy_summary(summary: dict) -> None:
         )
 
     if summary["updates_attempted"] == 0 and summary["skipped_up_to_date"] == 0:
+        if summary["deferred_for_budget"] > 0:
+            raise PipelineRunError(
+                "El presupuesto de ejecucion se agoto antes de procesar alguna ciudad. "
+                f"deferred_for_budget={summary['deferred_for_budget']}."
+            )
         raise PipelineRunError("El pipeline no intento ni omitio ninguna ciudad activa.")
 
 
@@ -170,135 +301,297 @@ def fetch_provider_air_quality(provider: str, city: dict, env: dict[str, str]) -
     )
 
 
-def main(force_update=False) -> dict:
-    provider = get_provider()
-    env = get_required_env(provider)
-    summary = build_summary(force_update=force_update, provider=provider)
-    logging.info("[CONFIG] Air quality provider: %s", provider)
-
-    sync_summary, updated_db_cities_list = get_cities_for_provider(provider, env)
-    summary["sync_summary"] = sync_summary
-
-    active_cities = get_active_cities(updated_db_cities_list)
-    summary["active_cities"] = len(active_cities)
-
-    consecutive_failures = 0
-
-    for city in active_cities:
-        city_started_at = time.perf_counter()
-        check_result = check_if_update_needed(city, force_update)
-
-        if check_result["needsUpdate"]:
-            logging.info("[UPDATE] Ciudad %s necesita actualizacion.", city["api_name"])
-            summary["updates_attempted"] += 1
-
-            fetch_result = fetch_provider_air_quality(provider, city, env)
-            fetch_result["city_id"] = city["id"]
-            fetch_result = enrich_with_weather_context(
-                fetch_result,
-                canonical_lat=city.get("latitude"),
-                canonical_lon=city.get("longitude"),
-            )
-            weather_context = fetch_result.get("weather_context") or {}
-            if weather_context.get("status") == "success":
-                summary["weather_context_success"] += 1
-            elif weather_context:
-                summary["weather_context_errors"] += 1
-
-            update_result = update_city(fetch_or_skip_result=fetch_result)
-            successful_insert = (
-                fetch_result.get("status") == "success"
-                and update_result.get("readingInserted")
-                and not update_result.get("insertError")
-                and not update_result.get("updateError")
-                and not update_result.get("validationErrors")
-            )
-
-            if successful_insert:
-                consecutive_failures = 0
-                summary["readings_inserted"] += 1
-                logging.info("[OK] Update realizado para %s: %s", city["api_name"], update_result)
-            else:
-                error_type = fetch_result.get("errorType")
-                non_fatal_fetch_error = error_type in NON_FATAL_FETCH_ERROR_TYPES
-
-                if non_fatal_fetch_error:
-                    summary["skipped_unmapped"] += 1
-                    consecutive_failures = 0
-                    logging.warning(
-                        "[NEEDS_MAPPING] Ciudad %s sin mapping verificado: %s",
-                        city["api_name"],
-                        update_result,
-                    )
-                else:
-                    consecutive_failures += 1
-                    summary["failed_updates"] += 1
-
-                if fetch_result.get("status") == "error" and not non_fatal_fetch_error:
-                    summary["fetch_errors"] += 1
-                if update_result.get("validationErrors"):
-                    summary["validation_failures"] += 1
-                if update_result.get("insertError"):
-                    summary["insert_errors"] += 1
-                if update_result.get("updateError"):
-                    summary["update_errors"] += 1
-
-                if not non_fatal_fetch_error:
-                    logging.warning("[WARN] Update con alertas para %s: %s", city["api_name"], update_result)
-
-            record_city_result(
-                summary,
-                city,
-                {
-                    "needed_update": True,
-                    "fetch_status": fetch_result.get("status"),
-                    "fetch_error_type": fetch_result.get("errorType"),
-                    "weather_context_status": weather_context.get("status"),
-                    "weather_context_error_type": weather_context.get("errorType"),
-                    "reading_inserted": bool(update_result.get("readingInserted")),
-                    "city_status_updated": bool(update_result.get("cityStatusUpdated")),
-                    "insert_error": update_result.get("insertError"),
-                    "update_error": update_result.get("updateError"),
-                    "validation_errors": update_result.get("validationErrors"),
-                },
+def finalize_city_outcomes(outcomes: list[dict]) -> list[dict]:
+    """Flush the bulk writer and reclassify outcomes whose writes were queued."""
+    if not any("pending_write" in outcome for outcome in outcomes):
+        return outcomes
+
+    finish_bulk_writer()
+    finalized = []
+    for outcome in outcomes:
+        pending = outcome.get("pending_write")
+        if pending is None:
+            finalized.append(outcome)
+            continue
+        finalized.append(
+            build_updated_city_outcome(
+                outcome["city"],
+                pending["fetch_result"],
+                pending["update_result"],
+                city_started_at=0.0,
+                elapsed_seconds=outcome["elapsed_seconds"],
             )
-        else:
-            logging.info("[SKIP] Ciudad %s no necesita actualizacion.", city["api_name"])
-            summary["skipped_up_to_date"] += 1
-            consecutive_failures = 0
-            record_city_result(
-                summary,
-                city,
-                {
-                    "needed_update": False,
-                    "reason": check_result.get("errorMessage") or "up_to_date",
-                },
+        )
+    return finalized
+
+
+def process_city(
+    provider: str,
+    city: dict,
+    env: dict[str, str],
+    force_update: bool,
+    budget: RunBudget | None = None,
+) -> dict:
+    """Run check -> fetch -> weather -> write for one city without touching the summary.
+
+    Returns an outcome that `apply_city_outcome` folds into the run summary.
+    The run budget only defers cities that need an update; up-to-date cities
+    are still reported as skipped.
+    """
+    city_started_at = time.perf_counter()
+    check_result = check_if_update_needed(city, force_update)
+    if not check_result["needsUpdate"]:
+        return build_skipped_city_outcome(city, check_result, city_started_at)
+    if budget is not None and not budget.can_start_city():
+        return build_deferred_city_outcome(city)
+
+    logging.info("[UPDATE] Ciudad %s necesita actualizacion.", city["api_name"])
+    fetch_result = fetch_provider_air_quality(provider, city, env)
+    fetch_result["city_id"] = city["id"]
+    fetch_result = dedupe_fetch_result(fetch_result)
+    deferred_weather = is_weather_enrichment_deferred()
+    if not deferred_weather:
+        fetch_result = enrich_with_weather_context(
+            fetch_result,
+            canonical_lat=city.get("latitude"),
+            canonical_lon=city.get("longitude"),
+        )
+    update_result = update_city(fetch_or_skip_result=fetch_result)
+    if deferred_weather:
+        defer_weather_enrichment(city, fetch_result, update_result)
+    return build_updated_city_outcome(city, fetch_result, update_result, city_started_at)
+
+
+def process_city_within_budget(
+    budget: RunBudget,
+    provider: str,
+    city: dict,
+    env: dict[str, str],
+    force_update: bool,
+) -> dict:
+    """Defer the city when it needs an update the run budget cannot cover."""
+    outcome = process_city(provider, city, env, force_update, budget)
+    record_outcome_latency(budget, outcome)
+    return outcome
+
+
+def apply_city_outcome(summary: dict, outcome: dict) -> None:
+    for counter_name, increment in outcome["counters"].items():
+        summary[counter_name] += increment
+    summary["timing"]["summed_city_seconds"] += outcome["elapsed_seconds"]
+    record_city_result(summary, outcome["city"], outcome["result"])
+
+    # Bounds mode may skip a station next run only once its reading is stored,
+    # so a failed or still-queued write is fetched again.
+    result = outcome["result"]
+    stored = outcome["counters"].get("readings_inserted") or (
+        result.get("fetch_status") == "success" and outcome["counters"].get("skipped_unchanged_upstream")
+    )
+    if stored and result.get("provider_station_id"):
+        record_station_detail_fetched(result["provider_station_id"])
+
+
+def run_cities_sequentially(
+    provider: str,
+    cities: list[dict],
+    env: dict[str, str],
+    force_update: bool,
+    summary: dict,
+    budget: RunBudget | None = None,
+) -> None:
+    run_budget = budget or RunBudget(None)
+    # With adaptive rate control the provider limiters pace every HTTP call, so
+    # the legacy 8-15s inter-city sleep only applies in PIPELINE_RATE_CONTROL=fixed.
+    fixed_inter_city_delay = get_rate_control_mode() == "fixed"
+    consecutive_failures = 0
+    outcomes = []
+
+    for city in cities:
+        outcome = process_city_within_budget(run_budget, provider, city, env, force_update)
+        outcomes.append(outcome)
+        if outcome["result"].get("deferred"):
+            continue
+        consecutive_failures = consecutive_failures + 1 if outcome["fatal_failure"] else 0
+
+        # A city served from a shared station fetch made no provider call.
+        if not fixed_inter_city_delay or outcome["result"].get("shared_fetch_city_id") is not None:
+            logging.info(
+                "[TIMING] Ciudad %s procesada en %.2fs (fallos consecutivos: %s).",
+                city["api_name"],
+                outcome["elapsed_seconds"],
+                consecutive_failures,
             )
+            continue
 
         inter_city_delay = compute_inter_city_delay(consecutive_failures)
-        elapsed_city = time.perf_counter() - city_started_at
         logging.info(
             "[TIMING] Ciudad %s procesada en %.2fs. Esperando %.1fs antes de la "
             "siguiente (fallos consecutivos: %s).",
             city["api_name"],
-            elapsed_city,
+            outcome["elapsed_seconds"],
             inter_city_delay,
             consecutive_failures,
         )
         delay(inter_city_delay)
 
+    for outcome in finalize_city_outcomes(outcomes):
+        apply_city_outcome(summary, outcome)
+
+
+def run_cities_concurrently(
+    provider: str,
+    cities: list[dict],
+    env: dict[str, str],
+    force_update: bool,
+    summary: dict,
+    max_workers: int,
+    budget: RunBudget | None = None,
+) -> None:
+    """Process cities on a thread pool; provider pacing comes from rate_limiter."""
+    run_budget = budget or RunBudget(None)
+    # The budget is checked when a worker picks a city up, not at submit time,
+    # so deferral reflects the latencies observed while the pool was running.
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="city") as executor:
+        outcomes = list(
+            executor.map(
+                lambda city: process_city_within_budget(run_budget, provider, city, env, force_update),
+                cities,
+            )
+        )
+
+    # executor.map preserves input order, so city_results match the sequential run.
+    for outcome in finalize_city_outcomes(outcomes):
+        apply_city_outcome(summary, outcome)
+        logging.info(
+            "[TIMING] Ciudad %s procesada en %.2fs.",
+            outcome["city"]["api_name"],
+            outcome["elapsed_seconds"],
+        )
+
+
+def main(
+    force_update=False,
+    max_workers: int | None = None,
+    engine: str = DEFAULT_ENGINE,
+    max_runtime_seconds: float | None = None,
+) -> dict:
+    run_started_at = time.perf_counter()
+    provider = get_provider()
+    env = get_required_env(provider)
+    if engine not in ENGINES:
+        raise EnvironmentError(f"Engine no soportado: {engine}. Usa {' o '.join(ENGINES)}.")
+    if max_runtime_seconds is None:
+        max_runtime_seconds = get_max_runtime_seconds()
+    elif max_runtime_seconds <= 0:
+        raise EnvironmentError(f"--max-runtime invalido: {max_runtime_seconds}. Usa segundos > 0.")
+    budget = RunBudget(max_runtime_seconds, started_at=run_started_at)
+
+    summary = build_summary(force_update=force_update, provider=provider)
+    logging.info("[CONFIG] Air quality provider: %s", provider)
+
+    sync_summary, updated_db_cities_list = get_cities_for_provider(provider, env)
+    summary["sync_summary"] = sync_summary
+
+    active_cities = order_cities_by_staleness(get_active_cities(updated_db_cities_list))
+    summary["active_cities"] = len(active_cities)
+    if max_runtime_seconds is not None:
+        logging.info("[CONFIG] Presupuesto de ejecucion: %ss", max_runtime_seconds)
+
+    reset_provider_limiters()
+    reset_transport_stats()
+    reset_raw_payload_store()
+    reset_weather_enrichment()
+    write_mode = get_write_mode()
+    summary["timing"]["write_mode"] = write_mode
+    bulk_writer = start_bulk_writer(active_cities) if write_mode == "bulk" else None
+    if provider == "waqi":
+        summary["waqi_bounds"] = prepare_bounds_snapshot(env["WAQI_API_TOKEN"], force_update)
+        summary["waqi_station_plan"] = prepare_station_fetch_plan(active_cities)
+    summary["reading_dedupe"] = prepare_reading_dedupe()
+    if not is_weather_enrichment_deferred():
+        # One multi-location Open-Meteo request instead of one per city. In
+        # deferred mode the drain loads weather after the writes instead.
+        summary["weather_prefetch"] = prefetch_weather_contexts(active_cities)
+
+    if engine == "async":
+        concurrency = get_async_concurrency()
+        summary["timing"]["engine"] = "async"
+        summary["timing"]["max_workers"] = concurrency
+        logging.info("[CONFIG] Engine async, concurrencia: %s", concurrency)
+        outcomes = asyncio.run(
+            run_cities_async(provider, active_cities, env, force_update, concurrency, budget)
+        )
+        for outcome in finalize_city_outcomes(outcomes):
+            apply_city_outcome(summary, outcome)
+    else:
+        workers = max_workers if max_workers is not None else get_max_workers()
+        summary["timing"]["engine"] = "threaded" if workers > 1 else "sequential"
+        summary["timing"]["max_workers"] = workers
+        logging.info("[CONFIG] Workers: %s", workers)
+        if workers > 1:
+            run_cities_concurrently(provider, active_cities, env, force_update, summary, workers, budget)
+        else:
+            run_cities_sequentially(provider, active_cities, env, force_update, summary, budget)
+
+    if bulk_writer is not None:
+        finish_bulk_writer()
+        summary["timing"]["write_flushes"] = bulk_writer.flushes
+    # Weather for readings written without it; before the rollups, which average it.
+    summary["weather_enrichment"] = drain_weather_queue()
+    # Recompute only the hourly/daily rollup buckets touched by this run.
+    summary["rollups"] = refresh_rollups(summary["city_results"], extra_readings=get_enriched_readings())
+    summary["raw_payload_store"] = get_raw_payload_store_snapshot()
+    summary["weather_cache"] = {**get_weather_cache_snapshot(), "disk": get_weather_cache_stats()}
+    summary["weather_health"] = get_weather_health_snapshot()
+    if summary["waqi_station_plan"] is not None:
+        summary["waqi_station_plan"]["shared_fetch_city_ids"] = get_shared_fetch_city_ids()
+    summary["timing"]["wall_clock_seconds"] = time.perf_counter() - run_started_at
+    summary["timing"]["rate_limits"] = get_rate_limiter_snapshot()
+    summary["timing"]["http"] = get_transport_snapshot()
+    summary["timing"].update(budget.snapshot())
+    save_rate_limiter_state()
+    save_station_state()
+
     log_pipeline_summary(summary)
     assert_healthy_summary(summary)
     return summary
 
 
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pipeline de calidad del aire MtyRespira.")
+    parser.add_argument(
+        "--force-update",
+        action="store_true",
+        help="Actualiza todas las ciudades activas sin revisar el intervalo.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=os.getenv(ENGINE_ENV_VAR, DEFAULT_ENGINE),
+        help="sync usa secuencial/thread pool (PIPELINE_MAX_WORKERS); async usa asyncio.",
+    )
+    parser.add_argument(
+        "--max-runtime",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Presupuesto de ejecucion; difiere ciudades que no alcanzan a procesarse "
+        "(default: PIPELINE_MAX_RUNTIME_SECONDS o sin limite).",
+    )
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    force_update_enabled = "--force-update" in sys.argv
+    args = parse_args()
 
     try:
-        main(force_update=force_update_enabled)
+        main(
+            force_update=args.force_update,
+            engine=args.engine,
+            max_runtime_seconds=args.max_runtime,
+        )
     except Exception as error:
         logging.exception("[FAIL] Pipeline terminado con error operativo: %s", error)
         sys.exit(1)
 
-    logging.info("\n[DONE] Pipeline terminado exitosamente.\n")
\ No newline at end of file
+    logging.info("\n[DONE] Pipeline terminado exitosamente.\n")
@@ -0,0 +1,349 @@
+"""Per-provider token buckets shared by every worker of a run.
+
+Each provider (`waqi`, `open-meteo`, `airvisual`) gets one `TokenBucket`. With
+`PIPELINE_RATE_CONTROL=adaptive` (the default) its rate follows AIMD: it grows
+by a small step after each fast 2xx, halves on 429, 5xx or transport errors and
+honours `Retry-After`, always between the provider's min and max rate. The
+learned rates are saved to `.pipeline_state/rate_limits.json`
+(`PIPELINE_RATE_STATE_PATH`) at the end of a run, and the next run starts from
+them. `fixed` keeps the configured rate for the whole run and neither reads nor
+writes that file. `PIPELINE_RATE_LIMIT_<PROVIDER>` and
+`PIPELINE_RATE_BURST_<PROVIDER>` override the starting rate and burst.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from utils import async_delay, delay
+
+# Conservative starting points: WAQI and Open-Meteo tolerate far more than the
+# pipeline needs, AirVisual community keys are limited to a few calls/minute.
+# The adaptive controller moves each rate between min and max at runtime.
+DEFAULT_PROVIDER_RATES = {
+    "waqi": {"rate_per_second": 1.0, "burst": 2, "min_rate": 0.2, "max_rate": 5.0},
+    "open-meteo": {"rate_per_second": 2.0, "burst": 4, "min_rate": 0.2, "max_rate": 10.0},
+    "airvisual": {"rate_per_second": 0.1, "burst": 1, "min_rate": 0.02, "max_rate": 0.2},
+}
+RATE_ENV_PREFIX = "PIPELINE_RATE_LIMIT_"
+BURST_ENV_PREFIX = "PIPELINE_RATE_BURST_"
+RATE_CONTROL_ENV_VAR = "PIPELINE_RATE_CONTROL"
+RATE_CONTROL_MODES = ("adaptive", "fixed")
+DEFAULT_RATE_CONTROL = "adaptive"
+RATE_STATE_PATH_ENV_VAR = "PIPELINE_RATE_STATE_PATH"
+DEFAULT_RATE_STATE_PATH = Path(".pipeline_state") / "rate_limits.json"
+
+# AIMD tuning: grow by a small slice of the allowed range after each fast 2xx,
+# halve on 429/5xx/transport errors, and honour Retry-After up to a cap.
+FAST_RESPONSE_SECONDS = 2.0
+ADDITIVE_INCREASE_FRACTION = 0.05
+MULTIPLICATIVE_DECREASE = 0.5
+MAX_RETRY_AFTER_SECONDS = 120.0
+
+_limiters: dict[str, "TokenBucket"] = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Thread-safe AIMD token bucket shared by every worker calling one provider.
+
+    Each `acquire` reserves a token immediately and sleeps only for the deficit,
+    so concurrent callers queue fairly without spinning on the lock. Callers
+    report each response back so the rate grows while the provider answers 2xx
+    quickly and backs off only when it throttles or fails.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_per_second: float,
+        burst: int,
+        min_rate: float | None = None,
+        max_rate: float | None = None,
+    ):
+        if rate_per_second <= 0:
+            raise ValueError(f"rate_per_second debe ser > 0 para {name}.")
+        if burst < 1:
+            raise ValueError(f"burst debe ser >= 1 para {name}.")
+
+        self.name = name
+        self.min_rate = float(min_rate if min_rate is not None else rate_per_second)
+        self.max_rate = float(max_rate if max_rate is not None else rate_per_second)
+        if self.min_rate <= 0 or self.min_rate > self.max_rate:
+            raise ValueError(f"Rango de rate invalido para {name}: {self.min_rate}..{self.max_rate}.")
+
+        self.rate_per_second = min(max(float(rate_per_second), self.min_rate), self.max_rate)
+        self.burst = int(burst)
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.total_wait_seconds = 0.0
+        self.successes = 0
+        self.throttles = 0
+
+    @property
+    def adaptive(self) -> bool:
+        return self.max_rate > self.min_rate
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(now - self._updated_at, 0.0)
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate_per_second)
+        self._updated_at = now
+
+    def _reserve(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            wait_seconds = 0.0 if self._tokens >= 0 else -self._tokens / self.rate_per_second
+            self.acquired += 1
+            self.total_wait_seconds += wait_seconds
+        return wait_seconds
+
+    def acquire(self) -> float:
+        wait_seconds = self._reserve()
+        if wait_seconds > 0:
+            logging.debug("[RATE] %s esperando %.2fs por token.", self.name, wait_seconds)
+            delay(wait_seconds)
+        return wait_seconds
+
+    async def acquire_async(self) -> float:
+        wait_seconds = self._reserve()
+        if wait_seconds > 0:
+            logging.debug("[RATE] %s esperando %.2fs por token (async).", self.name, wait_seconds)
+            await async_delay(wait_seconds)
+        return wait_seconds
+
+    def record_success(self, elapsed_seconds: float | None = None) -> None:
+        with self._lock:
+            self.successes += 1
+            if not self.adaptive:
+                return
+            if elapsed_seconds is not None and elapsed_seconds > FAST_RESPONSE_SECONDS:
+                return
+            self._refill(time.monotonic())
+            step = (self.max_rate - self.min_rate) * ADDITIVE_INCREASE_FRACTION
+            self.rate_per_second = min(self.max_rate, self.rate_per_second + step)
+
+    def record_throttle(self, retry_after_seconds: float | None = None) -> None:
+        with self._lock:
+            self.throttles += 1
+            self._refill(time.monotonic())
+            if self.adaptive:
+                self.rate_per_second = max(self.min_rate, self.rate_per_second * MULTIPLICATIVE_DECREASE)
+            if retry_after_seconds:
+                pause = min(retry_after_seconds, MAX_RETRY_AFTER_SECONDS)
+                # Next token becomes available exactly `pause` seconds from now.
+                self._tokens = min(self._tokens, 1 - pause * self.rate_per_second)
+            rate = self.rate_per_second
+
+        logging.warning(
+            "[RATE] %s throttled (retry_after=%s). Nuevo rate: %.3f req/s.",
+            self.name,
+            retry_after_seconds,
+            rate,
+        )
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "rate_per_second": round(self.rate_per_second, 4),
+                "min_rate": self.min_rate,
+                "max_rate": self.max_rate,
+                "burst": self.burst,
+                "acquired": self.acquired,
+                "successes": self.successes,
+                "throttles": self.throttles,
+                "wait_seconds": round(self.total_wait_seconds, 3),
+            }
+
+
+def _env_key(provider: str) -> str:
+    return provider.upper().replace("-", "_")
+
+
+def get_rate_control_mode() -> str:
+    mode = os.getenv(RATE_CONTROL_ENV_VAR, DEFAULT_RATE_CONTROL).strip().lower()
+    if mode not in RATE_CONTROL_MODES:
+        raise EnvironmentError(
+            f"{RATE_CONTROL_ENV_VAR} invalido: {mode}. Usa {' o '.join(RATE_CONTROL_MODES)}."
+        )
+    return mode
+
+
+def get_rate_state_path() -> Path:
+    return Path(os.getenv(RATE_STATE_PATH_ENV_VAR) or DEFAULT_RATE_STATE_PATH)
+
+
+def load_rate_state(path: Path | None = None) -> dict[str, dict[str, Any]]:
+    state_path = path or get_rate_state_path()
+    try:
+        payload = json.loads(state_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        logging.warning("[RATE] Ignorando estado de rate limits ilegible %s: %s", state_path, error)
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def get_provider_rate_config(provider: str) -> dict[str, float | int]:
+    defaults = DEFAULT_PROVIDER_RATES.get(provider, {"rate_per_second": 1.0, "burst": 1})
+    raw_rate = os.getenv(f"{RATE_ENV_PREFIX}{_env_key(provider)}")
+    raw_burst = os.getenv(f"{BURST_ENV_PREFIX}{_env_key(provider)}")
+
+    try:
+        rate_per_second = float(raw_rate) if raw_rate else float(defaults["rate_per_second"])
+        burst = int(raw_burst) if raw_burst else int(defaults["burst"])
+    except ValueError as error:
+        raise EnvironmentError(
+            f"Configuracion de rate limit invalida para {provider}: {error}"
+        ) from error
+
+    config: dict[str, float | int] = {"rate_per_second": rate_per_second, "burst": burst}
+    if get_rate_control_mode() == "fixed":
+        config["min_rate"] = config["max_rate"] = rate_per_second
+        return config
+
+    config["min_rate"] = min(float(defaults.get("min_rate", rate_per_second)), rate_per_second)
+    config["max_rate"] = max(float(defaults.get("max_rate", rate_per_second)), rate_per_second)
+    if not raw_rate:
+        learned_rate = load_rate_state().get(provider, {}).get("rate_per_second")
+        if isinstance(learned_rate, (int, float)) and learned_rate > 0:
+            config["rate_per_second"] = float(learned_rate)
+    return config
+
+
+def get_provider_limiter(provider: str) -> TokenBucket:
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            config = get_provider_rate_config(provider)
+            limiter = TokenBucket(
+                provider,
+                config["rate_per_second"],
+                config["burst"],
+                min_rate=config.get("min_rate"),
+                max_rate=config.get("max_rate"),
+            )
+            _limiters[provider] = limiter
+        return limiter
+
+
+def acquire_provider_token(provider: str) -> float:
+    return get_provider_limiter(provider).acquire()
+
+
+async def acquire_provider_token_async(provider: str) -> float:
+    return await get_provider_limiter(provider).acquire_async()
+
+
+def parse_retry_after(value: Any) -> float | None:
+    """Parse a Retry-After header given as delta-seconds or an HTTP-date."""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    clean_value = value.strip()
+    try:
+        return max(float(clean_value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(clean_value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def record_provider_response(
+    provider: str,
+    status_code: Any,
+    elapsed_seconds: float | None = None,
+    retry_after: Any = None,
+) -> None:
+    """Feed an HTTP outcome into the provider's adaptive rate controller."""
+    limiter = get_provider_limiter(provider)
+    retry_after_seconds = parse_retry_after(retry_after)
+    if not isinstance(status_code, int):
+        return
+    if status_code == 429 or 500 <= status_code <= 599:
+        limiter.record_throttle(retry_after_seconds)
+    elif 200 <= status_code <= 299:
+        limiter.record_success(elapsed_seconds)
+
+
+def record_provider_failure(provider: str) -> None:
+    """Timeouts and connection errors count as a throttle signal."""
+    get_provider_limiter(provider).record_throttle()
+
+
+def call_with_rate_control(provider: str, send: Callable[[], Any]) -> Any:
+    """Acquire a token, run one HTTP call and report its outcome to the limiter."""
+    acquire_provider_token(provider)
+    started_at = time.perf_counter()
+    try:
+        response = send()
+    except Exception:
+        record_provider_failure(provider)
+        raise
+    record_provider_response(
+        provider,
+        response.status_code,
+        time.perf_counter() - started_at,
+        response.headers.get("Retry-After"),
+    )
+    return response
+
+
+async def call_with_rate_control_async(provider: str, send: Callable[[], Awaitable[Any]]) -> Any:
+    await acquire_provider_token_async(provider)
+    started_at = time.perf_counter()
+    try:
+        response = await send()
+    except Exception:
+        record_provider_failure(provider)
+        raise
+    record_provider_response(
+        provider,
+        response.status_code,
+        time.perf_counter() - started_at,
+        response.headers.get("Retry-After"),
+    )
+    return response
+
+
+def get_rate_limiter_snapshot() -> dict[str, dict[str, Any]]:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.snapshot() for name, limiter in sorted(limiters.items())}
+
+
+def save_rate_limiter_state(path: Path | None = None) -> None:
+    """Persist learned adaptive rates so the next run starts where this one ended."""
+    if get_rate_control_mode() != "adaptive":
+        return
+
+    state_path = path or get_rate_state_path()
+    state = load_rate_state(state_path)
+    updated_at = datetime.now(timezone.utc).isoformat()
+    for provider, snapshot in get_rate_limiter_snapshot().items():
+        state[provider] = {"rate_per_second": snapshot["rate_per_second"], "updated_at": updated_at}
+
+    try:
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        state_path.write_text(json.dumps(state, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    except OSError as error:
+        logging.warning("[RATE] No se pudo guardar estado de rate limits en %s: %s", state_path, error)
+
+
+def reset_provider_limiters() -> None:
+    """Drop shared limiter state; used between runs and by tests."""
+    with _limiters_lock:
+        _limiters.clear()
@@ -0,0 +1,152 @@
+"""Content-addressed storage of raw provider payloads.
+
+With `PIPELINE_RAW_PAYLOAD_STORE=hashed`, a reading's `raw_api_response` is
+keyed by `utils.canonical_json_sha256` and stored once in `raw_payloads`; the
+reading row carries `raw_payload_hash` instead of the jsonb. Payloads already
+stored, by this run or an earlier one, are not sent again: hashes written or
+found this run are remembered in-process and the rest are looked up with one
+`select hash` before the insert.
+
+If `raw_payloads` cannot be read or written the readings keep their inline
+`raw_api_response`, so a payload store problem never loses a reading.
+"""
+
+import logging
+import os
+import threading
+from typing import Any
+
+from postgrest.types import ReturnMethod
+
+from utils import canonical_json_sha256
+
+RAW_PAYLOAD_STORE_ENV_VAR = "PIPELINE_RAW_PAYLOAD_STORE"
+RAW_PAYLOAD_STORE_MODES = ("hashed", "inline")
+DEFAULT_RAW_PAYLOAD_STORE_MODE = "hashed"
+RAW_PAYLOADS_TABLE = "raw_payloads"
+
+_known_hashes_lock = threading.Lock()
+_known_hashes: set[str] = set()
+_stats = {"payloads_sent": 0, "payloads_reused": 0, "store_errors": 0}
+
+
+def get_raw_payload_store_mode() -> str:
+    mode = os.getenv(RAW_PAYLOAD_STORE_ENV_VAR, DEFAULT_RAW_PAYLOAD_STORE_MODE).strip().lower()
+    if mode not in RAW_PAYLOAD_STORE_MODES:
+        raise EnvironmentError(
+            f"{RAW_PAYLOAD_STORE_ENV_VAR} invalido: {mode}. Usa {' o '.join(RAW_PAYLOAD_STORE_MODES)}."
+        )
+    return mode
+
+
+def reset_raw_payload_store() -> None:
+    with _known_hashes_lock:
+        _known_hashes.clear()
+        for key in _stats:
+            _stats[key] = 0
+
+
+def get_raw_payload_store_snapshot() -> dict[str, Any]:
+    with _known_hashes_lock:
+        return {"mode": get_raw_payload_store_mode(), **_stats}
+
+
+def hash_reading_payloads(readings: list[dict]) -> dict[str, Any]:
+    """{hash: payload} for readings that still embed `raw_api_response`."""
+    payload_by_hash = {}
+    for reading in readings:
+        payload = reading.get("raw_api_response")
+        if payload is not None:
+            payload_by_hash[canonical_json_sha256(payload)] = payload
+    return payload_by_hash
+
+
+def get_unknown_hashes(payload_by_hash: dict[str, Any]) -> list[str]:
+    with _known_hashes_lock:
+        return sorted(hash_value for hash_value in payload_by_hash if hash_value not in _known_hashes)
+
+
+def build_payload_rows(payload_by_hash: dict[str, Any], unknown: list[str], stored_rows: Any) -> list[dict]:
+    stored = {row.get("hash") for row in stored_rows or [] if isinstance(row, dict)}
+    return [
+        {"hash": hash_value, "payload": payload_by_hash[hash_value]}
+        for hash_value in unknown
+        if hash_value not in stored
+    ]
+
+
+def apply_payload_hashes(readings: list[dict], payload_by_hash: dict[str, Any], sent: int) -> None:
+    """Swap inline payloads for their hash once every hash is stored."""
+    with _known_hashes_lock:
+        _known_hashes.update(payload_by_hash)
+        _stats["payloads_sent"] += sent
+        _stats["payloads_reused"] += len(payload_by_hash) - sent
+    for reading in readings:
+        payload = reading.get("raw_api_response")
+        if payload is not None:
+            reading["raw_payload_hash"] = canonical_json_sha256(payload)
+            reading["raw_api_response"] = None
+
+
+def record_store_error(error: Exception) -> None:
+    with _known_hashes_lock:
+        _stats["store_errors"] += 1
+    logging.warning(
+        "[RAW] No se pudo guardar en %s; se mantiene raw_api_response inline: %s",
+        RAW_PAYLOADS_TABLE,
+        error,
+    )
+
+
+def store_raw_payloads(readings: list[dict], supabase: Any) -> None:
+    """Store new payloads of `readings` in `raw_payloads` and reference them by hash."""
+    if get_raw_payload_store_mode() == "inline":
+        return
+    payload_by_hash = hash_reading_payloads(readings)
+    if not payload_by_hash:
+        return
+
+    rows: list[dict] = []
+    try:
+        unknown = get_unknown_hashes(payload_by_hash)
+        if unknown:
+            response = supabase.table(RAW_PAYLOADS_TABLE).select("hash").in_("hash", unknown).execute()
+            rows = build_payload_rows(payload_by_hash, unknown, response.data)
+        if rows:
+            supabase.table(RAW_PAYLOADS_TABLE).upsert(
+                rows,
+                on_conflict="hash",
+                ignore_duplicates=True,
+                returning=ReturnMethod.minimal,
+            ).execute()
+    except Exception as error:
+        record_store_error(error)
+        return
+    apply_payload_hashes(readings, payload_by_hash, len(rows))
+
+
+async def store_raw_payloads_async(readings: list[dict], supabase: Any) -> None:
+    """Async twin of `store_raw_payloads` for the shared async Supabase client."""
+    if get_raw_payload_store_mode() == "inline":
+        return
+    payload_by_hash = hash_reading_payloads(readings)
+    if not payload_by_hash:
+        return
+
+    rows: list[dict] = []
+    try:
+        unknown = get_unknown_hashes(payload_by_hash)
+        if unknown:
+            response = await supabase.table(RAW_PAYLOADS_TABLE).select("hash").in_("hash", unknown).execute()
+            rows = build_payload_rows(payload_by_hash, unknown, response.data)
+        if rows:
+            await supabase.table(RAW_PAYLOADS_TABLE).upsert(
+                rows,
+                on_conflict="hash",
+                ignore_duplicates=True,
+                returning=ReturnMethod.minimal,
+            ).execute()
+    except Exception as error:
+        record_store_error(error)
+        return
+    apply_payload_hashes(readings, payload_by_hash, len(rows))
@@ -0,0 +1,132 @@
+"""Skip writes for readings that are already stored.
+
+WAQI stations publish hourly, so re-runs, `--force-update` and lagging
+stations often return a `reading_timestamp_iso` we already inserted. At run
+start the latest stored `reading_timestamp` per city is loaded in one RPC call;
+a fetched reading that is not newer becomes a `skipped: unchanged_upstream`
+result instead of a duplicate row.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any
+
+from supabase_client import get_supabase_client
+
+DEDUPE_ENV_VAR = "PIPELINE_READING_DEDUPE"
+DEDUPE_MODES = ("on", "off")
+DEFAULT_DEDUPE_MODE = "on"
+LATEST_READINGS_RPC_NAME = "get_latest_air_quality_per_city"
+
+_latest_lock = threading.Lock()
+# None means dedupe is disabled for this run (mode off or the load failed).
+_latest_reading_timestamps: dict[int, datetime] | None = None
+
+
+def get_dedupe_mode() -> str:
+    mode = os.getenv(DEDUPE_ENV_VAR, DEFAULT_DEDUPE_MODE).strip().lower()
+    if mode not in DEDUPE_MODES:
+        raise EnvironmentError(f"{DEDUPE_ENV_VAR} invalido: {mode}. Usa {' o '.join(DEDUPE_MODES)}.")
+    return mode
+
+
+def parse_reading_timestamp(value: Any) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def parse_latest_readings(rows: Any) -> dict[int, datetime] | None:
+    if not isinstance(rows, list):
+        return None
+
+    latest = {}
+    for row in rows:
+        if not isinstance(row, dict) or row.get("city_id") is None:
+            continue
+        timestamp = parse_reading_timestamp(row.get("reading_timestamp"))
+        if timestamp is not None:
+            latest[row["city_id"]] = timestamp
+    return latest
+
+
+def prepare_reading_dedupe(supabase: Any = None) -> dict[str, Any]:
+    """Load the latest stored reading timestamp per city once per run.
+
+    If the load fails, dedupe is disabled and every fetched reading is written
+    as before.
+    """
+    global _latest_reading_timestamps
+
+    mode = get_dedupe_mode()
+    with _latest_lock:
+        _latest_reading_timestamps = None
+    if mode == "off":
+        return {"mode": mode, "status": "disabled"}
+
+    try:
+        client = supabase or get_supabase_client()
+        response = client.rpc(LATEST_READINGS_RPC_NAME).execute()
+    except Exception as error:
+        logging.error("[DEDUPE] No se pudieron cargar las ultimas lecturas; dedupe desactivado: %s", error)
+        return {"mode": mode, "status": "fetch_failed", "error": str(error)}
+
+    latest = parse_latest_readings(response.data)
+    if latest is None:
+        logging.warning("[DEDUPE] Respuesta invalida de %s; dedupe desactivado.", LATEST_READINGS_RPC_NAME)
+        return {"mode": mode, "status": "invalid_payload"}
+
+    with _latest_lock:
+        _latest_reading_timestamps = latest
+    logging.info("[DEDUPE] Ultima lectura cargada para %s ciudades.", len(latest))
+    return {"mode": mode, "status": "success", "cities": len(latest)}
+
+
+def get_latest_stored_timestamp(city_id: int) -> datetime | None:
+    with _latest_lock:
+        if _latest_reading_timestamps is None:
+            return None
+        return _latest_reading_timestamps.get(city_id)
+
+
+def dedupe_fetch_result(fetch_result: dict) -> dict:
+    """Turn a successful fetch into `skipped: unchanged_upstream` when it is not newer."""
+    if fetch_result.get("status") != "success":
+        return fetch_result
+
+    stored = get_latest_stored_timestamp(fetch_result.get("city_id"))
+    fetched = parse_reading_timestamp(fetch_result.get("reading_timestamp_iso"))
+    if stored is None or fetched is None or fetched > stored:
+        return fetch_result
+
+    logging.info(
+        "[DEDUPE] City ID %s: lectura %s no es mas nueva que la almacenada (%s); sin insert.",
+        fetch_result.get("city_id"),
+        fetched.isoformat(),
+        stored.isoformat(),
+    )
+    return {
+        "city_id": fetch_result.get("city_id"),
+        "status": "skipped",
+        "municipio": fetch_result.get("municipio"),
+        "api_name_used": fetch_result.get("api_name_used"),
+        "provider": fetch_result.get("provider"),
+        "provider_station_id": fetch_result.get("provider_station_id"),
+        "skipReason": "unchanged_upstream",
+        "upstream_timestamp_iso": fetch_result.get("reading_timestamp_iso"),
+    }
+
+
+def reset_reading_dedupe() -> None:
+    global _latest_reading_timestamps
+
+    with _latest_lock:
+        _latest_reading_timestamps = None
@@ -0,0 +1,127 @@
+"""End-of-run refresh of the hourly/daily AQI rollup tables.
+
+After all cities are written, `main` sends the (city_id, reading_timestamp)
+pairs inserted by this run to `refresh_air_quality_rollups`, which recomputes
+only the `air_quality_hourly` / `air_quality_daily` buckets containing them.
+A failed refresh is logged and reported in the summary without failing the
+run. Its pairs are kept in `.pipeline_state/rollups_pending.json`
+(`PIPELINE_ROLLUP_STATE_PATH`) and sent again with the next run's refresh;
+the file is cleared once a refresh succeeds.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any
+
+from supabase_client import get_supabase_client
+
+ROLLUPS_ENV_VAR = "PIPELINE_ROLLUPS"
+ROLLUP_MODES = ("on", "off")
+DEFAULT_ROLLUP_MODE = "on"
+REFRESH_ROLLUPS_RPC_NAME = "refresh_air_quality_rollups"
+ROLLUP_STATE_PATH_ENV_VAR = "PIPELINE_ROLLUP_STATE_PATH"
+DEFAULT_ROLLUP_STATE_PATH = Path(".pipeline_state") / "rollups_pending.json"
+
+
+def get_rollup_mode() -> str:
+    mode = os.getenv(ROLLUPS_ENV_VAR, DEFAULT_ROLLUP_MODE).strip().lower()
+    if mode not in ROLLUP_MODES:
+        raise EnvironmentError(f"{ROLLUPS_ENV_VAR} invalido: {mode}. Usa {' o '.join(ROLLUP_MODES)}.")
+    return mode
+
+
+def get_rollup_state_path() -> Path:
+    return Path(os.getenv(ROLLUP_STATE_PATH_ENV_VAR) or DEFAULT_ROLLUP_STATE_PATH)
+
+
+def load_pending_readings(path: Path | None = None) -> list[dict[str, Any]]:
+    """Pairs of earlier runs whose rollup refresh failed."""
+    state_path = path or get_rollup_state_path()
+    try:
+        payload = json.loads(state_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as error:
+        logging.warning("[ROLLUP] Ignorando estado de rollups ilegible %s: %s", state_path, error)
+        return []
+    if not isinstance(payload, list):
+        return []
+    return [item for item in payload if isinstance(item, dict)]
+
+
+def save_pending_readings(readings: list[dict[str, Any]], path: Path | None = None) -> None:
+    state_path = path or get_rollup_state_path()
+    try:
+        if not readings:
+            state_path.unlink(missing_ok=True)
+            return
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        state_path.write_text(json.dumps(readings, indent=2) + "\n", encoding="utf-8")
+    except OSError as error:
+        logging.warning("[ROLLUP] No se pudo guardar estado de rollups en %s: %s", state_path, error)
+
+
+def collect_inserted_readings(
+    city_results: list[dict],
+    extra_readings: list[dict] | None = None,
+) -> list[dict[str, Any]]:
+    """(city_id, reading_timestamp) pairs this run actually inserted, plus `extra_readings`.
+
+    `extra_readings` are rows this run updated, e.g. by the deferred weather drain.
+    """
+    readings = []
+    seen = set()
+    extra_results = [{**reading, "reading_inserted": True} for reading in extra_readings or []]
+    for result in [*city_results, *extra_results]:
+        if not result.get("reading_inserted") or not result.get("reading_timestamp"):
+            continue
+        key = (result.get("city_id"), result["reading_timestamp"])
+        if key in seen:
+            continue
+        seen.add(key)
+        readings.append({"city_id": key[0], "reading_timestamp": key[1]})
+    return readings
+
+
+def refresh_rollups(
+    city_results: list[dict],
+    supabase: Any = None,
+    extra_readings: list[dict] | None = None,
+) -> dict[str, Any]:
+    mode = get_rollup_mode()
+    if mode == "off":
+        return {"mode": mode, "status": "disabled"}
+
+    pending = load_pending_readings()
+    readings = collect_inserted_readings(city_results, [*(extra_readings or []), *pending])
+    if not readings:
+        return {"mode": mode, "status": "no_new_readings"}
+
+    try:
+        client = supabase or get_supabase_client()
+        response = client.rpc(REFRESH_ROLLUPS_RPC_NAME, {"p_readings": readings}).execute()
+    except Exception as error:
+        logging.error("[ROLLUP] No se pudieron refrescar los rollups, se reintentan en la siguiente corrida: %s", error)
+        save_pending_readings(readings)
+        return {
+            "mode": mode,
+            "status": "failed",
+            "readings": len(readings),
+            "retried": len(pending),
+            "error": str(error),
+        }
+
+    if pending:
+        save_pending_readings([])
+    refreshed = response.data if isinstance(response.data, dict) else {}
+    logging.info("[ROLLUP] Rollups refrescados para %s lecturas: %s", len(readings), refreshed)
+    return {
+        "mode": mode,
+        "status": "success",
+        "readings": len(readings),
+        "retried": len(pending),
+        "hourly_buckets": refreshed.get("hourly_buckets"),
+        "daily_buckets": refreshed.get("daily_buckets"),
+    }
@@ -0,0 +1,142 @@
+"""Run-budget scheduling for the hourly pipeline.
+
+Cities are ordered stalest-first so that, when a run is cut short, freshness
+degrades across municipalities instead of always hurting the tail of the list.
+`RunBudget` stops new city work once the remaining time cannot cover the
+observed p95 per-city latency.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+MAX_RUNTIME_ENV_VAR = "PIPELINE_MAX_RUNTIME_SECONDS"
+# Used until the first city that needed an update has finished.
+DEFAULT_CITY_LATENCY_ESTIMATE_SECONDS = 30.0
+LATENCY_PERCENTILE = 0.95
+NEVER_UPDATED = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def parse_last_success(value: Any) -> datetime:
+    if not value:
+        return NEVER_UPDATED
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return NEVER_UPDATED
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def staleness_sort_key(city: dict) -> tuple[datetime, int]:
+    """Oldest successful update first; failing cities before healthy ones on ties."""
+    last_success = parse_last_success(city.get("last_successful_update_at"))
+    healthy = 1 if city.get("last_update_status") == "success" else 0
+    return last_success, healthy
+
+
+def order_cities_by_staleness(cities: list[dict]) -> list[dict]:
+    # sorted() is stable, so cities with identical staleness keep Supabase order.
+    return sorted(cities, key=staleness_sort_key)
+
+
+def get_max_runtime_seconds() -> float | None:
+    raw_value = os.getenv(MAX_RUNTIME_ENV_VAR, "").strip()
+    if not raw_value:
+        return None
+    try:
+        max_runtime = float(raw_value)
+    except ValueError:
+        max_runtime = 0.0
+    if max_runtime <= 0:
+        raise EnvironmentError(
+            f"{MAX_RUNTIME_ENV_VAR} invalido: {raw_value}. Usa segundos > 0."
+        )
+    return max_runtime
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    """Nearest-rank percentile; enough for a handful of city latencies."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(fraction * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class RunBudget:
+    """Thread-safe wall-clock budget shared by every runner.
+
+    Once the budget refuses a city it stays exhausted, so later cities in the
+    stalest-first order are deferred too instead of leapfrogging earlier ones.
+    """
+
+    def __init__(self, max_runtime_seconds: float | None, started_at: float | None = None):
+        self.max_runtime_seconds = max_runtime_seconds
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self._latencies: list[float] = []
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    def remaining_seconds(self) -> float | None:
+        if self.max_runtime_seconds is None:
+            return None
+        return self.max_runtime_seconds - (time.perf_counter() - self.started_at)
+
+    def record_city_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def p95_latency(self) -> float | None:
+        with self._lock:
+            return percentile(self._latencies, LATENCY_PERCENTILE)
+
+    def can_start_city(self) -> bool:
+        if self.max_runtime_seconds is None:
+            return True
+
+        estimate = self.p95_latency() or DEFAULT_CITY_LATENCY_ESTIMATE_SECONDS
+        remaining = self.remaining_seconds()
+        with self._lock:
+            if not self._exhausted and remaining < estimate:
+                self._exhausted = True
+                logging.warning(
+                    "[BUDGET] Quedan %.1fs y el p95 por ciudad es %.1fs; no se inician mas ciudades.",
+                    remaining,
+                    estimate,
+                )
+            return not self._exhausted
+
+    def snapshot(self) -> dict[str, Any]:
+        p95 = self.p95_latency()
+        return {
+            "max_runtime_seconds": self.max_runtime_seconds,
+            "p95_city_seconds": round(p95, 3) if p95 is not None else None,
+            "budget_exhausted": self._exhausted,
+        }
+
+
+def build_deferred_city_outcome(city: dict) -> dict:
+    logging.info("[DEFER] Ciudad %s diferida por presupuesto de ejecucion.", city.get("api_name"))
+    return {
+        "city": city,
+        "counters": {"deferred_for_budget": 1},
+        "result": {
+            "needed_update": None,
+            "deferred": True,
+            "reason": "run_budget_exhausted",
+        },
+        "fatal_failure": False,
+        "elapsed_seconds": 0.0,
+    }
+
+
+def record_outcome_latency(budget: RunBudget, outcome: dict) -> None:
+    # Up-to-date skips cost milliseconds and would drag the p95 toward zero.
+    if outcome["result"].get("needed_update"):
+        budget.record_city_latency(outcome["elapsed_seconds"])
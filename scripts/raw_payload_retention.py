@@ -0,0 +1,483 @@
+"""Retention for raw provider payloads in air_quality_readings.
+
+Default mode is dry-run. Use --apply to write. For readings older than
+--older-than-days, per city and in keyset-paginated batches:
+
+- `raw_api_response` is compacted (WAQI forecast/attributions/debug dropped) or,
+  with --payload-mode null, nulled together with `weather_source_payload`.
+- sub-hourly duplicates are downsampled to the last reading of each UTC hour.
+
+Then `raw_payloads` rows that no reading references any more (downsampled
+readings, or a reading write that failed after its payload was stored) and that
+are older than a day are deleted through `delete_unreferenced_raw_payloads`.
+With the hashed store (`PIPELINE_RAW_PAYLOAD_STORE=hashed`) new readings keep
+`raw_api_response` null and their bytes live in `raw_payloads.payload`, so the
+remaining `raw_payloads` rows older than the window are compacted in place too.
+The row keeps its hash, which is then the hash of the original payload, and the
+`_compacted` marker tells it apart. --payload-mode null never applies to this
+shared store. Both steps only run when no --city-id is given.
+
+AQI, pollutant, weather_* and timestamp columns are never modified. The report
+estimates bytes reclaimed per city from the compact JSON size of the payloads.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from postgrest.types import ReturnMethod
+
+from supabase_client import get_supabase_client
+
+DEFAULT_OLDER_THAN_DAYS = 90
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_BATCHES_PER_CITY = 200
+PAYLOAD_MODES = ("compact", "null")
+COMPACTED_MARKER = "_compacted"
+# Bulky WAQI members with no value once the reading is stored.
+RAW_DROP_KEYS = ("forecast", "attributions", "debug")
+WEATHER_DROP_KEYS = ("current_units",)
+ROLLUP_RANGE_RPC_NAME = "refresh_air_quality_rollups_for_range"
+UNREFERENCED_PAYLOADS_RPC_NAME = "delete_unreferenced_raw_payloads"
+# A pipeline run stores the payload just before the reading; newer payloads may
+# still be waiting for theirs.
+UNREFERENCED_PAYLOAD_GRACE_HOURS = 24
+
+
+@dataclass
+class CityRetention:
+    city_id: int
+    rows_scanned: int = 0
+    payloads_compacted: int = 0
+    payloads_nulled: int = 0
+    rows_downsampled: int = 0
+    bytes_reclaimed_estimate: int = 0
+    batches: int = 0
+    truncated: bool = False
+    first_downsampled: str | None = None
+    last_downsampled: str | None = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "city_id": self.city_id,
+            "rows_scanned": self.rows_scanned,
+            "payloads_compacted": self.payloads_compacted,
+            "payloads_nulled": self.payloads_nulled,
+            "rows_downsampled": self.rows_downsampled,
+            "bytes_reclaimed_estimate": self.bytes_reclaimed_estimate,
+            "batches": self.batches,
+            "truncated": self.truncated,
+        }
+
+
+def parse_utc_timestamp(value: Any) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def json_size(value: Any) -> int:
+    if value is None:
+        return 0
+    return len(json.dumps(value, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+
+
+def compact_raw_api_response(payload: Any) -> Any:
+    """Drop forecast/attributions/debug from a provider payload; idempotent."""
+    if not isinstance(payload, dict) or payload.get(COMPACTED_MARKER):
+        return payload
+    compacted = {key: value for key, value in payload.items() if key not in RAW_DROP_KEYS}
+    data = compacted.get("data")
+    if isinstance(data, dict):
+        compacted["data"] = {key: value for key, value in data.items() if key not in RAW_DROP_KEYS}
+    compacted[COMPACTED_MARKER] = True
+    return compacted
+
+
+def compact_weather_source_payload(payload: Any) -> Any:
+    if not isinstance(payload, dict):
+        return payload
+    return {key: value for key, value in payload.items() if key not in WEATHER_DROP_KEYS}
+
+
+def build_payload_update(row: dict[str, Any], payload_mode: str) -> dict[str, Any]:
+    """Columns to write for one row; empty when nothing would shrink."""
+    raw = row.get("raw_api_response")
+    weather = row.get("weather_source_payload")
+    if payload_mode == "null":
+        new_raw, new_weather = None, None
+    else:
+        new_raw, new_weather = compact_raw_api_response(raw), compact_weather_source_payload(weather)
+
+    update: dict[str, Any] = {}
+    if raw is not None and json_size(new_raw) < json_size(raw):
+        update["raw_api_response"] = new_raw
+    if weather is not None and json_size(new_weather) < json_size(weather):
+        update["weather_source_payload"] = new_weather
+    return update
+
+
+def payload_bytes_reclaimed(row: dict[str, Any], update: dict[str, Any]) -> int:
+    return sum(json_size(row.get(column)) - json_size(value) for column, value in update.items())
+
+
+def row_bytes(row: dict[str, Any]) -> int:
+    return json_size(row.get("raw_api_response")) + json_size(row.get("weather_source_payload"))
+
+
+def hour_bucket(value: Any) -> datetime | None:
+    parsed = parse_utc_timestamp(value)
+    return parsed.replace(minute=0, second=0, microsecond=0) if parsed else None
+
+
+def get_city_ids(supabase: Any, city_id: int | None = None) -> list[int]:
+    if city_id is not None:
+        return [city_id]
+    response = supabase.table("cities").select("id").order("id").execute()
+    rows = response.data if isinstance(response.data, list) else []
+    return [int(row["id"]) for row in rows]
+
+
+def fetch_batch(
+    supabase: Any,
+    city_id: int,
+    cutoff_iso: str,
+    after_timestamp: str | None,
+    batch_size: int,
+) -> list[dict[str, Any]]:
+    query = (
+        supabase.table("air_quality_readings")
+        .select("city_id, reading_timestamp, raw_api_response, weather_source_payload")
+        .eq("city_id", city_id)
+        .lt("reading_timestamp", cutoff_iso)
+    )
+    if after_timestamp is not None:
+        query = query.gt("reading_timestamp", after_timestamp)
+    response = query.order("reading_timestamp").limit(batch_size).execute()
+    return response.data if isinstance(response.data, list) else []
+
+
+def update_payloads(supabase: Any, row: dict[str, Any], update: dict[str, Any]) -> None:
+    (
+        supabase.table("air_quality_readings")
+        .update(update, returning=ReturnMethod.minimal)
+        .eq("city_id", row["city_id"])
+        .eq("reading_timestamp", row["reading_timestamp"])
+        .execute()
+    )
+
+
+def delete_reading(supabase: Any, row: dict[str, Any]) -> None:
+    (
+        supabase.table("air_quality_readings")
+        .delete(returning=ReturnMethod.minimal)
+        .eq("city_id", row["city_id"])
+        .eq("reading_timestamp", row["reading_timestamp"])
+        .execute()
+    )
+
+
+def refresh_rollups_for_range(supabase: Any, city_id: int, first: str, last: str) -> None:
+    """Deleted sub-hourly rows change hourly/daily rollups; recompute that window."""
+    last_parsed = parse_utc_timestamp(last)
+    supabase.rpc(
+        ROLLUP_RANGE_RPC_NAME,
+        {
+            "p_city_id": city_id,
+            "p_from": first,
+            "p_to": (last_parsed + timedelta(hours=1)).isoformat(),
+        },
+    ).execute()
+
+
+def process_city(
+    supabase: Any,
+    city_id: int,
+    *,
+    cutoff_iso: str,
+    batch_size: int,
+    max_batches: int,
+    payload_mode: str,
+    apply: bool,
+) -> CityRetention:
+    result = CityRetention(city_id)
+    after_timestamp: str | None = None
+    # Last row seen in the current UTC hour; carried across batch boundaries.
+    hour_keeper: dict[str, Any] | None = None
+
+    while result.batches < max_batches:
+        rows = fetch_batch(supabase, city_id, cutoff_iso, after_timestamp, batch_size)
+        if not rows:
+            break
+        result.batches += 1
+        result.rows_scanned += len(rows)
+        after_timestamp = rows[-1]["reading_timestamp"]
+
+        for row in rows:
+            bucket = hour_bucket(row.get("reading_timestamp"))
+            same_hour = hour_keeper is not None and bucket is not None and bucket == hour_bucket(
+                hour_keeper["reading_timestamp"]
+            )
+            if same_hour:
+                # Keep the last reading of the hour; the earlier one goes.
+                result.rows_downsampled += 1
+                result.bytes_reclaimed_estimate += row_bytes(hour_keeper)
+                result.first_downsampled = result.first_downsampled or hour_keeper["reading_timestamp"]
+                result.last_downsampled = hour_keeper["reading_timestamp"]
+                if apply:
+                    delete_reading(supabase, hour_keeper)
+            elif hour_keeper is not None:
+                apply_payload_retention(supabase, hour_keeper, result, payload_mode, apply)
+            hour_keeper = row
+
+        if len(rows) < batch_size:
+            break
+    else:
+        result.truncated = True
+
+    if hour_keeper is not None:
+        apply_payload_retention(supabase, hour_keeper, result, payload_mode, apply)
+
+    if apply and result.first_downsampled:
+        refresh_rollups_for_range(supabase, city_id, result.first_downsampled, result.last_downsampled)
+    return result
+
+
+def apply_payload_retention(
+    supabase: Any,
+    row: dict[str, Any],
+    result: CityRetention,
+    payload_mode: str,
+    apply: bool,
+) -> None:
+    update = build_payload_update(row, payload_mode)
+    if not update:
+        return
+    result.bytes_reclaimed_estimate += payload_bytes_reclaimed(row, update)
+    if payload_mode == "null":
+        result.payloads_nulled += 1
+    else:
+        result.payloads_compacted += 1
+    if apply:
+        update_payloads(supabase, row, update)
+
+
+def fetch_stored_payload_batch(
+    supabase: Any,
+    cutoff_iso: str,
+    after_hash: str | None,
+    batch_size: int,
+) -> list[dict[str, Any]]:
+    query = (
+        supabase.table("raw_payloads")
+        .select("hash, payload")
+        .lt("created_at", cutoff_iso)
+        .is_(f"payload->>{COMPACTED_MARKER}", "null")
+    )
+    if after_hash is not None:
+        query = query.gt("hash", after_hash)
+    response = query.order("hash").limit(batch_size).execute()
+    return response.data if isinstance(response.data, list) else []
+
+
+def compact_stored_payloads(
+    supabase: Any,
+    *,
+    cutoff_iso: str,
+    batch_size: int,
+    max_batches: int,
+    apply: bool,
+) -> dict[str, Any]:
+    """Compact (or, in dry-run, measure) `raw_payloads` rows created before the cutoff."""
+    report: dict[str, Any] = {
+        "rows_scanned": 0,
+        "payloads_compacted": 0,
+        "bytes_reclaimed_estimate": 0,
+        "batches": 0,
+        "truncated": False,
+    }
+    after_hash: str | None = None
+    while report["batches"] < max_batches:
+        rows = fetch_stored_payload_batch(supabase, cutoff_iso, after_hash, batch_size)
+        if not rows:
+            break
+        report["batches"] += 1
+        report["rows_scanned"] += len(rows)
+        after_hash = rows[-1]["hash"]
+        for row in rows:
+            compacted = compact_raw_api_response(row.get("payload"))
+            reclaimed = json_size(row.get("payload")) - json_size(compacted)
+            if reclaimed <= 0:
+                continue
+            report["payloads_compacted"] += 1
+            report["bytes_reclaimed_estimate"] += reclaimed
+            if apply:
+                (
+                    supabase.table("raw_payloads")
+                    .update({"payload": compacted}, returning=ReturnMethod.minimal)
+                    .eq("hash", row["hash"])
+                    .execute()
+                )
+        if len(rows) < batch_size:
+            break
+    else:
+        report["truncated"] = True
+    return report
+
+
+def delete_unreferenced_payloads(
+    supabase: Any,
+    *,
+    now_utc: datetime,
+    batch_size: int,
+    max_batches: int,
+    apply: bool,
+) -> dict[str, Any]:
+    """Delete (or, in dry-run, count) `raw_payloads` rows no reading references."""
+    created_before = (now_utc - timedelta(hours=UNREFERENCED_PAYLOAD_GRACE_HOURS)).isoformat()
+    report: dict[str, Any] = {
+        "created_before": created_before,
+        "unreferenced_payloads": 0,
+        "bytes_reclaimed_estimate": 0,
+        "batches": 0,
+        "truncated": False,
+    }
+    while report["batches"] < max_batches:
+        response = supabase.rpc(
+            UNREFERENCED_PAYLOADS_RPC_NAME,
+            {"p_created_before": created_before, "p_limit": batch_size, "p_apply": apply},
+        ).execute()
+        data = response.data if isinstance(response.data, dict) else {}
+        payloads = int(data.get("payloads") or 0)
+        report["batches"] += 1
+        report["unreferenced_payloads"] += payloads
+        report["bytes_reclaimed_estimate"] += int(data.get("bytes") or 0)
+        # A dry-run counts every candidate in one call.
+        if not apply or payloads < batch_size:
+            break
+    else:
+        report["truncated"] = True
+    return report
+
+
+def run_retention(
+    *,
+    older_than_days: int,
+    batch_size: int,
+    max_batches: int,
+    payload_mode: str,
+    apply: bool,
+    city_id: int | None = None,
+    now_utc: datetime | None = None,
+) -> dict[str, Any]:
+    supabase = get_supabase_client()
+    now_utc = now_utc or datetime.now(timezone.utc)
+    cutoff = now_utc - timedelta(days=older_than_days)
+    cutoff_iso = cutoff.isoformat()
+    report: dict[str, Any] = {
+        "mode": "apply" if apply else "dry_run",
+        "payload_mode": payload_mode,
+        "older_than_days": older_than_days,
+        "cutoff": cutoff_iso,
+        "batch_size": batch_size,
+        "max_batches_per_city": max_batches,
+        "summary": {
+            "cities": 0,
+            "rows_scanned": 0,
+            "payloads_compacted": 0,
+            "payloads_nulled": 0,
+            "rows_downsampled": 0,
+            "bytes_reclaimed_estimate": 0,
+            "truncated_cities": 0,
+        },
+        "city_results": [],
+        "raw_payloads": None,
+        "raw_payload_compaction": None,
+    }
+    for current_city_id in get_city_ids(supabase, city_id=city_id):
+        result = process_city(
+            supabase,
+            current_city_id,
+            cutoff_iso=cutoff_iso,
+            batch_size=batch_size,
+            max_batches=max_batches,
+            payload_mode=payload_mode,
+            apply=apply,
+        )
+        city_report = result.as_dict()
+        report["city_results"].append(city_report)
+        report["summary"]["cities"] += 1
+        report["summary"]["truncated_cities"] += int(result.truncated)
+        for key in (
+            "rows_scanned",
+            "payloads_compacted",
+            "payloads_nulled",
+            "rows_downsampled",
+            "bytes_reclaimed_estimate",
+        ):
+            report["summary"][key] += city_report[key]
+
+    # raw_payloads is shared by every city; only a full run cleans it.
+    if city_id is None:
+        report["raw_payloads"] = delete_unreferenced_payloads(
+            supabase,
+            now_utc=now_utc,
+            batch_size=batch_size,
+            max_batches=max_batches,
+            apply=apply,
+        )
+        report["raw_payload_compaction"] = compact_stored_payloads(
+            supabase,
+            cutoff_iso=cutoff_iso,
+            batch_size=batch_size,
+            max_batches=max_batches,
+            apply=apply,
+        )
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compact old raw payloads and downsample sub-hourly readings.")
+    parser.add_argument("--older-than-days", type=int, default=DEFAULT_OLDER_THAN_DAYS)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=DEFAULT_MAX_BATCHES_PER_CITY, help="Per city, per run.")
+    parser.add_argument("--payload-mode", choices=PAYLOAD_MODES, default="compact")
+    parser.add_argument("--city-id", type=int)
+    parser.add_argument("--apply", action="store_true", help="Write changes. Default is dry-run.")
+    args = parser.parse_args()
+    if args.older_than_days < 7:
+        raise ValueError("--older-than-days must be at least 7")
+    if args.batch_size < 1 or args.batch_size > 1000:
+        raise ValueError("--batch-size must be between 1 and 1000")
+    if args.max_batches < 1:
+        raise ValueError("--max-batches must be at least 1")
+    report = run_retention(
+        older_than_days=args.older_than_days,
+        batch_size=args.batch_size,
+        max_batches=args.max_batches,
+        payload_mode=args.payload_mode,
+        apply=args.apply,
+        city_id=args.city_id,
+    )
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,7 +1,8 @@
 """Operational smoke check for get_latest_air_quality_per_city.
 
 Read-only CLI intended for manual GitHub Actions runs and local incident checks.
-It validates the public RPC contract shape and freshness without writing to Supabase.
+It validates the public RPC contract shape and freshness without writing to Supabase,
+and checks that get_latest_air_quality_per_city_cached returns the same rows.
 """
 
 from __future__ import annotations
@@ -22,6 +23,7 @@ if str(REPO_ROOT) not in sys.path:
 from supabase_client import get_supabase_client
 
 RPC_NAME = "get_latest_air_quality_per_city"
+CACHED_RPC_NAME = "get_latest_air_quality_per_city_cached"
 EXPECTED_COLUMNS = {
     "city_id",
     "city_name",
@@ -77,8 +79,8 @@ def _freshness_hours(reading_timestamp: datetime, now_utc: datetime) -> float:
     return (now_utc - reading_timestamp).total_seconds() / 3600
 
 
-def fetch_rpc_rows() -> list[dict[str, Any]]:
-    response = get_supabase_client().rpc(RPC_NAME).execute()
+def fetch_rpc_rows(rpc_name: str = RPC_NAME) -> list[dict[str, Any]]:
+    response = get_supabase_client().rpc(rpc_name).execute()
     data = getattr(response, "data", None)
     if not isinstance(data, list):
         raise ValueError("Supabase RPC response is not an array")
@@ -189,6 +191,48 @@ def evaluate_rpc_contract(
     }
 
 
+def compare_rpc_rows(rows: list[dict[str, Any]], cached_rows: Any) -> list[str]:
+    """Differences between the ranking RPC and the trigger-maintained cached RPC."""
+    if not isinstance(cached_rows, list):
+        return [f"{CACHED_RPC_NAME} response must be an array"]
+
+    def by_city(items: list[Any]) -> dict[Any, dict[str, Any]]:
+        return {item.get("city_id"): item for item in items if isinstance(item, dict)}
+
+    primary = by_city(rows)
+    cached = by_city(cached_rows)
+    differences: list[str] = []
+    for city_id in sorted(set(primary) - set(cached), key=str):
+        differences.append(f"city_id {city_id} missing from {CACHED_RPC_NAME}")
+    for city_id in sorted(set(cached) - set(primary), key=str):
+        differences.append(f"city_id {city_id} only in {CACHED_RPC_NAME}")
+    for city_id in sorted(set(primary) & set(cached), key=str):
+        mismatched = sorted(
+            column
+            for column in set(primary[city_id]) | set(cached[city_id])
+            if primary[city_id].get(column) != cached[city_id].get(column)
+        )
+        if mismatched:
+            differences.append(
+                f"city_id {city_id} differs in {CACHED_RPC_NAME}: {', '.join(mismatched)}"
+            )
+    return differences
+
+
+def apply_cached_rpc_comparison(
+    result: dict[str, Any],
+    rows: list[dict[str, Any]],
+    cached_rows: Any,
+) -> dict[str, Any]:
+    differences = compare_rpc_rows(rows, cached_rows)
+    result["cached_rpc"] = CACHED_RPC_NAME
+    result["cached_rpc_matches"] = not differences
+    if differences:
+        result["errors"] = [*result.get("errors", []), *differences]
+        result["status"] = "unhealthy"
+    return result
+
+
 def build_human_summary(result: dict[str, Any]) -> str:
     status = str(result.get("status", "unknown")).upper()
     returned = result.get("returned_city_ids", [])
@@ -199,6 +243,7 @@ def build_human_summary(result: dict[str, Any]) -> str:
     lines = [
         f"RPC contract health: {status}",
         f"RPC: {result.get('rpc', RPC_NAME)}",
+        f"Cached RPC matches: {result.get('cached_rpc_matches')}",
         f"Expected city IDs: {expected}",
         f"Returned city IDs: {returned}",
     ]
@@ -234,11 +279,13 @@ def main(argv: list[str] | None = None) -> int:
 
     try:
         rows = fetch_rpc_rows()
+        cached_rows = fetch_rpc_rows(CACHED_RPC_NAME)
         result = evaluate_rpc_contract(
             rows,
             expected_city_ids=parse_expected_city_ids(args.expected_city_ids),
             thresholds=_thresholds_from_env(),
         )
+        result = apply_cached_rpc_comparison(result, rows, cached_rows)
     except Exception as exc:  # noqa: BLE001 - operational CLI must classify connection/config failures.
         result = {
             "status": "config_error",
@@ -17,7 +17,12 @@ from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Callable
 
-import requests
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.append(str(REPO_ROOT))
+
+from http_transport import http_get
+from weather_cache import archive_ttl_seconds, cached_get_json, get_weather_cache_stats
 
 OPEN_METEO_ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
 PROVIDER = "open-meteo"
@@ -173,13 +178,24 @@ def fetch_open_meteo_hours(
     timeout_seconds: int = 45,
 ) -> list[WeatherHour]:
     params = build_open_meteo_params(city, start_date, end_date)
-    response = requests.get(OPEN_METEO_ARCHIVE_URL, params=params, timeout=timeout_seconds)
-    response.raise_for_status()
-    return parse_open_meteo_hours(response.json())
+
+    def download() -> Any:
+        response = http_get(OPEN_METEO_ARCHIVE_URL, params=params, timeout=timeout_seconds)
+        response.raise_for_status()
+        return response.json()
+
+    payload = cached_get_json(
+        OPEN_METEO_ARCHIVE_URL,
+        params,
+        download,
+        archive_ttl_seconds(end_date),
+        is_valid=lambda item: bool(parse_open_meteo_hours(item)),
+    )
+    return parse_open_meteo_hours(payload)
 
 
 def parse_open_meteo_hours(payload: dict[str, Any]) -> list[WeatherHour]:
-    hourly = payload.get("hourly")
+    hourly = payload.get("hourly") if isinstance(payload, dict) else None
     if not isinstance(hourly, dict):
         return []
 
@@ -596,6 +612,7 @@ def build_dry_run_report(
         },
         "city_results": city_results,
         "validation_issues": validation_issues,
+        "weather_cache": get_weather_cache_stats(),
         "unit_contract": {
             "weather_wind_speed_field": "weather_wind_speed_kmh",
             "open_meteo_wind_speed_unit": "kmh",
@@ -2,7 +2,8 @@
 
 Default mode is dry-run. Use --apply to update only canonical weather_* columns
 for existing air_quality_readings rows. AQI, pollutants, coordinates, raw provider
-payloads, and legacy WAQI weather fields are never modified.
+payloads, and legacy WAQI weather fields are never modified. After applying a
+city's updates, its hourly/daily rollups are recomputed for the updated window.
 """
 
 from __future__ import annotations
@@ -16,16 +17,17 @@ from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Any, Iterable
 
-import requests
-
 REPO_ROOT = Path(__file__).resolve().parents[1]
 if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 
+from http_transport import http_get
 from supabase_client import get_supabase_client
+from weather_cache import archive_ttl_seconds, cached_get_json, get_weather_cache_stats
 
 OPEN_METEO_ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
 PROVIDER = "open-meteo"
+ROLLUP_RANGE_RPC_NAME = "refresh_air_quality_rollups_for_range"
 DEFAULT_DAYS = 90
 DEFAULT_BATCH_SIZE = 100
 REQUEST_DELAY_SECONDS = 1
@@ -128,13 +130,21 @@ def build_archive_params(city: City, start_date: str, end_date: str) -> dict[str
 
 
 def fetch_open_meteo_hours(city: City, start_date: str, end_date: str) -> list[WeatherHour]:
-    response = requests.get(
+    params = build_archive_params(city, start_date, end_date)
+
+    def download() -> Any:
+        response = http_get(OPEN_METEO_ARCHIVE_URL, params=params, timeout=45)
+        response.raise_for_status()
+        return response.json()
+
+    payload = cached_get_json(
         OPEN_METEO_ARCHIVE_URL,
-        params=build_archive_params(city, start_date, end_date),
-        timeout=45,
+        params,
+        download,
+        archive_ttl_seconds(end_date),
+        is_valid=lambda item: bool(parse_open_meteo_hours(item)),
     )
-    response.raise_for_status()
-    return parse_open_meteo_hours(response.json())
+    return parse_open_meteo_hours(payload)
 
 
 def parse_open_meteo_hours(payload: dict[str, Any]) -> list[WeatherHour]:
@@ -252,6 +262,18 @@ def update_reading(supabase: Any, reading: Reading, payload: dict[str, Any]) ->
     )
 
 
+def refresh_rollups_for_range(supabase: Any, city_id: int, first: datetime, last: datetime) -> None:
+    """Updated weather changes the rollup weather averages; recompute that window."""
+    supabase.rpc(
+        ROLLUP_RANGE_RPC_NAME,
+        {
+            "p_city_id": city_id,
+            "p_from": first.isoformat(),
+            "p_to": (last + timedelta(hours=1)).isoformat(),
+        },
+    ).execute()
+
+
 def run_backfill(*, days: int, batch_size: int, apply: bool, city_id: int | None = None) -> dict[str, Any]:
     supabase = get_supabase_client()
     report: dict[str, Any] = {
@@ -268,6 +290,7 @@ def run_backfill(*, days: int, batch_size: int, apply: bool, city_id: int | None
             "unmatched_rows": 0,
             "invalid_weather_rows": 0,
             "fetch_errors": 0,
+            "rollup_refresh_errors": 0,
         },
         "city_results": [],
     }
@@ -282,6 +305,7 @@ def run_backfill(*, days: int, batch_size: int, apply: bool, city_id: int | None
             "unmatched_rows": 0,
             "invalid_weather_rows": 0,
             "fetch_error": None,
+            "rollup_refresh_error": None,
             "sample_updates": [],
         }
         report["summary"]["cities"] += 1
@@ -298,6 +322,7 @@ def run_backfill(*, days: int, batch_size: int, apply: bool, city_id: int | None
             report["summary"]["fetch_errors"] += 1
             report["city_results"].append(result)
             continue
+        updated_timestamps: list[datetime] = []
         for reading in readings:
             match, delta_minutes = find_nearest_weather_hour(reading.reading_timestamp, weather_hours)
             if match is None:
@@ -324,10 +349,18 @@ def run_backfill(*, days: int, batch_size: int, apply: bool, city_id: int | None
             report["summary"]["matched_rows"] += 1
             if apply:
                 update_reading(supabase, reading, payload)
+                updated_timestamps.append(reading.reading_timestamp)
                 result["updated_rows"] += 1
                 report["summary"]["updated_rows"] += 1
+        if updated_timestamps:
+            try:
+                refresh_rollups_for_range(supabase, city.city_id, min(updated_timestamps), max(updated_timestamps))
+            except Exception as exc:  # noqa: BLE001 - report the stale window instead of aborting.
+                result["rollup_refresh_error"] = str(exc)
+                report["summary"]["rollup_refresh_errors"] += 1
         report["city_results"].append(result)
         time.sleep(REQUEST_DELAY_SECONDS)
+    report["weather_cache"] = get_weather_cache_stats()
     return report
 
 
@@ -0,0 +1,132 @@
+-- Single-transaction ingest for PIPELINE_WRITE_MODE=rpc.
+-- Inserts the reading (if any), updates the city status and writes the
+-- pipeline_logs event in one round trip. Any error rolls back all three, so a
+-- reading can no longer be stored while the city status update fails.
+--
+-- Payload shape (built by update_city.build_ingest_payload):
+--   {
+--     "city_id": 1,
+--     "city_name": "Monterrey",
+--     "reading": { air_quality_readings columns } | null,
+--     "city_status": { cities status columns } | {},
+--     "validation_errors": [...] | null
+--   }
+--
+-- Rollback: drop function if exists public.ingest_air_quality_reading(jsonb);
+
+create or replace function public.ingest_air_quality_reading(payload jsonb)
+returns jsonb
+language plpgsql
+volatile
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  v_city_id bigint := (payload ->> 'city_id')::bigint;
+  v_reading jsonb := payload -> 'reading';
+  v_city_status jsonb := coalesce(payload -> 'city_status', '{}'::jsonb);
+  v_reading_inserted boolean := false;
+  v_city_rows integer := 0;
+  v_result jsonb;
+begin
+  if v_city_id is null then
+    raise exception 'ingest_air_quality_reading: city_id is required';
+  end if;
+
+  if v_reading is not null and jsonb_typeof(v_reading) = 'object' then
+    insert into public.air_quality_readings (
+      city_id,
+      reading_timestamp,
+      aqi_us,
+      main_pollutant_us,
+      temperature_c,
+      pressure_hpa,
+      humidity_percent,
+      wind_speed_ms,
+      wind_direction_deg,
+      weather_icon,
+      raw_api_response,
+      weather_temperature_c,
+      weather_humidity_percent,
+      weather_wind_speed_kmh,
+      weather_wind_direction_deg,
+      weather_wind_gust_kmh,
+      weather_provider,
+      weather_timestamp,
+      weather_source_payload
+    )
+    select
+      v_city_id,
+      r.reading_timestamp,
+      r.aqi_us,
+      r.main_pollutant_us,
+      r.temperature_c,
+      r.pressure_hpa,
+      r.humidity_percent,
+      r.wind_speed_ms,
+      r.wind_direction_deg,
+      r.weather_icon,
+      r.raw_api_response,
+      r.weather_temperature_c,
+      r.weather_humidity_percent,
+      r.weather_wind_speed_kmh,
+      r.weather_wind_direction_deg,
+      r.weather_wind_gust_kmh,
+      r.weather_provider,
+      r.weather_timestamp,
+      r.weather_source_payload
+    from jsonb_populate_record(null::public.air_quality_readings, v_reading) r;
+
+    v_reading_inserted := true;
+  end if;
+
+  -- Only keys present in city_status are written, matching the PostgREST
+  -- partial update used by PIPELINE_WRITE_MODE=per_city.
+  if v_city_status <> '{}'::jsonb then
+    update public.cities c
+    set
+      last_update_status = case when v_city_status ? 'last_update_status'
+        then v_city_status ->> 'last_update_status' else c.last_update_status end,
+      last_successful_update_at = case when v_city_status ? 'last_successful_update_at'
+        then (v_city_status ->> 'last_successful_update_at')::timestamptz else c.last_successful_update_at end,
+      latitude = case when v_city_status ? 'latitude'
+        then (v_city_status ->> 'latitude')::double precision else c.latitude end,
+      longitude = case when v_city_status ? 'longitude'
+        then (v_city_status ->> 'longitude')::double precision else c.longitude end,
+      updated_at = case when v_city_status ? 'updated_at'
+        then (v_city_status ->> 'updated_at')::timestamptz else c.updated_at end
+    where c.id = v_city_id;
+
+    get diagnostics v_city_rows = row_count;
+  end if;
+
+  v_result := jsonb_build_object(
+    'city_id', v_city_id,
+    'readingInserted', v_reading_inserted,
+    'cityStatusUpdated', v_city_rows > 0,
+    'insertError', null,
+    'updateError', null,
+    'validationErrors', payload -> 'validation_errors'
+  );
+
+  insert into public.pipeline_logs (city_id, city_name, status, context, details, created_at)
+  values (
+    v_city_id,
+    payload ->> 'city_name',
+    v_city_status ->> 'last_update_status',
+    'update_city',
+    v_result,
+    now()
+  );
+
+  return v_result;
+end;
+$function$;
+
+comment on function public.ingest_air_quality_reading(jsonb) is
+  'Pipeline write path: reading insert + city status update + pipeline_logs event in one transaction.';
+
+-- Pipeline-only write path: never callable with the public anon/authenticated keys.
+revoke all on function public.ingest_air_quality_reading(jsonb) from public;
+revoke all on function public.ingest_air_quality_reading(jsonb) from anon, authenticated;
+grant execute on function public.ingest_air_quality_reading(jsonb) to service_role;
@@ -0,0 +1,147 @@
+-- One reading per (city_id, reading_timestamp).
+-- The pipeline writes readings with ON CONFLICT (city_id, reading_timestamp),
+-- so retries and overlapping runs no longer store the same reading twice. The
+-- index also serves the latest-per-city RPC and the weather backfill updates,
+-- which both look readings up by city_id + reading_timestamp.
+--
+-- Existing duplicates are removed first, keeping the first inserted row (lowest
+-- id). ctid is not used: it follows physical placement, which VACUUM FULL and
+-- updates change, so it does not identify the oldest row.
+-- Review them before applying on production:
+--   select city_id, reading_timestamp, count(*)
+--   from public.air_quality_readings
+--   group by 1, 2 having count(*) > 1;
+--
+-- The index is built inside the migration transaction (no CONCURRENTLY), which
+-- blocks writes to air_quality_readings while it builds. Run it outside the
+-- hourly pipeline window.
+--
+-- Rollback:
+--   drop index if exists public.air_quality_readings_city_id_reading_timestamp_key;
+--   then re-apply 20260601120000_add_ingest_air_quality_reading_rpc.sql.
+
+delete from public.air_quality_readings newer
+using public.air_quality_readings older
+where newer.city_id = older.city_id
+  and newer.reading_timestamp = older.reading_timestamp
+  and newer.id > older.id;
+
+create unique index if not exists air_quality_readings_city_id_reading_timestamp_key
+  on public.air_quality_readings (city_id, reading_timestamp);
+
+-- ingest_air_quality_reading: a repeated reading is a no-op instead of an error
+-- that would roll back the city status update.
+create or replace function public.ingest_air_quality_reading(payload jsonb)
+returns jsonb
+language plpgsql
+volatile
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  v_city_id bigint := (payload ->> 'city_id')::bigint;
+  v_reading jsonb := payload -> 'reading';
+  v_city_status jsonb := coalesce(payload -> 'city_status', '{}'::jsonb);
+  v_reading_inserted boolean := false;
+  v_reading_duplicate boolean := false;
+  v_reading_rows integer := 0;
+  v_city_rows integer := 0;
+  v_result jsonb;
+begin
+  if v_city_id is null then
+    raise exception 'ingest_air_quality_reading: city_id is required';
+  end if;
+
+  if v_reading is not null and jsonb_typeof(v_reading) = 'object' then
+    insert into public.air_quality_readings (
+      city_id,
+      reading_timestamp,
+      aqi_us,
+      main_pollutant_us,
+      temperature_c,
+      pressure_hpa,
+      humidity_percent,
+      wind_speed_ms,
+      wind_direction_deg,
+      weather_icon,
+      raw_api_response,
+      weather_temperature_c,
+      weather_humidity_percent,
+      weather_wind_speed_kmh,
+      weather_wind_direction_deg,
+      weather_wind_gust_kmh,
+      weather_provider,
+      weather_timestamp,
+      weather_source_payload
+    )
+    select
+      v_city_id,
+      r.reading_timestamp,
+      r.aqi_us,
+      r.main_pollutant_us,
+      r.temperature_c,
+      r.pressure_hpa,
+      r.humidity_percent,
+      r.wind_speed_ms,
+      r.wind_direction_deg,
+      r.weather_icon,
+      r.raw_api_response,
+      r.weather_temperature_c,
+      r.weather_humidity_percent,
+      r.weather_wind_speed_kmh,
+      r.weather_wind_direction_deg,
+      r.weather_wind_gust_kmh,
+      r.weather_provider,
+      r.weather_timestamp,
+      r.weather_source_payload
+    from jsonb_populate_record(null::public.air_quality_readings, v_reading) r
+    on conflict (city_id, reading_timestamp) do nothing;
+
+    get diagnostics v_reading_rows = row_count;
+    v_reading_inserted := v_reading_rows > 0;
+    v_reading_duplicate := v_reading_rows = 0;
+  end if;
+
+  -- Only keys present in city_status are written, matching the PostgREST
+  -- partial update used by PIPELINE_WRITE_MODE=per_city.
+  if v_city_status <> '{}'::jsonb then
+    update public.cities c
+    set
+      last_update_status = case when v_city_status ? 'last_update_status'
+        then v_city_status ->> 'last_update_status' else c.last_update_status end,
+      last_successful_update_at = case when v_city_status ? 'last_successful_update_at'
+        then (v_city_status ->> 'last_successful_update_at')::timestamptz else c.last_successful_update_at end,
+      latitude = case when v_city_status ? 'latitude'
+        then (v_city_status ->> 'latitude')::double precision else c.latitude end,
+      longitude = case when v_city_status ? 'longitude'
+        then (v_city_status ->> 'longitude')::double precision else c.longitude end,
+      updated_at = case when v_city_status ? 'updated_at'
+        then (v_city_status ->> 'updated_at')::timestamptz else c.updated_at end
+    where c.id = v_city_id;
+
+    get diagnostics v_city_rows = row_count;
+  end if;
+
+  v_result := jsonb_build_object(
+    'city_id', v_city_id,
+    'readingInserted', v_reading_inserted,
+    'readingDuplicate', v_reading_duplicate,
+    'cityStatusUpdated', v_city_rows > 0,
+    'insertError', null,
+    'updateError', null,
+    'validationErrors', payload -> 'validation_errors'
+  );
+
+  insert into public.pipeline_logs (city_id, city_name, status, context, details, created_at)
+  values (
+    v_city_id,
+    payload ->> 'city_name',
+    v_city_status ->> 'last_update_status',
+    'update_city',
+    v_result,
+    now()
+  );
+
+  return v_result;
+end;
+$function$;
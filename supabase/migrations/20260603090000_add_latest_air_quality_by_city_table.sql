@@ -0,0 +1,289 @@
+-- Constant-cost latest reading per city.
+-- get_latest_air_quality_per_city ranks every air_quality_readings row with
+-- row_number() on each dashboard hit, so its cost grows with the history.
+-- latest_air_quality_by_city keeps one row per city, maintained by triggers on
+-- air_quality_readings, and get_latest_air_quality_per_city_cached() reads only
+-- that table (plus cities) and returns the same columns.
+--
+-- The original RPC is left untouched; scripts/rpc_contract_health.py compares
+-- both until the dashboard is switched over.
+--
+-- Rollback:
+--   drop function if exists public.get_latest_air_quality_per_city_cached();
+--   drop trigger if exists air_quality_readings_refresh_latest on public.air_quality_readings;
+--   drop trigger if exists air_quality_readings_refresh_latest_on_delete on public.air_quality_readings;
+--   drop function if exists public.refresh_latest_air_quality_by_city();
+--   drop function if exists public.refresh_latest_air_quality_by_city_on_delete();
+--   drop table if exists public.latest_air_quality_by_city;
+
+create table if not exists public.latest_air_quality_by_city (
+  city_id bigint primary key references public.cities (id) on delete cascade,
+  reading_timestamp timestamp with time zone not null,
+  aqi_us smallint,
+  main_pollutant_us text,
+  temperature_c real,
+  humidity_percent smallint,
+  wind_speed_ms real,
+  wind_direction_deg smallint,
+  weather_icon text,
+  weather_temperature_c real,
+  weather_humidity_percent smallint,
+  weather_wind_speed_kmh real,
+  weather_wind_direction_deg smallint,
+  weather_wind_gust_kmh real,
+  weather_provider text,
+  weather_timestamp timestamp with time zone,
+  refreshed_at timestamp with time zone not null default now()
+);
+
+comment on table public.latest_air_quality_by_city is
+  'Latest air_quality_readings row per city, kept current by triggers. Read through get_latest_air_quality_per_city_cached().';
+
+-- Only reachable through the security definer RPC.
+alter table public.latest_air_quality_by_city enable row level security;
+revoke all on table public.latest_air_quality_by_city from anon, authenticated;
+
+-- Inserts and updates (e.g. weather backfill) of the newest reading replace the
+-- cached row; older readings never overwrite a newer one.
+create or replace function public.refresh_latest_air_quality_by_city()
+returns trigger
+language plpgsql
+set search_path = public, pg_temp
+as $function$
+begin
+  insert into public.latest_air_quality_by_city as latest (
+    city_id,
+    reading_timestamp,
+    aqi_us,
+    main_pollutant_us,
+    temperature_c,
+    humidity_percent,
+    wind_speed_ms,
+    wind_direction_deg,
+    weather_icon,
+    weather_temperature_c,
+    weather_humidity_percent,
+    weather_wind_speed_kmh,
+    weather_wind_direction_deg,
+    weather_wind_gust_kmh,
+    weather_provider,
+    weather_timestamp,
+    refreshed_at
+  )
+  values (
+    new.city_id,
+    new.reading_timestamp,
+    new.aqi_us,
+    new.main_pollutant_us,
+    new.temperature_c,
+    new.humidity_percent,
+    new.wind_speed_ms,
+    new.wind_direction_deg,
+    new.weather_icon,
+    new.weather_temperature_c,
+    new.weather_humidity_percent,
+    new.weather_wind_speed_kmh,
+    new.weather_wind_direction_deg,
+    new.weather_wind_gust_kmh,
+    new.weather_provider,
+    new.weather_timestamp,
+    now()
+  )
+  on conflict (city_id) do update
+  set
+    reading_timestamp = excluded.reading_timestamp,
+    aqi_us = excluded.aqi_us,
+    main_pollutant_us = excluded.main_pollutant_us,
+    temperature_c = excluded.temperature_c,
+    humidity_percent = excluded.humidity_percent,
+    wind_speed_ms = excluded.wind_speed_ms,
+    wind_direction_deg = excluded.wind_direction_deg,
+    weather_icon = excluded.weather_icon,
+    weather_temperature_c = excluded.weather_temperature_c,
+    weather_humidity_percent = excluded.weather_humidity_percent,
+    weather_wind_speed_kmh = excluded.weather_wind_speed_kmh,
+    weather_wind_direction_deg = excluded.weather_wind_direction_deg,
+    weather_wind_gust_kmh = excluded.weather_wind_gust_kmh,
+    weather_provider = excluded.weather_provider,
+    weather_timestamp = excluded.weather_timestamp,
+    refreshed_at = excluded.refreshed_at
+  where excluded.reading_timestamp >= latest.reading_timestamp;
+
+  return null;
+end;
+$function$;
+
+-- Deleting the cached reading (retention, manual cleanup) falls back to the
+-- next newest one through the (city_id, reading_timestamp) index.
+create or replace function public.refresh_latest_air_quality_by_city_on_delete()
+returns trigger
+language plpgsql
+set search_path = public, pg_temp
+as $function$
+begin
+  if not exists (
+    select 1
+    from public.latest_air_quality_by_city latest
+    where latest.city_id = old.city_id
+      and latest.reading_timestamp = old.reading_timestamp
+  ) then
+    return null;
+  end if;
+
+  delete from public.latest_air_quality_by_city where city_id = old.city_id;
+
+  insert into public.latest_air_quality_by_city (
+    city_id,
+    reading_timestamp,
+    aqi_us,
+    main_pollutant_us,
+    temperature_c,
+    humidity_percent,
+    wind_speed_ms,
+    wind_direction_deg,
+    weather_icon,
+    weather_temperature_c,
+    weather_humidity_percent,
+    weather_wind_speed_kmh,
+    weather_wind_direction_deg,
+    weather_wind_gust_kmh,
+    weather_provider,
+    weather_timestamp
+  )
+  select
+    aqr.city_id,
+    aqr.reading_timestamp,
+    aqr.aqi_us,
+    aqr.main_pollutant_us,
+    aqr.temperature_c,
+    aqr.humidity_percent,
+    aqr.wind_speed_ms,
+    aqr.wind_direction_deg,
+    aqr.weather_icon,
+    aqr.weather_temperature_c,
+    aqr.weather_humidity_percent,
+    aqr.weather_wind_speed_kmh,
+    aqr.weather_wind_direction_deg,
+    aqr.weather_wind_gust_kmh,
+    aqr.weather_provider,
+    aqr.weather_timestamp
+  from public.air_quality_readings aqr
+  where aqr.city_id = old.city_id
+  order by aqr.reading_timestamp desc
+  limit 1;
+
+  return null;
+end;
+$function$;
+
+drop trigger if exists air_quality_readings_refresh_latest on public.air_quality_readings;
+create trigger air_quality_readings_refresh_latest
+  after insert or update on public.air_quality_readings
+  for each row
+  execute function public.refresh_latest_air_quality_by_city();
+
+drop trigger if exists air_quality_readings_refresh_latest_on_delete on public.air_quality_readings;
+create trigger air_quality_readings_refresh_latest_on_delete
+  after delete on public.air_quality_readings
+  for each row
+  execute function public.refresh_latest_air_quality_by_city_on_delete();
+
+-- Seed from the existing history once.
+insert into public.latest_air_quality_by_city (
+  city_id,
+  reading_timestamp,
+  aqi_us,
+  main_pollutant_us,
+  temperature_c,
+  humidity_percent,
+  wind_speed_ms,
+  wind_direction_deg,
+  weather_icon,
+  weather_temperature_c,
+  weather_humidity_percent,
+  weather_wind_speed_kmh,
+  weather_wind_direction_deg,
+  weather_wind_gust_kmh,
+  weather_provider,
+  weather_timestamp
+)
+select distinct on (aqr.city_id)
+  aqr.city_id,
+  aqr.reading_timestamp,
+  aqr.aqi_us,
+  aqr.main_pollutant_us,
+  aqr.temperature_c,
+  aqr.humidity_percent,
+  aqr.wind_speed_ms,
+  aqr.wind_direction_deg,
+  aqr.weather_icon,
+  aqr.weather_temperature_c,
+  aqr.weather_humidity_percent,
+  aqr.weather_wind_speed_kmh,
+  aqr.weather_wind_direction_deg,
+  aqr.weather_wind_gust_kmh,
+  aqr.weather_provider,
+  aqr.weather_timestamp
+from public.air_quality_readings aqr
+order by aqr.city_id, aqr.reading_timestamp desc
+on conflict (city_id) do nothing;
+
+-- Same columns and order as get_latest_air_quality_per_city().
+create or replace function public.get_latest_air_quality_per_city_cached()
+returns table(
+  city_id bigint,
+  city_name text,
+  api_name text,
+  latitude double precision,
+  longitude double precision,
+  reading_timestamp timestamp with time zone,
+  aqi_us smallint,
+  main_pollutant_us text,
+  temperature_c real,
+  humidity_percent smallint,
+  wind_speed_ms real,
+  wind_direction_deg smallint,
+  weather_icon text,
+  last_successful_update_at timestamp with time zone,
+  weather_temperature_c real,
+  weather_humidity_percent smallint,
+  weather_wind_speed_kmh real,
+  weather_wind_direction_deg smallint,
+  weather_wind_gust_kmh real,
+  weather_provider text,
+  weather_timestamp timestamp with time zone
+)
+language sql
+stable
+security definer
+set search_path = public, pg_temp
+as $function$
+  select
+    latest.city_id,
+    c.name as city_name,
+    c.api_name as api_name,
+    c.latitude,
+    c.longitude,
+    latest.reading_timestamp,
+    latest.aqi_us,
+    latest.main_pollutant_us,
+    latest.temperature_c,
+    latest.humidity_percent,
+    latest.wind_speed_ms,
+    latest.wind_direction_deg,
+    latest.weather_icon,
+    c.last_successful_update_at,
+    latest.weather_temperature_c,
+    latest.weather_humidity_percent,
+    latest.weather_wind_speed_kmh,
+    latest.weather_wind_direction_deg,
+    latest.weather_wind_gust_kmh,
+    latest.weather_provider,
+    latest.weather_timestamp
+  from public.latest_air_quality_by_city latest
+  join public.cities c on latest.city_id = c.id
+  where c.is_active = true
+  order by c.name asc;
+$function$;
+
+grant execute on function public.get_latest_air_quality_per_city_cached() to anon, authenticated, service_role;
@@ -0,0 +1,95 @@
+-- get_latest_air_quality_per_city: one index probe per active city.
+-- The previous body ranked every air_quality_readings row with row_number()
+-- and filtered rn = 1, so each call sorted/scanned the full history. The
+-- LATERAL ... order by reading_timestamp desc limit 1 below walks the
+-- (city_id, reading_timestamp) unique index from
+-- 20260602090000_add_air_quality_readings_city_timestamp_unique.sql backwards
+-- and stops at the first row, so the cost no longer grows with history.
+--
+-- A separate (city_id, reading_timestamp desc) index is not needed: btree
+-- indexes scan in both directions and the plan is the same.
+--
+-- Output columns, column order, the active-city filter, the inner-join
+-- semantics (cities without readings are omitted) and the city_name ordering
+-- are unchanged. Compare plans before applying with
+-- supabase/benchmarks/latest_air_quality_rpc_explain.sql.
+--
+-- Rollback: re-apply 20260525045500_update_latest_air_quality_rpc_weather_context.sql.
+
+create or replace function public.get_latest_air_quality_per_city()
+returns table(
+  city_id bigint,
+  city_name text,
+  api_name text,
+  latitude double precision,
+  longitude double precision,
+  reading_timestamp timestamp with time zone,
+  aqi_us smallint,
+  main_pollutant_us text,
+  temperature_c real,
+  humidity_percent smallint,
+  wind_speed_ms real,
+  wind_direction_deg smallint,
+  weather_icon text,
+  last_successful_update_at timestamp with time zone,
+  weather_temperature_c real,
+  weather_humidity_percent smallint,
+  weather_wind_speed_kmh real,
+  weather_wind_direction_deg smallint,
+  weather_wind_gust_kmh real,
+  weather_provider text,
+  weather_timestamp timestamp with time zone
+)
+language sql
+stable
+security definer
+set search_path = public, pg_temp
+as $function$
+  select
+    c.id as city_id,
+    c.name as city_name,
+    c.api_name as api_name,
+    c.latitude,
+    c.longitude,
+    aqr.reading_timestamp,
+    aqr.aqi_us,
+    aqr.main_pollutant_us,
+    aqr.temperature_c,
+    aqr.humidity_percent,
+    aqr.wind_speed_ms,
+    aqr.wind_direction_deg,
+    aqr.weather_icon,
+    c.last_successful_update_at,
+    aqr.weather_temperature_c,
+    aqr.weather_humidity_percent,
+    aqr.weather_wind_speed_kmh,
+    aqr.weather_wind_direction_deg,
+    aqr.weather_wind_gust_kmh,
+    aqr.weather_provider,
+    aqr.weather_timestamp
+  from public.cities c
+  cross join lateral (
+    select
+      r.reading_timestamp,
+      r.aqi_us,
+      r.main_pollutant_us,
+      r.temperature_c,
+      r.humidity_percent,
+      r.wind_speed_ms,
+      r.wind_direction_deg,
+      r.weather_icon,
+      r.weather_temperature_c,
+      r.weather_humidity_percent,
+      r.weather_wind_speed_kmh,
+      r.weather_wind_direction_deg,
+      r.weather_wind_gust_kmh,
+      r.weather_provider,
+      r.weather_timestamp
+    from public.air_quality_readings r
+    where r.city_id = c.id
+    order by r.reading_timestamp desc
+    limit 1
+  ) aqr
+  where c.is_active = true
+  order by c.name asc;
+$function$;
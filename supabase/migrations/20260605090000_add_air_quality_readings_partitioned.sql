@@ -0,0 +1,222 @@
+-- Monthly range partitioning for air_quality_readings, step 1 of 2 (online).
+--
+-- Creates air_quality_readings_partitioned, partitioned by reading_timestamp
+-- month, next to the live table. Nothing is renamed and the pipeline keeps
+-- writing to public.air_quality_readings. This migration adds:
+--   * ensure_air_quality_readings_partitions(): creates monthly partitions
+--     ahead of time and BRIN-indexes closed months (scheduled with pg_cron
+--     when the extension is available),
+--   * a dual-write trigger so rows written during the copy reach both tables,
+--   * copy_air_quality_readings_to_partitioned(): a procedure that copies the
+--     history in short committed chunks.
+--
+-- Step 2, the rename cutover, is supabase/partitioning/air_quality_readings_cutover.sql
+-- and is run manually once the copy has caught up. See
+-- docs/pipeline-runtime-operations.md "Monthly partitioning".
+--
+-- Rollback (before cutover):
+--   select cron.unschedule('air_quality_readings_partitions');  -- if pg_cron
+--   drop trigger if exists air_quality_readings_dual_write on public.air_quality_readings;
+--   drop function if exists public.dual_write_air_quality_readings_partitioned();
+--   drop procedure if exists public.copy_air_quality_readings_to_partitioned(interval);
+--   drop function if exists public.ensure_air_quality_readings_partitions(integer);
+--   drop table if exists public.air_quality_readings_partitioned;
+--   drop sequence if exists public.air_quality_readings_partitioned_id_seq;
+
+create table if not exists public.air_quality_readings_partitioned (
+  like public.air_quality_readings including defaults including comments
+) partition by range (reading_timestamp);
+
+-- Identity columns cannot be copied onto a partitioned table on Postgres 15;
+-- give a bigint identity id its own sequence instead.
+do $block$
+begin
+  if exists (
+    select 1
+    from information_schema.columns
+    where table_schema = 'public'
+      and table_name = 'air_quality_readings'
+      and column_name = 'id'
+      and is_identity = 'YES'
+  ) then
+    create sequence if not exists public.air_quality_readings_partitioned_id_seq as bigint;
+    alter table public.air_quality_readings_partitioned
+      alter column id set default nextval('public.air_quality_readings_partitioned_id_seq');
+  end if;
+end;
+$block$;
+
+-- Same uniqueness as 20260602090000; includes the partition key as required.
+create unique index if not exists air_quality_readings_partitioned_city_id_reading_timestamp_key
+  on public.air_quality_readings_partitioned (city_id, reading_timestamp);
+
+-- LIKE copies no constraints, so id would lose its primary key at cutover.
+-- A partitioned table's primary key must include the partition key.
+do $block$
+begin
+  if not exists (
+    select 1
+    from pg_constraint
+    where conrelid = 'public.air_quality_readings_partitioned'::regclass
+      and contype = 'p'
+  ) then
+    alter table public.air_quality_readings_partitioned
+      add constraint air_quality_readings_partitioned_pkey primary key (id, reading_timestamp);
+  end if;
+end;
+$block$;
+
+-- Catches rows outside every monthly partition so inserts never fail. It
+-- should stay empty; ensure_air_quality_readings_partitions() keeps months ahead.
+create table if not exists public.air_quality_readings_p_default
+  partition of public.air_quality_readings_partitioned default;
+
+alter table public.air_quality_readings_partitioned enable row level security;
+
+create or replace function public.ensure_air_quality_readings_partitions(p_months_ahead integer default 3)
+returns integer
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  -- After the cutover the partitioned table is public.air_quality_readings.
+  v_parent text := case
+    when to_regclass('public.air_quality_readings_partitioned') is not null
+      then 'air_quality_readings_partitioned'
+    else 'air_quality_readings'
+  end;
+  v_first_month date;
+  v_month date;
+  v_partition text;
+  v_created integer := 0;
+begin
+  select date_trunc('month', coalesce(min(reading_timestamp), now()) at time zone 'UTC')::date
+  into v_first_month
+  from public.air_quality_readings;
+
+  v_month := v_first_month;
+  while v_month <= (date_trunc('month', now() at time zone 'UTC') + make_interval(months => p_months_ahead))::date loop
+    v_partition := format('air_quality_readings_p%s', to_char(v_month, 'YYYY_MM'));
+    if to_regclass(format('public.%I', v_partition)) is null then
+      execute format(
+        'create table public.%I partition of public.%I for values from (%L) to (%L)',
+        v_partition,
+        v_parent,
+        (v_month::timestamp at time zone 'UTC'),
+        ((v_month + interval '1 month')::timestamp at time zone 'UTC')
+      );
+      execute format('alter table public.%I enable row level security', v_partition);
+      v_created := v_created + 1;
+    end if;
+
+    -- Closed months are append-complete: a BRIN index on reading_timestamp
+    -- keeps time-window scans cheap at a few pages per partition.
+    if v_month < date_trunc('month', now() at time zone 'UTC')::date
+      and to_regclass(format('public.%I', v_partition || '_reading_timestamp_brin')) is null then
+      execute format(
+        'create index %I on public.%I using brin (reading_timestamp)',
+        v_partition || '_reading_timestamp_brin',
+        v_partition
+      );
+    end if;
+
+    v_month := (v_month + interval '1 month')::date;
+  end loop;
+
+  return v_created;
+end;
+$function$;
+
+select public.ensure_air_quality_readings_partitions();
+
+-- Run monthly partition maintenance daily when pg_cron is installed.
+do $block$
+begin
+  if exists (select 1 from pg_extension where extname = 'pg_cron') then
+    perform cron.schedule(
+      'air_quality_readings_partitions',
+      '15 3 * * *',
+      'select public.ensure_air_quality_readings_partitions()'
+    );
+  else
+    raise notice 'pg_cron not installed: schedule public.ensure_air_quality_readings_partitions() externally.';
+  end if;
+end;
+$block$;
+
+-- Keep both tables in step while the history is copied. Removed at cutover.
+create or replace function public.dual_write_air_quality_readings_partitioned()
+returns trigger
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $function$
+begin
+  if tg_op = 'DELETE' then
+    delete from public.air_quality_readings_partitioned p
+    where p.city_id = old.city_id
+      and p.reading_timestamp = old.reading_timestamp;
+    return null;
+  end if;
+
+  if tg_op = 'UPDATE' then
+    delete from public.air_quality_readings_partitioned p
+    where p.city_id = old.city_id
+      and p.reading_timestamp = old.reading_timestamp;
+  end if;
+
+  insert into public.air_quality_readings_partitioned
+  select (new).*
+  on conflict (city_id, reading_timestamp) do nothing;
+  return null;
+end;
+$function$;
+
+drop trigger if exists air_quality_readings_dual_write on public.air_quality_readings;
+create trigger air_quality_readings_dual_write
+  after insert or update or delete on public.air_quality_readings
+  for each row
+  execute function public.dual_write_air_quality_readings_partitioned();
+
+-- Copies the history oldest-first, one p_chunk window per transaction, so no
+-- lock is held for longer than one chunk. Safe to stop and re-run: rows already
+-- copied (or dual-written) are skipped by the unique index.
+--   call public.copy_air_quality_readings_to_partitioned();
+--   call public.copy_air_quality_readings_to_partitioned(interval '1 day');
+-- No SET search_path here: a procedure with SET cannot COMMIT.
+create or replace procedure public.copy_air_quality_readings_to_partitioned(p_chunk interval default interval '7 days')
+language plpgsql
+as $procedure$
+declare
+  v_from timestamp with time zone;
+  v_until timestamp with time zone;
+  v_rows bigint;
+begin
+  select min(reading_timestamp), max(reading_timestamp)
+  into v_from, v_until
+  from public.air_quality_readings;
+
+  if v_from is null then
+    raise notice 'air_quality_readings is empty; nothing to copy.';
+    return;
+  end if;
+
+  while v_from <= v_until loop
+    insert into public.air_quality_readings_partitioned
+    select *
+    from public.air_quality_readings
+    where reading_timestamp >= v_from
+      and reading_timestamp < v_from + p_chunk
+    on conflict (city_id, reading_timestamp) do nothing;
+
+    get diagnostics v_rows = row_count;
+    raise notice 'copied % rows in [%, %)', v_rows, v_from, v_from + p_chunk;
+    v_from := v_from + p_chunk;
+    commit;
+  end loop;
+end;
+$procedure$;
+
+revoke all on function public.ensure_air_quality_readings_partitions(integer) from public, anon, authenticated;
+revoke all on procedure public.copy_air_quality_readings_to_partitioned(interval) from public, anon, authenticated;
@@ -0,0 +1,304 @@
+-- Hourly and daily rollups of air_quality_readings per city.
+-- Charts read air_quality_hourly / air_quality_daily through
+-- get_air_quality_rollups() instead of aggregating raw readings: 90 days is
+-- 90 daily rows (or ~2160 hourly rows) per city.
+--
+-- Rollups are maintained incrementally by the pipeline: at the end of each run
+-- main.py calls refresh_air_quality_rollups() with the (city_id,
+-- reading_timestamp) pairs it inserted, and only the hour/day buckets that
+-- contain them are recomputed from raw readings. Recomputing (not adding) keeps
+-- the refresh idempotent, so a retried or overlapping run cannot double count.
+-- scripts/weather_history_backfill.py --apply and scripts/raw_payload_retention.py
+-- call refresh_air_quality_rollups_for_range() for the windows they change.
+--
+-- Daily buckets are America/Monterrey calendar days; hourly buckets are UTC hours.
+--
+-- Rollback:
+--   drop function if exists public.get_air_quality_rollups(bigint, timestamptz, timestamptz, text);
+--   drop function if exists public.refresh_air_quality_rollups(jsonb);
+--   drop function if exists public.refresh_air_quality_rollups_for_range(bigint, timestamptz, timestamptz);
+--   drop table if exists public.air_quality_daily;
+--   drop table if exists public.air_quality_hourly;
+
+create table if not exists public.air_quality_hourly (
+  city_id bigint not null references public.cities (id) on delete cascade,
+  bucket_start timestamp with time zone not null,
+  readings_count integer not null,
+  aqi_avg numeric(5, 1),
+  aqi_min smallint,
+  aqi_max smallint,
+  pollutant_counts jsonb not null default '{}'::jsonb,
+  weather_temperature_c_avg real,
+  weather_humidity_percent_avg real,
+  weather_wind_speed_kmh_avg real,
+  refreshed_at timestamp with time zone not null default now(),
+  primary key (city_id, bucket_start)
+);
+
+create table if not exists public.air_quality_daily (
+  city_id bigint not null references public.cities (id) on delete cascade,
+  bucket_date date not null,
+  bucket_start timestamp with time zone not null,
+  readings_count integer not null,
+  aqi_avg numeric(5, 1),
+  aqi_min smallint,
+  aqi_max smallint,
+  pollutant_counts jsonb not null default '{}'::jsonb,
+  weather_temperature_c_avg real,
+  weather_humidity_percent_avg real,
+  weather_wind_speed_kmh_avg real,
+  refreshed_at timestamp with time zone not null default now(),
+  primary key (city_id, bucket_date)
+);
+
+comment on table public.air_quality_hourly is
+  'Per-city UTC-hour rollup of air_quality_readings. Refreshed by refresh_air_quality_rollups().';
+comment on table public.air_quality_daily is
+  'Per-city America/Monterrey-day rollup of air_quality_readings. Refreshed by refresh_air_quality_rollups().';
+
+-- Only reachable through the security definer RPCs.
+alter table public.air_quality_hourly enable row level security;
+alter table public.air_quality_daily enable row level security;
+revoke all on table public.air_quality_hourly from anon, authenticated;
+revoke all on table public.air_quality_daily from anon, authenticated;
+
+-- Recompute every hourly and daily bucket of one city that overlaps
+-- [p_from, p_to). Bounds are widened to whole buckets.
+create or replace function public.refresh_air_quality_rollups_for_range(
+  p_city_id bigint,
+  p_from timestamp with time zone,
+  p_to timestamp with time zone
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  v_hour_from timestamp with time zone := date_trunc('hour', p_from);
+  v_hour_to timestamp with time zone := date_trunc('hour', p_to - interval '1 microsecond') + interval '1 hour';
+  v_day_from timestamp with time zone := date_trunc('day', p_from, 'America/Monterrey');
+  v_day_to timestamp with time zone := date_trunc('day', p_to - interval '1 microsecond', 'America/Monterrey') + interval '1 day';
+  v_hourly integer := 0;
+  v_daily integer := 0;
+begin
+  delete from public.air_quality_hourly
+  where city_id = p_city_id and bucket_start >= v_hour_from and bucket_start < v_hour_to;
+
+  insert into public.air_quality_hourly (
+    city_id, bucket_start, readings_count, aqi_avg, aqi_min, aqi_max, pollutant_counts,
+    weather_temperature_c_avg, weather_humidity_percent_avg, weather_wind_speed_kmh_avg
+  )
+  select
+    b.city_id,
+    b.bucket_start,
+    b.readings_count,
+    b.aqi_avg,
+    b.aqi_min,
+    b.aqi_max,
+    coalesce(p.pollutant_counts, '{}'::jsonb),
+    b.weather_temperature_c_avg,
+    b.weather_humidity_percent_avg,
+    b.weather_wind_speed_kmh_avg
+  from (
+    select
+      aqr.city_id,
+      date_trunc('hour', aqr.reading_timestamp) as bucket_start,
+      count(*)::integer as readings_count,
+      round(avg(aqr.aqi_us), 1) as aqi_avg,
+      min(aqr.aqi_us) as aqi_min,
+      max(aqr.aqi_us) as aqi_max,
+      avg(aqr.weather_temperature_c)::real as weather_temperature_c_avg,
+      avg(aqr.weather_humidity_percent)::real as weather_humidity_percent_avg,
+      avg(aqr.weather_wind_speed_kmh)::real as weather_wind_speed_kmh_avg
+    from public.air_quality_readings aqr
+    where aqr.city_id = p_city_id
+      and aqr.reading_timestamp >= v_hour_from
+      and aqr.reading_timestamp < v_hour_to
+    group by 1, 2
+  ) b
+  left join (
+    select bucket_start, jsonb_object_agg(main_pollutant_us, readings) as pollutant_counts
+    from (
+      select date_trunc('hour', aqr.reading_timestamp) as bucket_start, aqr.main_pollutant_us, count(*) as readings
+      from public.air_quality_readings aqr
+      where aqr.city_id = p_city_id
+        and aqr.reading_timestamp >= v_hour_from
+        and aqr.reading_timestamp < v_hour_to
+        and aqr.main_pollutant_us is not null
+      group by 1, 2
+    ) pollutants
+    group by bucket_start
+  ) p using (bucket_start);
+
+  get diagnostics v_hourly = row_count;
+
+  delete from public.air_quality_daily
+  where city_id = p_city_id and bucket_start >= v_day_from and bucket_start < v_day_to;
+
+  insert into public.air_quality_daily (
+    city_id, bucket_date, bucket_start, readings_count, aqi_avg, aqi_min, aqi_max, pollutant_counts,
+    weather_temperature_c_avg, weather_humidity_percent_avg, weather_wind_speed_kmh_avg
+  )
+  select
+    b.city_id,
+    (b.bucket_start at time zone 'America/Monterrey')::date,
+    b.bucket_start,
+    b.readings_count,
+    b.aqi_avg,
+    b.aqi_min,
+    b.aqi_max,
+    coalesce(p.pollutant_counts, '{}'::jsonb),
+    b.weather_temperature_c_avg,
+    b.weather_humidity_percent_avg,
+    b.weather_wind_speed_kmh_avg
+  from (
+    select
+      aqr.city_id,
+      date_trunc('day', aqr.reading_timestamp, 'America/Monterrey') as bucket_start,
+      count(*)::integer as readings_count,
+      round(avg(aqr.aqi_us), 1) as aqi_avg,
+      min(aqr.aqi_us) as aqi_min,
+      max(aqr.aqi_us) as aqi_max,
+      avg(aqr.weather_temperature_c)::real as weather_temperature_c_avg,
+      avg(aqr.weather_humidity_percent)::real as weather_humidity_percent_avg,
+      avg(aqr.weather_wind_speed_kmh)::real as weather_wind_speed_kmh_avg
+    from public.air_quality_readings aqr
+    where aqr.city_id = p_city_id
+      and aqr.reading_timestamp >= v_day_from
+      and aqr.reading_timestamp < v_day_to
+    group by 1, 2
+  ) b
+  left join (
+    select bucket_start, jsonb_object_agg(main_pollutant_us, readings) as pollutant_counts
+    from (
+      select
+        date_trunc('day', aqr.reading_timestamp, 'America/Monterrey') as bucket_start,
+        aqr.main_pollutant_us,
+        count(*) as readings
+      from public.air_quality_readings aqr
+      where aqr.city_id = p_city_id
+        and aqr.reading_timestamp >= v_day_from
+        and aqr.reading_timestamp < v_day_to
+        and aqr.main_pollutant_us is not null
+      group by 1, 2
+    ) pollutants
+    group by bucket_start
+  ) p using (bucket_start);
+
+  get diagnostics v_daily = row_count;
+
+  return jsonb_build_object('hourly_buckets', v_hourly, 'daily_buckets', v_daily);
+end;
+$function$;
+
+-- Pipeline entry point. p_readings: [{"city_id": 1, "reading_timestamp": "..."}, ...]
+-- Only the buckets spanned by each city's inserted readings are recomputed.
+create or replace function public.refresh_air_quality_rollups(p_readings jsonb)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  v_city record;
+  v_refreshed jsonb;
+  v_cities integer := 0;
+  v_hourly integer := 0;
+  v_daily integer := 0;
+begin
+  for v_city in
+    select
+      (item ->> 'city_id')::bigint as city_id,
+      min((item ->> 'reading_timestamp')::timestamptz) as first_reading,
+      max((item ->> 'reading_timestamp')::timestamptz) as last_reading
+    from jsonb_array_elements(coalesce(p_readings, '[]'::jsonb)) as item
+    where item ->> 'city_id' is not null
+      and item ->> 'reading_timestamp' is not null
+    group by 1
+  loop
+    v_refreshed := public.refresh_air_quality_rollups_for_range(
+      v_city.city_id,
+      v_city.first_reading,
+      v_city.last_reading + interval '1 microsecond'
+    );
+    v_cities := v_cities + 1;
+    v_hourly := v_hourly + (v_refreshed ->> 'hourly_buckets')::integer;
+    v_daily := v_daily + (v_refreshed ->> 'daily_buckets')::integer;
+  end loop;
+
+  return jsonb_build_object('cities', v_cities, 'hourly_buckets', v_hourly, 'daily_buckets', v_daily);
+end;
+$function$;
+
+-- Chart read path. p_granularity: 'hourly' or 'daily'.
+create or replace function public.get_air_quality_rollups(
+  p_city_id bigint,
+  p_from timestamp with time zone,
+  p_to timestamp with time zone,
+  p_granularity text default 'daily'
+)
+returns table(
+  city_id bigint,
+  bucket_start timestamp with time zone,
+  readings_count integer,
+  aqi_avg numeric,
+  aqi_min smallint,
+  aqi_max smallint,
+  pollutant_counts jsonb,
+  weather_temperature_c_avg real,
+  weather_humidity_percent_avg real,
+  weather_wind_speed_kmh_avg real
+)
+language plpgsql
+stable
+security definer
+set search_path = public, pg_temp
+as $function$
+begin
+  if p_granularity = 'hourly' then
+    return query
+      select h.city_id, h.bucket_start, h.readings_count, h.aqi_avg, h.aqi_min, h.aqi_max,
+        h.pollutant_counts, h.weather_temperature_c_avg, h.weather_humidity_percent_avg,
+        h.weather_wind_speed_kmh_avg
+      from public.air_quality_hourly h
+      where h.city_id = p_city_id and h.bucket_start >= p_from and h.bucket_start < p_to
+      order by h.bucket_start;
+  elsif p_granularity = 'daily' then
+    return query
+      select d.city_id, d.bucket_start, d.readings_count, d.aqi_avg, d.aqi_min, d.aqi_max,
+        d.pollutant_counts, d.weather_temperature_c_avg, d.weather_humidity_percent_avg,
+        d.weather_wind_speed_kmh_avg
+      from public.air_quality_daily d
+      where d.city_id = p_city_id and d.bucket_start >= p_from and d.bucket_start < p_to
+      order by d.bucket_start;
+  else
+    raise exception 'get_air_quality_rollups: p_granularity must be hourly or daily, got %', p_granularity;
+  end if;
+end;
+$function$;
+
+-- Seed from existing history, one city at a time.
+do $block$
+declare
+  v_city record;
+begin
+  for v_city in
+    select city_id, min(reading_timestamp) as first_reading, max(reading_timestamp) as last_reading
+    from public.air_quality_readings
+    group by city_id
+  loop
+    perform public.refresh_air_quality_rollups_for_range(
+      v_city.city_id,
+      v_city.first_reading,
+      v_city.last_reading + interval '1 microsecond'
+    );
+  end loop;
+end;
+$block$;
+
+revoke all on function public.refresh_air_quality_rollups_for_range(bigint, timestamptz, timestamptz) from public, anon, authenticated;
+revoke all on function public.refresh_air_quality_rollups(jsonb) from public, anon, authenticated;
+grant execute on function public.refresh_air_quality_rollups_for_range(bigint, timestamptz, timestamptz) to service_role;
+grant execute on function public.refresh_air_quality_rollups(jsonb) to service_role;
+grant execute on function public.get_air_quality_rollups(bigint, timestamptz, timestamptz, text) to anon, authenticated, service_role;
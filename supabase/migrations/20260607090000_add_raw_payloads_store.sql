@@ -0,0 +1,178 @@
+-- Content-addressed store for raw provider payloads.
+--
+-- Cities that share a WAQI station, and stations that did not change between
+-- runs, produce byte-identical payloads. raw_payloads keeps each one once, keyed
+-- by the sha256 of its canonical JSON (sorted keys, no whitespace; see
+-- utils.canonical_json_sha256). air_quality_readings.raw_payload_hash points at
+-- it and raw_api_response is left null for rows written this way. Rows written
+-- before this migration, or with PIPELINE_RAW_PAYLOAD_STORE=inline, keep the
+-- inline jsonb. air_quality_readings_with_raw_payload reads both kinds.
+--
+-- Rollback:
+--   drop view if exists public.air_quality_readings_with_raw_payload;
+--   re-apply 20260602090000_add_air_quality_readings_city_timestamp_unique.sql
+--     (ingest_air_quality_reading without raw_payload_hash);
+--   alter table public.air_quality_readings_partitioned drop column if exists raw_payload_hash;
+--   alter table public.air_quality_readings drop column if exists raw_payload_hash;
+--   drop table if exists public.raw_payloads;
+-- Set PIPELINE_RAW_PAYLOAD_STORE=inline before rolling back.
+
+create table if not exists public.raw_payloads (
+  hash text primary key check (hash ~ '^[0-9a-f]{64}$'),
+  payload jsonb not null,
+  created_at timestamp with time zone not null default now()
+);
+
+alter table public.raw_payloads enable row level security;
+
+alter table public.air_quality_readings
+  add column if not exists raw_payload_hash text references public.raw_payloads (hash);
+
+-- Serves the foreign key check when unreferenced payloads are deleted.
+create index if not exists air_quality_readings_raw_payload_hash_idx
+  on public.air_quality_readings (raw_payload_hash)
+  where raw_payload_hash is not null;
+
+-- The dual-write trigger and copy procedure from 20260605090000 insert whole
+-- rows positionally, so the shadow table needs the same trailing column.
+do $block$
+begin
+  if to_regclass('public.air_quality_readings_partitioned') is not null then
+    alter table public.air_quality_readings_partitioned
+      add column if not exists raw_payload_hash text references public.raw_payloads (hash);
+  end if;
+end;
+$block$;
+
+create or replace view public.air_quality_readings_with_raw_payload
+with (security_invoker = true)
+as
+select
+  r.*,
+  coalesce(r.raw_api_response, p.payload) as raw_payload
+from public.air_quality_readings r
+left join public.raw_payloads p on p.hash = r.raw_payload_hash;
+
+-- ingest_air_quality_reading: also stores raw_payload_hash. The payload row is
+-- written by the pipeline before the RPC call.
+create or replace function public.ingest_air_quality_reading(payload jsonb)
+returns jsonb
+language plpgsql
+volatile
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  v_city_id bigint := (payload ->> 'city_id')::bigint;
+  v_reading jsonb := payload -> 'reading';
+  v_city_status jsonb := coalesce(payload -> 'city_status', '{}'::jsonb);
+  v_reading_inserted boolean := false;
+  v_reading_duplicate boolean := false;
+  v_reading_rows integer := 0;
+  v_city_rows integer := 0;
+  v_result jsonb;
+begin
+  if v_city_id is null then
+    raise exception 'ingest_air_quality_reading: city_id is required';
+  end if;
+
+  if v_reading is not null and jsonb_typeof(v_reading) = 'object' then
+    insert into public.air_quality_readings (
+      city_id,
+      reading_timestamp,
+      aqi_us,
+      main_pollutant_us,
+      temperature_c,
+      pressure_hpa,
+      humidity_percent,
+      wind_speed_ms,
+      wind_direction_deg,
+      weather_icon,
+      raw_api_response,
+      raw_payload_hash,
+      weather_temperature_c,
+      weather_humidity_percent,
+      weather_wind_speed_kmh,
+      weather_wind_direction_deg,
+      weather_wind_gust_kmh,
+      weather_provider,
+      weather_timestamp,
+      weather_source_payload
+    )
+    select
+      v_city_id,
+      r.reading_timestamp,
+      r.aqi_us,
+      r.main_pollutant_us,
+      r.temperature_c,
+      r.pressure_hpa,
+      r.humidity_percent,
+      r.wind_speed_ms,
+      r.wind_direction_deg,
+      r.weather_icon,
+      r.raw_api_response,
+      r.raw_payload_hash,
+      r.weather_temperature_c,
+      r.weather_humidity_percent,
+      r.weather_wind_speed_kmh,
+      r.weather_wind_direction_deg,
+      r.weather_wind_gust_kmh,
+      r.weather_provider,
+      r.weather_timestamp,
+      r.weather_source_payload
+    from jsonb_populate_record(null::public.air_quality_readings, v_reading) r
+    on conflict (city_id, reading_timestamp) do nothing;
+
+    get diagnostics v_reading_rows = row_count;
+    v_reading_inserted := v_reading_rows > 0;
+    v_reading_duplicate := v_reading_rows = 0;
+  end if;
+
+  -- Only keys present in city_status are written, matching the PostgREST
+  -- partial update used by PIPELINE_WRITE_MODE=per_city.
+  if v_city_status <> '{}'::jsonb then
+    update public.cities c
+    set
+      last_update_status = case when v_city_status ? 'last_update_status'
+        then v_city_status ->> 'last_update_status' else c.last_update_status end,
+      last_successful_update_at = case when v_city_status ? 'last_successful_update_at'
+        then (v_city_status ->> 'last_successful_update_at')::timestamptz else c.last_successful_update_at end,
+      latitude = case when v_city_status ? 'latitude'
+        then (v_city_status ->> 'latitude')::double precision else c.latitude end,
+      longitude = case when v_city_status ? 'longitude'
+        then (v_city_status ->> 'longitude')::double precision else c.longitude end,
+      updated_at = case when v_city_status ? 'updated_at'
+        then (v_city_status ->> 'updated_at')::timestamptz else c.updated_at end
+    where c.id = v_city_id;
+
+    get diagnostics v_city_rows = row_count;
+  end if;
+
+  v_result := jsonb_build_object(
+    'city_id', v_city_id,
+    'readingInserted', v_reading_inserted,
+    'readingDuplicate', v_reading_duplicate,
+    'cityStatusUpdated', v_city_rows > 0,
+    'insertError', null,
+    'updateError', null,
+    'validationErrors', payload -> 'validation_errors'
+  );
+
+  insert into public.pipeline_logs (city_id, city_name, status, context, details, created_at)
+  values (
+    v_city_id,
+    payload ->> 'city_name',
+    v_city_status ->> 'last_update_status',
+    'update_city',
+    v_result,
+    now()
+  );
+
+  return v_result;
+end;
+$function$;
+
+revoke all on table public.raw_payloads from public, anon, authenticated;
+grant select, insert on table public.raw_payloads to service_role;
+revoke all on table public.air_quality_readings_with_raw_payload from public, anon, authenticated;
+grant select on table public.air_quality_readings_with_raw_payload to service_role;
@@ -0,0 +1,111 @@
+-- Deferred weather enrichment queue.
+--
+-- With PIPELINE_WEATHER_ENRICHMENT=deferred the pipeline inserts each AQI
+-- reading without weather and queues a job here with the reading coordinates
+-- and its WAQI iaqi weather. At the end of the run weather_enrichment.py drains
+-- the queue with batched Open-Meteo requests and calls
+-- apply_weather_enrichment(), which fills the weather_* columns, sets
+-- weather_backfilled_at and removes finished jobs in one transaction. Jobs that
+-- fail stay queued for the next run until p_max_attempts.
+--
+-- Rollback:
+--   drop function if exists public.apply_weather_enrichment(jsonb, jsonb, jsonb, integer);
+--   drop table if exists public.weather_enrichment_queue;
+-- Set PIPELINE_WEATHER_ENRICHMENT=inline before rolling back.
+
+create table if not exists public.weather_enrichment_queue (
+  city_id bigint not null references public.cities (id) on delete cascade,
+  reading_timestamp timestamp with time zone not null,
+  latitude double precision,
+  longitude double precision,
+  waqi_weather jsonb,
+  attempts smallint not null default 0,
+  last_error text,
+  enqueued_at timestamp with time zone not null default now(),
+  primary key (city_id, reading_timestamp)
+);
+
+comment on table public.weather_enrichment_queue is
+  'Readings inserted without weather, pending apply_weather_enrichment(). Written by the pipeline only.';
+
+alter table public.weather_enrichment_queue enable row level security;
+revoke all on table public.weather_enrichment_queue from public, anon, authenticated;
+
+-- p_rows:    [{"city_id", "reading_timestamp", "weather_*"..., "weather_backfilled_at"}, ...]
+-- p_failed:  [{"city_id", "reading_timestamp", "error"}, ...]
+-- p_expired: [{"city_id", "reading_timestamp"}, ...]
+-- Rows that already have weather are left as they are; `updated_readings`
+-- lists the (city_id, reading_timestamp) pairs actually changed, which the
+-- pipeline sends on to refresh_air_quality_rollups().
+create or replace function public.apply_weather_enrichment(
+  p_rows jsonb,
+  p_failed jsonb default '[]'::jsonb,
+  p_expired jsonb default '[]'::jsonb,
+  p_max_attempts integer default 3
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  v_updated jsonb := '[]'::jsonb;
+  v_failed integer := 0;
+  v_dropped integer := 0;
+begin
+  with updated as (
+    update public.air_quality_readings aqr
+    set
+      weather_temperature_c = (item ->> 'weather_temperature_c')::real,
+      weather_humidity_percent = (item ->> 'weather_humidity_percent')::smallint,
+      weather_wind_speed_kmh = (item ->> 'weather_wind_speed_kmh')::real,
+      weather_wind_direction_deg = (item ->> 'weather_wind_direction_deg')::smallint,
+      weather_wind_gust_kmh = (item ->> 'weather_wind_gust_kmh')::real,
+      weather_provider = item ->> 'weather_provider',
+      weather_timestamp = (item ->> 'weather_timestamp')::timestamptz,
+      weather_source_payload = item -> 'weather_source_payload',
+      weather_backfilled_at = (item ->> 'weather_backfilled_at')::timestamptz
+    from jsonb_array_elements(coalesce(p_rows, '[]'::jsonb)) as item
+    where aqr.city_id = (item ->> 'city_id')::bigint
+      and aqr.reading_timestamp = (item ->> 'reading_timestamp')::timestamptz
+      and aqr.weather_provider is null
+    returning aqr.city_id, aqr.reading_timestamp
+  )
+  select coalesce(
+    jsonb_agg(jsonb_build_object('city_id', city_id, 'reading_timestamp', reading_timestamp)),
+    '[]'::jsonb
+  )
+  into v_updated
+  from updated;
+
+  delete from public.weather_enrichment_queue q
+  using jsonb_array_elements(coalesce(p_rows, '[]'::jsonb) || coalesce(p_expired, '[]'::jsonb)) as item
+  where q.city_id = (item ->> 'city_id')::bigint
+    and q.reading_timestamp = (item ->> 'reading_timestamp')::timestamptz;
+
+  update public.weather_enrichment_queue q
+  set attempts = q.attempts + 1,
+      last_error = item ->> 'error'
+  from jsonb_array_elements(coalesce(p_failed, '[]'::jsonb)) as item
+  where q.city_id = (item ->> 'city_id')::bigint
+    and q.reading_timestamp = (item ->> 'reading_timestamp')::timestamptz;
+
+  get diagnostics v_failed = row_count;
+
+  delete from public.weather_enrichment_queue
+  where attempts >= p_max_attempts;
+
+  get diagnostics v_dropped = row_count;
+
+  return jsonb_build_object(
+    'updated', jsonb_array_length(v_updated),
+    'updated_readings', v_updated,
+    'failed', v_failed,
+    'dropped', v_dropped
+  );
+end;
+$function$;
+
+revoke all on function public.apply_weather_enrichment(jsonb, jsonb, jsonb, integer) from public, anon, authenticated;
+grant select, insert, update, delete on table public.weather_enrichment_queue to service_role;
+grant execute on function public.apply_weather_enrichment(jsonb, jsonb, jsonb, integer) to service_role;
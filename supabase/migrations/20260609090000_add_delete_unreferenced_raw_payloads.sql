@@ -0,0 +1,67 @@
+-- Deletes raw_payloads rows that no reading references any more.
+--
+-- A payload loses its last reading when retention downsamples sub-hourly
+-- readings, and is never referenced when the reading write that follows the
+-- payload insert fails (the payload is stored before the reading, outside the
+-- ingest transaction). scripts/raw_payload_retention.py calls this function in
+-- batches. p_created_before leaves recent payloads alone so a run that has
+-- stored a payload but not yet its reading is not affected.
+--
+-- Rollback:
+--   drop function if exists public.delete_unreferenced_raw_payloads(timestamptz, integer, boolean);
+
+create or replace function public.delete_unreferenced_raw_payloads(
+  p_created_before timestamp with time zone,
+  p_limit integer default 1000,
+  p_apply boolean default false
+)
+returns jsonb
+language plpgsql
+volatile
+security definer
+set search_path = public, pg_temp
+as $function$
+declare
+  v_payloads integer := 0;
+  v_bytes bigint := 0;
+begin
+  -- After the partitioning cutover the legacy table keeps its own foreign key
+  -- to raw_payloads; its rows are not checked here.
+  if p_apply and to_regclass('public.air_quality_readings_legacy') is not null then
+    raise exception 'delete_unreferenced_raw_payloads: drop air_quality_readings_legacy first';
+  end if;
+
+  if not p_apply then
+    select count(*), coalesce(sum(pg_column_size(p.payload)), 0)
+    into v_payloads, v_bytes
+    from public.raw_payloads p
+    where p.created_at < p_created_before
+      and not exists (
+        select 1 from public.air_quality_readings r where r.raw_payload_hash = p.hash
+      );
+  else
+    with deleted as (
+      delete from public.raw_payloads p
+      where p.hash in (
+        select candidate.hash
+        from public.raw_payloads candidate
+        where candidate.created_at < p_created_before
+          and not exists (
+            select 1 from public.air_quality_readings r where r.raw_payload_hash = candidate.hash
+          )
+        order by candidate.created_at
+        limit p_limit
+      )
+      returning pg_column_size(p.payload) as payload_bytes
+    )
+    select count(*), coalesce(sum(payload_bytes), 0)
+    into v_payloads, v_bytes
+    from deleted;
+  end if;
+
+  return jsonb_build_object('payloads', v_payloads, 'bytes', v_bytes);
+end;
+$function$;
+
+revoke all on function public.delete_unreferenced_raw_payloads(timestamptz, integer, boolean) from public, anon, authenticated;
+grant execute on function public.delete_unreferenced_raw_payloads(timestamptz, integer, boolean) to service_role;
@@ -0,0 +1,12 @@
+-- Lets scripts/raw_payload_retention.py compact raw_payloads rows in place.
+--
+-- With the hashed store the provider payload of new readings lives in
+-- raw_payloads.payload, not in air_quality_readings.raw_api_response. Retention
+-- rewrites payloads older than its window without WAQI forecast/attributions/
+-- debug and adds "_compacted": true. The hash is left as it is: it identifies
+-- the original payload, and readings reference it.
+--
+-- Rollback:
+--   revoke update on table public.raw_payloads from service_role;
+
+grant update (payload) on table public.raw_payloads to service_role;
@@ -0,0 +1,234 @@
+-- Monthly range partitioning for air_quality_readings, step 2 of 2 (cutover).
+--
+-- Run manually with psql, outside the hourly pipeline window, after
+-- 20260605090000_add_air_quality_readings_partitioned.sql is applied and
+--   call public.copy_air_quality_readings_to_partitioned();
+-- has finished. The swap is two renames in one short transaction; the lock on
+-- air_quality_readings is held only for the final catch-up copy and renames.
+--
+-- Functions (ingest RPC, latest-per-city RPCs, latest table triggers) reference
+-- public.air_quality_readings by name and pick up the partitioned table.
+--
+-- RLS, policies and anon/authenticated select grants are copied from the
+-- legacy table and checked before commit, so API access does not change.
+-- Views are bound to the table, not its name, and would keep reading the
+-- legacy table: air_quality_readings_with_raw_payload (20260607090000) is
+-- recreated on the new table, and the commit is refused if any other view
+-- still depends on the legacy one.
+--
+-- Rollback (after cutover, before dropping the legacy table):
+--   begin;
+--   lock table public.air_quality_readings in access exclusive mode;
+--   insert into public.air_quality_readings_legacy
+--     select * from public.air_quality_readings
+--     on conflict (city_id, reading_timestamp) do nothing;
+--   alter table public.air_quality_readings rename to air_quality_readings_partitioned;
+--   alter table public.air_quality_readings_legacy rename to air_quality_readings;
+--   -- recreate the latest-table triggers on public.air_quality_readings (20260603090000)
+--   -- recreate air_quality_readings_with_raw_payload as below
+--   commit;
+
+\set ON_ERROR_STOP on
+
+begin;
+
+set local lock_timeout = '10s';
+lock table public.air_quality_readings in access exclusive mode;
+
+-- Catch-up for anything the dual-write trigger missed (e.g. rows written
+-- before the trigger existed but after the copy procedure's snapshot).
+insert into public.air_quality_readings_partitioned
+select * from public.air_quality_readings
+where reading_timestamp >= (
+  select coalesce(max(reading_timestamp), '-infinity'::timestamptz) - interval '7 days'
+  from public.air_quality_readings_partitioned
+)
+on conflict (city_id, reading_timestamp) do nothing;
+
+do $block$
+declare
+  v_live bigint;
+  v_partitioned bigint;
+begin
+  select count(*) into v_live from public.air_quality_readings;
+  select count(*) into v_partitioned from public.air_quality_readings_partitioned;
+  if v_live <> v_partitioned then
+    raise exception 'row count mismatch: air_quality_readings=% partitioned=%; re-run the copy', v_live, v_partitioned;
+  end if;
+end;
+$block$;
+
+drop trigger if exists air_quality_readings_dual_write on public.air_quality_readings;
+drop function if exists public.dual_write_air_quality_readings_partitioned();
+
+alter table public.air_quality_readings rename to air_quality_readings_legacy;
+alter table public.air_quality_readings_partitioned rename to air_quality_readings;
+
+-- New ids continue after the copied ones.
+do $block$
+begin
+  if to_regclass('public.air_quality_readings_partitioned_id_seq') is not null then
+    perform setval(
+      'public.air_quality_readings_partitioned_id_seq',
+      coalesce((select max(id) from public.air_quality_readings), 0) + 1,
+      false
+    );
+  end if;
+end;
+$block$;
+
+-- Latest-reading triggers from 20260603090000 stay on the legacy table after
+-- the rename; move them to the partitioned one.
+drop trigger if exists air_quality_readings_refresh_latest on public.air_quality_readings_legacy;
+drop trigger if exists air_quality_readings_refresh_latest_on_delete on public.air_quality_readings_legacy;
+
+create trigger air_quality_readings_refresh_latest
+  after insert or update on public.air_quality_readings
+  for each row
+  execute function public.refresh_latest_air_quality_by_city();
+
+create trigger air_quality_readings_refresh_latest_on_delete
+  after delete on public.air_quality_readings
+  for each row
+  execute function public.refresh_latest_air_quality_by_city_on_delete();
+
+-- Same table privileges as before the swap.
+grant select, insert, update, delete on public.air_quality_readings to service_role;
+
+-- RLS, policies and anon/authenticated read grants stay on the legacy table
+-- after the rename; copy them as they are so API clients see the same rows.
+do $block$
+declare
+  v_policy record;
+  v_role record;
+begin
+  if (select relrowsecurity from pg_class where oid = 'public.air_quality_readings_legacy'::regclass) then
+    alter table public.air_quality_readings enable row level security;
+  else
+    alter table public.air_quality_readings disable row level security;
+  end if;
+  if (select relforcerowsecurity from pg_class where oid = 'public.air_quality_readings_legacy'::regclass) then
+    alter table public.air_quality_readings force row level security;
+  end if;
+
+  for v_policy in
+    select policyname, permissive, roles, cmd, qual, with_check
+    from pg_policies
+    where schemaname = 'public'
+      and tablename = 'air_quality_readings_legacy'
+  loop
+    execute format('drop policy if exists %I on public.air_quality_readings', v_policy.policyname);
+    execute format(
+      'create policy %I on public.air_quality_readings as %s for %s to %s%s%s',
+      v_policy.policyname,
+      v_policy.permissive,
+      v_policy.cmd,
+      (select string_agg(quote_ident(role_name), ', ') from unnest(v_policy.roles) as role_name),
+      coalesce(' using (' || v_policy.qual || ')', ''),
+      coalesce(' with check (' || v_policy.with_check || ')', '')
+    );
+  end loop;
+
+  for v_role in
+    select grantee
+    from information_schema.role_table_grants
+    where table_schema = 'public'
+      and table_name = 'air_quality_readings_legacy'
+      and grantee in ('anon', 'authenticated')
+      and privilege_type = 'SELECT'
+  loop
+    execute format('grant select on public.air_quality_readings to %I', v_role.grantee);
+  end loop;
+end;
+$block$;
+
+-- Point the raw payload view at the partitioned table, with the grants of 20260607090000.
+do $block$
+begin
+  if to_regclass('public.air_quality_readings_with_raw_payload') is not null then
+    drop view public.air_quality_readings_with_raw_payload;
+    create view public.air_quality_readings_with_raw_payload
+    with (security_invoker = true)
+    as
+    select
+      r.*,
+      coalesce(r.raw_api_response, p.payload) as raw_payload
+    from public.air_quality_readings r
+    left join public.raw_payloads p on p.hash = r.raw_payload_hash;
+
+    revoke all on table public.air_quality_readings_with_raw_payload from public, anon, authenticated;
+    grant select on table public.air_quality_readings_with_raw_payload to service_role;
+  end if;
+end;
+$block$;
+
+-- Verify access matches the legacy table before committing the swap.
+do $block$
+declare
+  v_mismatches text;
+begin
+  select string_agg(check_name, ', ') into v_mismatches
+  from (
+    select 'row level security' as check_name
+    where (
+      select (relrowsecurity, relforcerowsecurity)
+      from pg_class where oid = 'public.air_quality_readings_legacy'::regclass
+    ) is distinct from (
+      select (relrowsecurity, relforcerowsecurity)
+      from pg_class where oid = 'public.air_quality_readings'::regclass
+    )
+    union all
+    select 'policies'
+    where exists (
+      (
+        select policyname, permissive, roles, cmd, qual, with_check
+        from pg_policies where schemaname = 'public' and tablename = 'air_quality_readings_legacy'
+        except
+        select policyname, permissive, roles, cmd, qual, with_check
+        from pg_policies where schemaname = 'public' and tablename = 'air_quality_readings'
+      )
+      union all
+      (
+        select policyname, permissive, roles, cmd, qual, with_check
+        from pg_policies where schemaname = 'public' and tablename = 'air_quality_readings'
+        except
+        select policyname, permissive, roles, cmd, qual, with_check
+        from pg_policies where schemaname = 'public' and tablename = 'air_quality_readings_legacy'
+      )
+    )
+    union all
+    select 'select grant for ' || role_name
+    from unnest(array['anon', 'authenticated']) as role_name
+    where has_table_privilege(role_name, 'public.air_quality_readings_legacy', 'select')
+      is distinct from has_table_privilege(role_name, 'public.air_quality_readings', 'select')
+    union all
+    select distinct 'view ' || view_class.oid::regclass::text || ' still reads the legacy table'
+    from pg_depend dependency
+    join pg_rewrite rewrite on rewrite.oid = dependency.objid
+    join pg_class view_class on view_class.oid = rewrite.ev_class
+    where dependency.classid = 'pg_rewrite'::regclass
+      and dependency.refobjid = 'public.air_quality_readings_legacy'::regclass
+      and view_class.oid <> dependency.refobjid
+    union all
+    select 'view grants on air_quality_readings_with_raw_payload'
+    where to_regclass('public.air_quality_readings_with_raw_payload') is not null
+      and (
+        not has_table_privilege('service_role', 'public.air_quality_readings_with_raw_payload', 'select')
+        or has_table_privilege('anon', 'public.air_quality_readings_with_raw_payload', 'select')
+        or has_table_privilege('authenticated', 'public.air_quality_readings_with_raw_payload', 'select')
+      )
+  ) as mismatches;
+
+  if v_mismatches is not null then
+    raise exception 'access or view mismatch after swap (%); the transaction is rolled back', v_mismatches;
+  end if;
+end;
+$block$;
+
+commit;
+
+-- After a few healthy runs:
+--   drop table public.air_quality_readings_legacy;
+-- Archiving an old month is then a metadata-only operation:
+--   alter table public.air_quality_readings detach partition public.air_quality_readings_p2025_01 concurrently;
+--   -- dump/export air_quality_readings_p2025_01, then drop it.
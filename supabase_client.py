@@ -3,13 +3,20 @@ from dotenv import load_dotenv
 import logging
 import os
 import socket
+import threading
 from urllib.parse import urlparse
 
-from supabase import Client, create_client
+from supabase import AsyncClient, Client, acreate_client, create_client
 
 EXPECTED_SUPABASE_DOMAIN_SUFFIX = ".supabase.co"
 NON_API_SUPABASE_HOST_PREFIXES = ("db.",)
 
+# One validated client (and its HTTP connection pool) per process, rebuilt only
+# when SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY change.
+_client_lock = threading.Lock()
+_cached_client: Client | None = None
+_cached_client_config: tuple[str, str] | None = None
+
 
 def get_safe_supabase_url_host(supabase_url: str) -> str:
     """Return a sanitized Supabase API host for logs/errors.
@@ -56,8 +63,8 @@ def validate_supabase_url(supabase_url: str) -> None:
         ) from error
 
 
-def get_supabase_client() -> Client:
-    """Crea y devuelve un cliente de Supabase."""
+def load_supabase_config() -> tuple[str, str]:
+    """Read and validate Supabase credentials from the environment."""
     # Recargar las variables de entorno en cada llamada para permitir su
     # configuración durante las pruebas.
     load_dotenv()
@@ -68,14 +75,56 @@ def get_supabase_client() -> Client:
         raise ValueError("Supabase URL and Service Role Key are required.")
 
     validate_supabase_url(supabase_url)
+    return supabase_url, service_role_key
+
+
+def get_supabase_client() -> Client:
+    """Devuelve el cliente de Supabase del proceso, creandolo una sola vez.
+
+    La validacion de URL (incluido el lookup DNS) y la construccion del cliente
+    solo ocurren en la primera llamada o si cambian las credenciales.
+    """
+    global _cached_client, _cached_client_config
+
+    with _client_lock:
+        current_config = (os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_ROLE_KEY"))
+        if _cached_client is not None and current_config == _cached_client_config:
+            return _cached_client
+
+        supabase_url, service_role_key = load_supabase_config()
+        safe_host = get_safe_supabase_url_host(supabase_url)
+
+        try:
+            client = create_client(supabase_url, service_role_key)
+        except Exception as e:
+            raise Exception(f"Error creating Supabase client for host {safe_host}: {str(e)}")
+
+        logging.info("Supabase API host validated: %s", safe_host)
+        _cached_client = client
+        _cached_client_config = (supabase_url, service_role_key)
+        return client
+
+
+def reset_supabase_client() -> None:
+    """Drop the cached client; used by tests and after credential rotation."""
+    global _cached_client, _cached_client_config
+
+    with _client_lock:
+        _cached_client = None
+        _cached_client_config = None
+
+
+async def get_async_supabase_client() -> AsyncClient:
+    """Crea un cliente async de Supabase para el engine asyncio."""
+    supabase_url, service_role_key = load_supabase_config()
     safe_host = get_safe_supabase_url_host(supabase_url)
 
     try:
-        client = create_client(supabase_url, service_role_key)
-        logging.info("Supabase API host validated: %s", safe_host)
+        client = await acreate_client(supabase_url, service_role_key)
+        logging.info("Supabase async API host validated: %s", safe_host)
         return client
     except Exception as e:
-        raise Exception(f"Error creating Supabase client for host {safe_host}: {str(e)}")
+        raise Exception(f"Error creating async Supabase client for host {safe_host}: {str(e)}")
 
 def get_existing_cities():
     logging.info("Starting Get Existing Cities from Supabase")
@@ -84,8 +133,10 @@ def get_existing_cities():
     logging.info("Supabase client created successfully.")
 
     try:
-        logging.info("Querying 'cities' table for columns: id, api_name, is_active...")
-        response = supabase.table("cities").select("id, api_name, is_active, last_successful_update_at, last_update_status").execute()
+        logging.info("Querying 'cities' table for columns: id, name, api_name, is_active, latitude, longitude...")
+        response = supabase.table("cities").select(
+            "id, name, api_name, is_active, last_successful_update_at, last_update_status, latitude, longitude"
+        ).execute()
 
         if not isinstance(response.data, list):
             raise ValueError("Supabase response is not an array.")
@@ -97,6 +148,17 @@ def get_existing_cities():
         raise Exception(f"Failed to get existing cities from Supabase: {str(e)}")
 
 
+def build_pipeline_log_payload(event: dict) -> dict:
+    return {
+        "city_id": event.get("city_id"),
+        "city_name": event.get("city_name"),
+        "status": event.get("status"),
+        "context": event.get("context"),
+        "details": event.get("details"),
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
 def log_pipeline_event(event: dict):
     """Insert a pipeline log entry into Supabase (best-effort)."""
     if not isinstance(event, dict):
@@ -104,14 +166,19 @@ def log_pipeline_event(event: dict):
 
     try:
         supabase = get_supabase_client()
-        payload = {
-            "city_id": event.get("city_id"),
-            "city_name": event.get("city_name"),
-            "status": event.get("status"),
-            "context": event.get("context"),
-            "details": event.get("details"),
-            "created_at": datetime.utcnow().isoformat(),
-        }
+        payload = build_pipeline_log_payload(event)
         supabase.table("pipeline_logs").insert(payload).execute()
     except Exception as e:
         logging.warning(f"Could not persist pipeline log: {e}")
+
+
+async def log_pipeline_event_async(supabase: AsyncClient, event: dict):
+    """Async best-effort pipeline log insert using an existing async client."""
+    if not isinstance(event, dict):
+        return
+
+    try:
+        payload = build_pipeline_log_payload(event)
+        await supabase.table("pipeline_logs").insert(payload).execute()
+    except Exception as e:
+        logging.warning(f"Could not persist pipeline log: {e}")
@@ -95,7 +95,7 @@ def sync_cities(api_cities_list, db_cities_list, deactivate_missing_cities=True)
             logging.info("[OK] No hay ciudades para desactivar.")
 
         # Actualizar la lista de ciudades después de la sincronización
-        updated_db_cities_list = supabase.table('cities').select('id', 'api_name', 'is_active', 'last_successful_update_at', 'last_update_status').execute().data
+        updated_db_cities_list = supabase.table('cities').select('id', 'name', 'api_name', 'is_active', 'last_successful_update_at', 'last_update_status', 'latitude', 'longitude').execute().data
 
         logging.info('--- Finalizando Sync Cities ---')
         logging.info(f'Resumen: {summary}')
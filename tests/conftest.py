@@ -1,7 +1,42 @@
 import sys
 import os
 
+import pytest
+
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Avoid real sleeps during tests
 os.environ.setdefault('SKIP_PIPELINE_DELAYS', '1')
+
+
+@pytest.fixture(autouse=True)
+def isolated_pipeline_state(tmp_path, monkeypatch):
+    """Keep learned rate limits and other local run state out of the repo."""
+    monkeypatch.setenv('PIPELINE_RATE_STATE_PATH', str(tmp_path / 'rate_limits.json'))
+    monkeypatch.setenv('PIPELINE_WAQI_STATE_PATH', str(tmp_path / 'waqi_stations.json'))
+    monkeypatch.delenv('PIPELINE_WAQI_FETCH_MODE', raising=False)
+    monkeypatch.delenv('PIPELINE_WAQI_RAW_PAYLOAD_MODE', raising=False)
+    # Dedupe loads stored readings from Supabase; tests opt in explicitly.
+    monkeypatch.setenv('PIPELINE_READING_DEDUPE', 'off')
+    monkeypatch.setenv('PIPELINE_ROLLUPS', 'off')
+    monkeypatch.setenv('PIPELINE_ROLLUP_STATE_PATH', str(tmp_path / 'rollups_pending.json'))
+    monkeypatch.setenv('PIPELINE_RAW_PAYLOAD_STORE', 'inline')
+    monkeypatch.delenv('PIPELINE_WEATHER_MODE', raising=False)
+    monkeypatch.setenv('PIPELINE_WEATHER_CACHE', 'off')
+    monkeypatch.setenv('PIPELINE_WEATHER_CACHE_PATH', str(tmp_path / 'weather_cache.sqlite3'))
+    yield
+    import raw_payload_store
+    import reading_dedupe
+    import supabase_client
+    import waqi_api
+    import weather_cache
+    import weather_context
+    import weather_enrichment
+    raw_payload_store.reset_raw_payload_store()
+    reading_dedupe.reset_reading_dedupe()
+    supabase_client.reset_supabase_client()
+    waqi_api.reset_bounds_snapshot()
+    waqi_api.reset_station_fetch_plan()
+    weather_context.reset_weather_prefetch()
+    weather_cache.reset_weather_cache()
+    weather_enrichment.reset_weather_enrichment()
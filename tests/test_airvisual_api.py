@@ -4,8 +4,8 @@ from airvisual_api import fetch_cities, fetch_air_quality_data
 
 @pytest.fixture
 def mock_requests_get():
-    """Fixture to mock requests.get."""
-    with patch('requests.get') as mock_get:
+    """Fixture to mock the pooled HTTP GET used by the adapter."""
+    with patch('airvisual_api.http_get') as mock_get:
         yield mock_get
 
 def test_fetch_cities_success(mock_requests_get):
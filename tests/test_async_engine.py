@@ -0,0 +1,69 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+import async_engine
+import main
+from tests.test_main import CITIES, fake_enrich, fake_fetch, fake_update_city, without_timing
+
+
+@pytest.fixture(autouse=True)
+def pipeline_env(monkeypatch):
+    monkeypatch.setenv("AIR_QUALITY_PROVIDER", "waqi")
+    monkeypatch.setenv("WAQI_API_TOKEN", "token")
+    monkeypatch.setenv("SUPABASE_URL", "https://example-project.supabase.co")
+    monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "test_key")
+    monkeypatch.delenv("PIPELINE_ASYNC_CONCURRENCY", raising=False)
+
+
+async def fake_fetch_async(client, provider, city, env):
+    await asyncio.sleep(0)
+    return fake_fetch(provider, city, env)
+
+
+async def fake_enrich_async(client, reading, canonical_lat=None, canonical_lon=None):
+    return fake_enrich(reading, canonical_lat, canonical_lon)
+
+
+async def fake_update_city_async(fetch_or_skip_result, supabase):
+    return fake_update_city(fetch_or_skip_result)
+
+
+def run_engine(engine):
+    with patch(
+        "main.get_cities_for_provider",
+        return_value=({"provider": "waqi"}, [dict(city) for city in CITIES]),
+    ), patch("main.fetch_provider_air_quality", side_effect=fake_fetch), patch(
+        "main.enrich_with_weather_context", side_effect=fake_enrich
+    ), patch("main.update_city", side_effect=fake_update_city), patch(
+        "async_engine.fetch_provider_air_quality_async", side_effect=fake_fetch_async
+    ), patch(
+        "async_engine.enrich_with_weather_context_async", side_effect=fake_enrich_async
+    ), patch(
+        "async_engine.update_city_async", side_effect=fake_update_city_async
+    ), patch(
+        "async_engine.get_async_supabase_client", new=AsyncMock(return_value=object())
+    ), patch("main.log_pipeline_summary"), patch("main.assert_healthy_summary"):
+        return main.main(force_update=True, max_workers=1, engine=engine)
+
+
+def test_async_engine_produces_same_summary_as_sync_engine():
+    sync_summary = run_engine("sync")
+    async_summary = run_engine("async")
+
+    assert without_timing(async_summary) == without_timing(sync_summary)
+    assert async_summary["timing"]["engine"] == "async"
+    assert async_summary["timing"]["max_workers"] == async_engine.DEFAULT_ASYNC_CONCURRENCY
+
+
+def test_main_rejects_unknown_engine():
+    with pytest.raises(EnvironmentError, match="Engine no soportado"):
+        main.main(engine="celery")
+
+
+def test_get_async_concurrency_rejects_invalid_values(monkeypatch):
+    monkeypatch.setenv("PIPELINE_ASYNC_CONCURRENCY", "-2")
+
+    with pytest.raises(EnvironmentError, match="PIPELINE_ASYNC_CONCURRENCY"):
+        async_engine.get_async_concurrency()
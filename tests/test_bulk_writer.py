@@ -0,0 +1,189 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from postgrest.types import ReturnMethod
+
+import bulk_writer
+import main
+from update_city import build_city_update_plan, build_update_result, update_city
+
+
+CITIES = [
+    {"id": 1, "name": "Monterrey", "api_name": "Monterrey", "is_active": True, "last_update_status": None},
+    {"id": 4, "name": "Guadalupe", "api_name": "Guadalupe", "is_active": True, "last_update_status": None},
+    {"id": 6, "name": "García", "api_name": "Garcia", "is_active": True, "last_update_status": None},
+]
+
+
+def success_fetch_result(city_id):
+    return {
+        "city_id": city_id,
+        "status": "success",
+        "reading_timestamp_iso": "2026-05-25T01:00:00+00:00",
+        "calidad_aire": {"aqi_us": 50},
+        "clima": {"temperatura_c": 25},
+        "coordenadas": {"lat": 25.7, "lon": -100.3},
+        "api_raw_response": {},
+    }
+
+
+@pytest.fixture
+def supabase():
+    client = MagicMock()
+    yield client
+    bulk_writer.finish_bulk_writer()
+
+
+def queue(writer, fetch_result):
+    plan = build_city_update_plan(fetch_result)
+    return writer.submit(plan, build_update_result(plan))
+
+
+def reading_upsert_execute(client):
+    return client.table.return_value.upsert.return_value.select.return_value.execute
+
+
+def return_inserted(client, *city_ids):
+    reading_upsert_execute(client).return_value.data = [
+        {"city_id": city_id, "reading_timestamp": "2026-05-25T01:00:00+00:00"} for city_id in city_ids
+    ]
+
+
+def table_calls(client, table_name):
+    return [call for call in client.table.call_args_list if call.args == (table_name,)]
+
+
+def test_flush_batches_readings_city_upserts_and_logs(supabase):
+    writer = bulk_writer.BulkWriter(supabase, batch_size=10, flush_seconds=60)
+    writer.register_cities(CITIES)
+
+    results = [
+        queue(writer, success_fetch_result(1)),
+        queue(writer, success_fetch_result(4)),
+        queue(writer, {"city_id": 6, "status": "error", "errorType": "fetch_failed"}),
+    ]
+    assert all(result["pendingWrite"] for result in results)
+    return_inserted(supabase, 1, 4)
+
+    writer.flush()
+
+    table = supabase.table.return_value
+    reading_upsert, *city_upserts = table.upsert.call_args_list
+    assert [row["city_id"] for row in reading_upsert.args[0]] == [1, 4]
+    assert reading_upsert.kwargs["on_conflict"] == "city_id,reading_timestamp"
+    assert reading_upsert.kwargs["ignore_duplicates"] is True
+    assert reading_upsert.kwargs["returning"] == ReturnMethod.representation
+    table.upsert.return_value.select.assert_called_once_with("city_id, reading_timestamp")
+    # Success and error status rows carry different columns -> two upserts.
+    assert len(city_upserts) == 2
+    for call in city_upserts:
+        assert call.kwargs["on_conflict"] == "id"
+        assert all(row["name"] and row["api_name"] for row in call.args[0])
+    assert len(table_calls(supabase, "pipeline_logs")) == 1
+
+    assert [result["readingInserted"] for result in results] == [True, True, False]
+    assert all(result["cityStatusUpdated"] for result in results)
+    assert not any("pendingWrite" in result for result in results)
+
+
+def test_failed_multi_row_insert_is_retried_per_row(supabase):
+    writer = bulk_writer.BulkWriter(supabase, batch_size=10, flush_seconds=60)
+    writer.register_cities(CITIES)
+    first = queue(writer, success_fetch_result(1))
+    second = queue(writer, success_fetch_result(4))
+
+    reading_upsert_execute(supabase).side_effect = [
+        Exception("batch rejected"),
+        MagicMock(data=[{"city_id": 1, "reading_timestamp": "2026-05-25T01:00:00+00:00"}]),
+        Exception("bad row"),
+    ]
+
+    writer.flush()
+
+    assert first["readingInserted"] is True
+    assert second["readingInserted"] is False
+    assert second["insertError"] == "bad row"
+
+
+def test_rows_not_returned_by_the_upsert_are_duplicates(supabase):
+    writer = bulk_writer.BulkWriter(supabase, batch_size=10, flush_seconds=60)
+    writer.register_cities(CITIES)
+    inserted = queue(writer, success_fetch_result(1))
+    duplicate = queue(writer, success_fetch_result(4))
+    # PostgREST returns the timestamp in UTC regardless of the offset sent.
+    reading_upsert_execute(supabase).return_value.data = [
+        {"city_id": 1, "reading_timestamp": "2026-05-25 01:00:00+00"},
+    ]
+
+    writer.flush()
+
+    assert inserted["readingInserted"] is True
+    assert duplicate["readingInserted"] is False
+    assert duplicate["readingDuplicate"] is True
+
+
+def test_unknown_city_identity_falls_back_to_single_update(supabase):
+    writer = bulk_writer.BulkWriter(supabase, batch_size=10, flush_seconds=60)
+    result = queue(writer, {"city_id": 9, "status": "error", "errorType": "fetch_failed"})
+
+    writer.flush()
+
+    supabase.table.return_value.upsert.assert_not_called()
+    supabase.table.return_value.update.return_value.eq.assert_called_once_with("id", 9)
+    assert result["cityStatusUpdated"] is True
+
+
+def test_flush_is_due_by_size_or_age(supabase):
+    writer = bulk_writer.BulkWriter(supabase, batch_size=2, flush_seconds=30)
+    assert writer.flush_due() is False
+
+    with patch("bulk_writer.time.perf_counter", return_value=100.0):
+        queue(writer, success_fetch_result(1))
+    with patch("bulk_writer.time.perf_counter", return_value=110.0):
+        assert writer.flush_due() is False
+    with patch("bulk_writer.time.perf_counter", return_value=131.0):
+        assert writer.flush_due() is True
+
+    queue(writer, success_fetch_result(4))
+    assert writer.flush_due() is True
+
+
+def test_update_city_routes_to_active_bulk_writer(supabase):
+    writer = bulk_writer.start_bulk_writer(CITIES, supabase)
+
+    result = update_city(success_fetch_result(1))
+    return_inserted(supabase, 1)
+
+    assert result["pendingWrite"] is True
+    supabase.table.assert_not_called()
+    assert bulk_writer.finish_bulk_writer() is writer
+    assert result["readingInserted"] is True
+
+
+def test_bulk_mode_summary_matches_per_city_results(monkeypatch, supabase):
+    monkeypatch.setenv("AIR_QUALITY_PROVIDER", "waqi")
+    monkeypatch.setenv("WAQI_API_TOKEN", "token")
+    monkeypatch.setenv("SUPABASE_URL", "https://example-project.supabase.co")
+    monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "test_key")
+    monkeypatch.setenv("PIPELINE_WRITE_MODE", "bulk")
+
+    def fetch(provider, city, env):
+        if city["id"] == 6:
+            return {"status": "error", "errorType": "station_not_mapped"}
+        return success_fetch_result(city["id"])
+
+    return_inserted(supabase, 1, 4)
+    with patch("main.get_cities_for_provider", return_value=({"provider": "waqi"}, [dict(c) for c in CITIES])), patch(
+        "main.fetch_provider_air_quality", side_effect=fetch
+    ), patch("main.enrich_with_weather_context", side_effect=lambda reading, **kwargs: reading), patch(
+        "bulk_writer.get_supabase_client", return_value=supabase
+    ):
+        summary = main.main(force_update=True, max_workers=2)
+
+    assert summary["readings_inserted"] == 2
+    assert summary["skipped_unmapped"] == 1
+    assert summary["failed_updates"] == 0
+    assert [row["reading_inserted"] for row in summary["city_results"]] == [True, True, False]
+    assert summary["timing"]["write_mode"] == "bulk"
+    assert summary["timing"]["write_flushes"] == 1
+    assert len(table_calls(supabase, "air_quality_readings")) == 1
@@ -0,0 +1,83 @@
+import http.server
+import socketserver
+import threading
+
+import pytest
+
+import http_transport
+
+
+class JsonHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), JsonHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    http_transport.reset_transport_stats()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    http_transport.close_sessions()
+    http_transport.reset_transport_stats()
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_get_reuses_one_connection_per_host(local_server):
+    for page in range(3):
+        response = http_transport.http_get(f"{local_server}/feed", params={"page": page}, timeout=5)
+        assert response.json() == {"status": "ok"}
+
+    stats = http_transport.get_transport_snapshot()["127.0.0.1"]
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["avg_handshake_ms"] is not None
+    assert stats["avg_ttfb_ms"] is not None
+
+
+def test_get_session_is_shared_per_host():
+    try:
+        first = http_transport.get_session("https://api.waqi.info/feed/@1/")
+        second = http_transport.get_session("https://api.waqi.info/map/bounds/")
+        other = http_transport.get_session("https://api.open-meteo.com/v1/forecast")
+    finally:
+        http_transport.close_sessions()
+
+    assert first is second
+    assert first is not other
+    assert first.headers["Accept-Encoding"] == "gzip, deflate"
+
+
+def test_http_get_splits_connect_and_read_timeouts(monkeypatch):
+    captured = {}
+
+    class FakeSession:
+        def get(self, url, params=None, timeout=None):
+            captured["timeout"] = timeout
+            return "response"
+
+    monkeypatch.setenv("PIPELINE_HTTP_CONNECT_TIMEOUT_SECONDS", "3")
+    monkeypatch.setattr(http_transport, "get_session", lambda url: FakeSession())
+
+    assert http_transport.http_get("https://api.waqi.info/feed", timeout=45) == "response"
+    assert captured["timeout"] == (3.0, 45)
+
+
+def test_pool_size_rejects_invalid_values(monkeypatch):
+    monkeypatch.setenv("PIPELINE_HTTP_POOL_SIZE", "0")
+
+    with pytest.raises(EnvironmentError, match="PIPELINE_HTTP_POOL_SIZE"):
+        http_transport.get_pool_size()
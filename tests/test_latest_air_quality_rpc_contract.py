@@ -8,6 +8,7 @@ import pytest
 from scripts.rpc_contract_health import EXPECTED_COLUMNS, parse_utc_timestamp
 
 FIXTURE_PATH = Path(__file__).parent / "fixtures" / "latest_air_quality_rpc_valid.json"
+MIGRATIONS_PATH = Path(__file__).resolve().parents[1] / "supabase" / "migrations"
 
 REQUIRED_FIELDS = {"city_id", "city_name", "api_name", "reading_timestamp"}
 NULLABLE_FIELDS = EXPECTED_COLUMNS - REQUIRED_FIELDS
@@ -127,3 +128,28 @@ def test_fixture_contract_examples_would_fail_for_invalid_required_values(field,
     elif field == "reading_timestamp":
         with pytest.raises(ValueError):
             parse_utc_timestamp(row[field])
+
+
+def read_returns_table(migration_name: str, function_name: str) -> list[str]:
+    sql = (MIGRATIONS_PATH / migration_name).read_text(encoding="utf-8")
+    signature = f"function public.{function_name}()\nreturns table("
+    start = sql.index(signature) + len(signature)
+    columns_block = sql[start:sql.index("\n)", start)]
+    return [line.strip().rstrip(",") for line in columns_block.strip().splitlines()]
+
+
+@pytest.mark.parametrize(
+    "migration_name,function_name",
+    [
+        ("20260603090000_add_latest_air_quality_by_city_table.sql", "get_latest_air_quality_per_city_cached"),
+        ("20260604090000_rewrite_latest_air_quality_rpc_lateral.sql", "get_latest_air_quality_per_city"),
+    ],
+)
+def test_rpc_rewrites_keep_the_published_output_columns(migration_name, function_name):
+    published = read_returns_table(
+        "20260525045500_update_latest_air_quality_rpc_weather_context.sql",
+        "get_latest_air_quality_per_city",
+    )
+
+    assert EXPECTED_COLUMNS.issubset({column.split()[0] for column in published})
+    assert read_returns_table(migration_name, function_name) == published
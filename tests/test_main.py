@@ -0,0 +1,366 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import main
+import scheduler
+
+
+CITIES = [
+    {"id": 1, "api_name": "Monterrey", "is_active": True, "last_update_status": None},
+    {"id": 4, "api_name": "Guadalupe", "is_active": True, "last_update_status": None},
+    {"id": 9, "api_name": "Apodaca", "is_active": True, "last_update_status": None},
+    {"id": 5, "api_name": "Santa Catarina", "is_active": False, "last_update_status": None},
+    {"id": 6, "api_name": "Garcia", "is_active": True, "last_update_status": None},
+]
+
+
+@pytest.fixture(autouse=True)
+def pipeline_env(monkeypatch):
+    monkeypatch.setenv("AIR_QUALITY_PROVIDER", "waqi")
+    monkeypatch.setenv("WAQI_API_TOKEN", "token")
+    monkeypatch.setenv("SUPABASE_URL", "https://example-project.supabase.co")
+    monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "test_key")
+    monkeypatch.delenv("PIPELINE_MAX_WORKERS", raising=False)
+    monkeypatch.delenv("PIPELINE_MAX_RUNTIME_SECONDS", raising=False)
+
+
+def fake_fetch(provider, city, env):
+    if city["api_name"] == "Apodaca":
+        return {"status": "error", "errorType": "station_not_mapped"}
+    if city["api_name"] == "Garcia":
+        return {"status": "error", "errorType": "fetch_failed"}
+    return {"status": "success", "reading_timestamp_iso": "2026-05-25T01:00:00+00:00"}
+
+
+def fake_enrich(reading, canonical_lat=None, canonical_lon=None):
+    if reading.get("status") != "success":
+        return reading
+    return {**reading, "weather_context": {"status": "success"}}
+
+
+def fake_update_city(fetch_or_skip_result):
+    inserted = fetch_or_skip_result.get("status") == "success"
+    return {
+        "city_id": fetch_or_skip_result["city_id"],
+        "readingInserted": inserted,
+        "cityStatusUpdated": True,
+        "insertError": None,
+        "updateError": None,
+        "validationErrors": None,
+    }
+
+
+def run_pipeline(fetch=fake_fetch, **kwargs):
+    with patch(
+        "main.get_cities_for_provider",
+        return_value=({"provider": "waqi"}, [dict(city) for city in CITIES]),
+    ), patch("main.fetch_provider_air_quality", side_effect=fetch), patch(
+        "main.enrich_with_weather_context", side_effect=fake_enrich
+    ), patch("main.update_city", side_effect=fake_update_city):
+        try:
+            return main.main(**kwargs)
+        except main.PipelineRunError as error:
+            return error
+
+
+def without_timing(summary):
+    return {key: value for key, value in summary.items() if key != "timing"}
+
+
+def test_threaded_runner_matches_sequential_summary():
+    sequential_error = run_pipeline(force_update=True, max_workers=1)
+    threaded_error = run_pipeline(force_update=True, max_workers=4)
+
+    assert isinstance(sequential_error, main.PipelineRunError)
+    assert isinstance(threaded_error, main.PipelineRunError)
+    assert str(sequential_error) == str(threaded_error)
+
+
+def test_process_city_outcomes_fold_into_identical_summaries():
+    env = {"WAQI_API_TOKEN": "token"}
+    summaries = []
+    with patch("main.fetch_provider_air_quality", side_effect=fake_fetch), patch(
+        "main.enrich_with_weather_context", side_effect=fake_enrich
+    ), patch("main.update_city", side_effect=fake_update_city):
+        for workers in (1, 3):
+            summary = main.build_summary(force_update=True, provider="waqi")
+            cities = main.get_active_cities(CITIES)
+            if workers == 1:
+                main.run_cities_sequentially("waqi", cities, env, True, summary)
+            else:
+                main.run_cities_concurrently("waqi", cities, env, True, summary, workers)
+            summaries.append(summary)
+
+    assert without_timing(summaries[0]) == without_timing(summaries[1])
+    assert [row["city_id"] for row in summaries[1]["city_results"]] == [1, 4, 9, 6]
+    assert summaries[1]["readings_inserted"] == 2
+    assert summaries[1]["skipped_unmapped"] == 1
+    assert summaries[1]["failed_updates"] == 1
+    assert summaries[1]["fetch_errors"] == 1
+
+
+def test_healthy_threaded_run_reports_wall_clock_and_summed_time():
+    summary = run_pipeline(
+        fetch=lambda provider, city, env: {"status": "success"},
+        force_update=True,
+        max_workers=2,
+    )
+
+    assert summary["readings_inserted"] == 4
+    assert summary["timing"]["engine"] == "threaded"
+    assert summary["timing"]["max_workers"] == 2
+    assert summary["timing"]["wall_clock_seconds"] >= 0
+    assert summary["timing"]["summed_city_seconds"] >= 0
+
+
+def test_build_summary_declares_every_run_snapshot():
+    summary = main.build_summary(force_update=False, provider="waqi")
+
+    for key in (
+        "waqi_bounds",
+        "waqi_station_plan",
+        "reading_dedupe",
+        "weather_prefetch",
+        "weather_cache",
+        "weather_health",
+        "weather_enrichment",
+        "rollups",
+        "raw_payload_store",
+    ):
+        assert summary[key] is None
+
+
+def test_get_max_workers_rejects_invalid_values(monkeypatch):
+    monkeypatch.setenv("PIPELINE_MAX_WORKERS", "0")
+
+    with pytest.raises(EnvironmentError, match="PIPELINE_MAX_WORKERS"):
+        main.get_max_workers()
+
+
+def test_budget_defers_remaining_cities_once_p95_no_longer_fits():
+    clock = {"now": 0.0}
+
+    def slow_fetch(provider, city, env):
+        clock["now"] += 10.0
+        return {"status": "success"}
+
+    env = {"WAQI_API_TOKEN": "token"}
+    summary = main.build_summary(force_update=True, provider="waqi")
+    with patch("main.time.perf_counter", side_effect=lambda: clock["now"]), patch(
+        "scheduler.time.perf_counter", side_effect=lambda: clock["now"]
+    ), patch("main.fetch_provider_air_quality", side_effect=slow_fetch), patch(
+        "main.enrich_with_weather_context", side_effect=fake_enrich
+    ), patch("main.update_city", side_effect=fake_update_city):
+        budget = scheduler.RunBudget(35.0)
+        main.run_cities_sequentially(
+            "waqi", main.get_active_cities(CITIES), env, True, summary, budget
+        )
+
+    assert summary["readings_inserted"] == 3
+    assert summary["deferred_for_budget"] == 1
+    assert summary["city_results"][-1]["city_id"] == 6
+    assert summary["city_results"][-1]["deferred"] is True
+    assert budget.snapshot()["budget_exhausted"] is True
+
+
+def test_exhausted_budget_still_skips_up_to_date_cities():
+    fresh_city = {"id": 1, "api_name": "Monterrey", "is_active": True}
+    budget = scheduler.RunBudget(0.5)
+    assert budget.can_start_city() is False
+
+    with patch("main.check_if_update_needed", return_value={"needsUpdate": False}), patch("main.fetch_provider_air_quality") as fetch_mock:
+        outcome = main.process_city_within_budget(budget, "waqi", fresh_city, {}, False)
+
+    fetch_mock.assert_not_called()
+    assert outcome["result"]["needed_update"] is False
+    assert "deferred_for_budget" not in outcome["counters"]
+
+
+def test_main_fails_when_budget_defers_every_city():
+    error = run_pipeline(force_update=True, max_runtime_seconds=0.5)
+
+    assert isinstance(error, main.PipelineRunError)
+    assert "deferred_for_budget=4" in str(error)
+
+
+def test_main_processes_stalest_cities_first():
+    cities = [
+        {"id": 1, "api_name": "Monterrey", "is_active": True, "last_update_status": "success",
+         "last_successful_update_at": "2026-05-25T01:00:00+00:00"},
+        {"id": 4, "api_name": "Guadalupe", "is_active": True, "last_update_status": "error",
+         "last_successful_update_at": "2026-05-24T20:00:00+00:00"},
+        {"id": 9, "api_name": "Apodaca", "is_active": True, "last_update_status": None,
+         "last_successful_update_at": None},
+    ]
+    with patch("main.get_cities_for_provider", return_value=({"provider": "waqi"}, cities)), patch(
+        "main.fetch_provider_air_quality", side_effect=lambda provider, city, env: {"status": "success"}
+    ), patch("main.enrich_with_weather_context", side_effect=fake_enrich), patch(
+        "main.update_city", side_effect=fake_update_city
+    ):
+        summary = main.main(force_update=True, max_workers=1)
+
+    assert [row["city_id"] for row in summary["city_results"]] == [9, 4, 1]
+
+
+def test_unchanged_upstream_stations_are_not_failures():
+    def unchanged_fetch(provider, city, env):
+        if city["api_name"] == "Monterrey":
+            return {"status": "success"}
+        return {"status": "skipped", "skipReason": "unchanged_upstream"}
+
+    summary = run_pipeline(fetch=unchanged_fetch, force_update=True, max_workers=1)
+
+    assert summary["readings_inserted"] == 1
+    assert summary["skipped_unchanged_upstream"] == 3
+    assert summary["failed_updates"] == 0
+    assert summary["city_results"][1]["fetch_skip_reason"] == "unchanged_upstream"
+
+
+def test_force_update_does_not_reinsert_stored_readings(monkeypatch):
+    monkeypatch.setenv("PIPELINE_READING_DEDUPE", "on")
+    stored = [
+        {"city_id": 1, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+        {"city_id": 4, "reading_timestamp": "2026-05-25T00:00:00+00:00"},
+    ]
+
+    def fetch(provider, city, env):
+        return {"status": "success", "reading_timestamp_iso": "2026-05-25T01:00:00+00:00"}
+
+    with patch("reading_dedupe.get_supabase_client") as get_client:
+        get_client.return_value.rpc.return_value.execute.return_value.data = stored
+        summary = run_pipeline(fetch=fetch, force_update=True, max_workers=1)
+
+    assert summary["reading_dedupe"] == {"mode": "on", "status": "success", "cities": 2}
+    assert summary["skipped_unchanged_upstream"] == 1
+    assert summary["readings_inserted"] == 3
+    results = {result["city_id"]: result for result in summary["city_results"]}
+    assert results[1]["fetch_skip_reason"] == "unchanged_upstream"
+    assert results[4]["reading_inserted"] is True
+
+
+def test_duplicate_readings_rejected_at_write_are_unchanged_upstream():
+    def duplicate_update_city(fetch_or_skip_result):
+        result = fake_update_city(fetch_or_skip_result)
+        if fetch_or_skip_result["city_id"] == 4:
+            result.update({"readingInserted": False, "readingDuplicate": True})
+        return result
+
+    with patch(
+        "main.get_cities_for_provider",
+        return_value=({"provider": "waqi"}, [dict(city) for city in CITIES]),
+    ), patch("main.fetch_provider_air_quality", side_effect=lambda provider, city, env: {
+        "status": "success",
+        "reading_timestamp_iso": "2026-05-25T01:00:00+00:00",
+    }), patch("main.enrich_with_weather_context", side_effect=fake_enrich), patch(
+        "main.update_city", side_effect=duplicate_update_city
+    ):
+        summary = main.main(force_update=True, max_workers=1)
+
+    assert summary["readings_inserted"] == 3
+    assert summary["skipped_unchanged_upstream"] == 1
+    assert summary["failed_updates"] == 0
+
+
+def test_bounds_state_records_only_stations_whose_reading_was_stored():
+    def station_fetch(provider, city, env):
+        station_id = {"Monterrey": "6492", "Guadalupe": "6494", "Garcia": "6495"}.get(city["api_name"])
+        return {
+            "status": "success",
+            "provider_station_id": station_id,
+            "reading_timestamp_iso": "2026-05-25T01:00:00+00:00",
+        }
+
+    def update_city_with_failure(fetch_or_skip_result):
+        result = fake_update_city(fetch_or_skip_result)
+        if fetch_or_skip_result["city_id"] == 4:
+            result.update({"readingInserted": False, "readingDuplicate": True})
+        if fetch_or_skip_result["city_id"] == 6:
+            result.update({"readingInserted": False, "insertError": "timeout"})
+        return result
+
+    with patch("main.record_station_detail_fetched") as record_station, patch(
+        "main.update_city", side_effect=update_city_with_failure
+    ):
+        with patch(
+            "main.get_cities_for_provider",
+            return_value=({"provider": "waqi"}, [dict(city) for city in CITIES]),
+        ), patch("main.fetch_provider_air_quality", side_effect=station_fetch), patch(
+            "main.enrich_with_weather_context", side_effect=fake_enrich
+        ), pytest.raises(main.PipelineRunError):
+            main.main(force_update=True, max_workers=1)
+
+    assert [call.args[0] for call in record_station.call_args_list] == ["6492", "6494"]
+
+
+def test_rollups_refresh_receives_readings_inserted_this_run(monkeypatch):
+    monkeypatch.setenv("PIPELINE_ROLLUPS", "on")
+
+    with patch("rollups.get_supabase_client") as get_client:
+        rpc = get_client.return_value.rpc
+        rpc.return_value.execute.return_value.data = {"hourly_buckets": 2, "daily_buckets": 2}
+        run_pipeline(force_update=True, max_workers=1)
+
+    rpc_name, params = rpc.call_args.args
+    assert rpc_name == "refresh_air_quality_rollups"
+    assert params["p_readings"] == [
+        {"city_id": 1, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+        {"city_id": 4, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+    ]
+
+
+def test_cities_sharing_a_waqi_station_are_served_by_one_fetch():
+    cities = [
+        {"id": 6, "api_name": "Garcia", "is_active": True, "last_update_status": None},
+        {"id": 7, "api_name": "García", "is_active": True, "last_update_status": None},
+    ]
+    response = MagicMock(status_code=200, headers={})
+    response.json.return_value = {
+        "status": "ok",
+        "data": {"aqi": 60, "time": {"iso": "2026-05-25T01:00:00+00:00"}, "city": {"geo": [25.79, -100.58]}},
+    }
+
+    with patch("main.get_cities_for_provider", return_value=({"provider": "waqi"}, cities)), patch(
+        "waqi_api.http_get", return_value=response
+    ) as http_get, patch("main.enrich_with_weather_context", side_effect=fake_enrich), patch(
+        "main.update_city", side_effect=fake_update_city
+    ):
+        summary = main.main(force_update=True, max_workers=1)
+
+    http_get.assert_called_once()
+    assert summary["readings_inserted"] == 2
+    assert summary["waqi_station_plan"] == {
+        "stations": 1,
+        "shared_stations": {"6495": [6, 7]},
+        "shared_fetch_city_ids": [7],
+    }
+    assert [result["shared_fetch_city_id"] for result in summary["city_results"]] == [None, 6]
+
+
+def test_deferred_weather_inserts_without_waiting_and_queues_the_reading(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_ENRICHMENT", "deferred")
+    city = {"id": 1, "api_name": "Monterrey", "latitude": 25.6866, "longitude": -100.3161}
+
+    with patch("main.fetch_provider_air_quality", side_effect=fake_fetch), patch(
+        "main.enrich_with_weather_context", side_effect=fake_enrich
+    ) as enrich, patch("main.update_city", side_effect=fake_update_city), patch(
+        "city_outcomes.enqueue_weather_job"
+    ) as enqueue:
+        outcome = main.process_city("waqi", city, {"WAQI_API_TOKEN": "token"}, True)
+
+    enrich.assert_not_called()
+    enqueue.assert_called_once()
+    assert enqueue.call_args.kwargs == {"canonical_lat": 25.6866, "canonical_lon": -100.3161}
+    assert outcome["result"]["reading_inserted"] is True
+
+
+def test_deferred_weather_skips_the_prefetch_before_the_city_loop(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_ENRICHMENT", "deferred")
+
+    with patch("main.prefetch_weather_contexts") as prefetch, patch(
+        "main.drain_weather_queue", return_value={"mode": "deferred", "status": "no_pending_jobs"}
+    ) as drain, patch("city_outcomes.enqueue_weather_job"):
+        run_pipeline(force_update=True, max_workers=1)
+
+    prefetch.assert_not_called()
+    drain.assert_called_once()
@@ -0,0 +1,135 @@
+from unittest.mock import patch
+
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def reset_limiters():
+    rate_limiter.reset_provider_limiters()
+    yield
+    rate_limiter.reset_provider_limiters()
+
+
+def test_token_bucket_allows_burst_without_waiting():
+    bucket = TokenBucket("waqi", rate_per_second=1.0, burst=3)
+
+    with patch("rate_limiter.delay") as delay_mock:
+        waits = [bucket.acquire() for _ in range(3)]
+
+    assert waits == [0.0, 0.0, 0.0]
+    delay_mock.assert_not_called()
+
+
+def test_token_bucket_reserves_deficit_for_queued_callers():
+    bucket = TokenBucket("waqi", rate_per_second=2.0, burst=1)
+
+    with patch("rate_limiter.time.monotonic", return_value=100.0), patch(
+        "rate_limiter.delay"
+    ) as delay_mock:
+        waits = [bucket.acquire() for _ in range(3)]
+
+    assert waits == [0.0, 0.5, 1.0]
+    assert [call.args[0] for call in delay_mock.call_args_list] == [0.5, 1.0]
+    assert bucket.snapshot()["wait_seconds"] == 1.5
+
+
+def test_token_bucket_rejects_invalid_config():
+    with pytest.raises(ValueError):
+        TokenBucket("waqi", rate_per_second=0, burst=1)
+
+
+def test_provider_limiter_reads_env_overrides(monkeypatch):
+    monkeypatch.setenv("PIPELINE_RATE_LIMIT_OPEN_METEO", "5")
+    monkeypatch.setenv("PIPELINE_RATE_BURST_OPEN_METEO", "7")
+
+    limiter = rate_limiter.get_provider_limiter("open-meteo")
+
+    assert limiter.rate_per_second == 5.0
+    assert limiter.burst == 7
+    assert rate_limiter.get_provider_limiter("open-meteo") is limiter
+
+
+def test_provider_limiter_rejects_invalid_env(monkeypatch):
+    monkeypatch.setenv("PIPELINE_RATE_LIMIT_WAQI", "fast")
+
+    with pytest.raises(EnvironmentError, match="rate limit invalida"):
+        rate_limiter.get_provider_limiter("waqi")
+
+
+def test_adaptive_bucket_increases_on_fast_success_and_halves_on_throttle():
+    bucket = TokenBucket("waqi", rate_per_second=1.0, burst=1, min_rate=0.2, max_rate=5.0)
+
+    bucket.record_success(elapsed_seconds=0.3)
+    assert bucket.rate_per_second == pytest.approx(1.24)
+
+    bucket.record_success(elapsed_seconds=rate_limiter.FAST_RESPONSE_SECONDS + 1)
+    assert bucket.rate_per_second == pytest.approx(1.24)
+
+    bucket.record_throttle()
+    assert bucket.rate_per_second == pytest.approx(0.62)
+
+    for _ in range(5):
+        bucket.record_throttle()
+    assert bucket.rate_per_second == 0.2
+
+
+def test_retry_after_pauses_next_token():
+    bucket = TokenBucket("open-meteo", rate_per_second=2.0, burst=2, min_rate=0.5, max_rate=4.0)
+
+    with patch("rate_limiter.time.monotonic", return_value=50.0), patch("rate_limiter.delay"):
+        bucket.record_throttle(retry_after_seconds=10)
+        wait_seconds = bucket.acquire()
+
+    assert wait_seconds == pytest.approx(10.0)
+
+
+def test_record_provider_response_classifies_status_codes():
+    rate_limiter.reset_provider_limiters()
+    limiter = rate_limiter.get_provider_limiter("waqi")
+    starting_rate = limiter.rate_per_second
+
+    rate_limiter.record_provider_response("waqi", 200, elapsed_seconds=0.1)
+    assert limiter.rate_per_second > starting_rate
+
+    rate_limiter.record_provider_response("waqi", 404, elapsed_seconds=0.1)
+    assert limiter.throttles == 0
+
+    rate_limiter.record_provider_response("waqi", 429, retry_after="0")
+    rate_limiter.record_provider_response("waqi", 503)
+    assert limiter.throttles == 2
+
+
+def test_parse_retry_after_accepts_seconds_and_http_dates():
+    assert rate_limiter.parse_retry_after("30") == 30.0
+    assert rate_limiter.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert rate_limiter.parse_retry_after("soon") is None
+    assert rate_limiter.parse_retry_after(None) is None
+
+
+def test_learned_rates_persist_between_runs(tmp_path, monkeypatch):
+    state_path = tmp_path / "state" / "rate_limits.json"
+    monkeypatch.setenv("PIPELINE_RATE_STATE_PATH", str(state_path))
+
+    limiter = rate_limiter.get_provider_limiter("waqi")
+    for _ in range(10):
+        limiter.record_success(elapsed_seconds=0.1)
+    learned_rate = round(limiter.rate_per_second, 4)
+    rate_limiter.save_rate_limiter_state()
+
+    rate_limiter.reset_provider_limiters()
+
+    assert rate_limiter.get_provider_limiter("waqi").rate_per_second == learned_rate
+
+
+def test_fixed_rate_control_disables_adaptation(monkeypatch):
+    monkeypatch.setenv("PIPELINE_RATE_CONTROL", "fixed")
+
+    limiter = rate_limiter.get_provider_limiter("waqi")
+    limiter.record_success(elapsed_seconds=0.1)
+    limiter.record_throttle()
+
+    assert limiter.adaptive is False
+    assert limiter.rate_per_second == rate_limiter.DEFAULT_PROVIDER_RATES["waqi"]["rate_per_second"]
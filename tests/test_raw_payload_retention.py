@@ -0,0 +1,194 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+from scripts.raw_payload_retention import (
+    build_payload_update,
+    compact_raw_api_response,
+    compact_stored_payloads,
+    delete_unreferenced_payloads,
+    process_city,
+)
+
+
+WAQI_RAW = {
+    "status": "ok",
+    "data": {
+        "aqi": 74,
+        "idx": 6492,
+        "time": {"iso": "2026-01-01T10:00:00-06:00"},
+        "iaqi": {"pm25": {"v": 74}},
+        "forecast": {"daily": {"pm25": [{"avg": 70, "day": "2026-01-02"}] * 10}},
+        "attributions": [{"url": "https://example.org", "name": "SIMA"}] * 3,
+        "debug": {"sync": "2026-01-01T10:05:00+09:00"},
+    },
+}
+
+
+def make_row(timestamp, raw=WAQI_RAW, weather=None):
+    return {
+        "city_id": 1,
+        "reading_timestamp": timestamp,
+        "raw_api_response": raw,
+        "weather_source_payload": weather,
+    }
+
+
+def test_compact_raw_api_response_keeps_reading_fields_and_is_idempotent():
+    compacted = compact_raw_api_response(WAQI_RAW)
+
+    assert compacted["data"] == {
+        "aqi": 74,
+        "idx": 6492,
+        "time": {"iso": "2026-01-01T10:00:00-06:00"},
+        "iaqi": {"pm25": {"v": 74}},
+    }
+    assert compacted["_compacted"] is True
+    assert compact_raw_api_response(compacted) is compacted
+    assert build_payload_update(make_row("2026-01-01T16:00:00+00:00", raw=compacted), "compact") == {}
+
+
+def test_null_mode_clears_both_payload_columns():
+    row = make_row("2026-01-01T16:00:00+00:00", weather={"current": {"temperature_2m": 20}})
+
+    assert build_payload_update(row, "null") == {"raw_api_response": None, "weather_source_payload": None}
+
+
+def test_dry_run_reports_downsampling_and_bytes_without_writing():
+    rows = [
+        make_row("2026-01-01T16:00:00+00:00"),
+        make_row("2026-01-01T16:30:00+00:00"),
+        make_row("2026-01-01T17:00:00+00:00"),
+    ]
+    supabase = MagicMock()
+
+    with patch("scripts.raw_payload_retention.fetch_batch", side_effect=[rows[:2], rows[2:]]):
+        result = process_city(
+            supabase,
+            1,
+            cutoff_iso="2026-03-01T00:00:00+00:00",
+            batch_size=2,
+            max_batches=10,
+            payload_mode="compact",
+            apply=False,
+        )
+
+    assert result.rows_scanned == 3
+    assert result.batches == 2
+    assert result.rows_downsampled == 1
+    assert result.payloads_compacted == 2
+    assert result.bytes_reclaimed_estimate > 0
+    supabase.table.assert_not_called()
+    supabase.rpc.assert_not_called()
+
+
+def test_apply_deletes_earlier_duplicate_across_batches_and_refreshes_rollups():
+    rows = [
+        make_row("2026-01-01T16:10:00+00:00"),
+        make_row("2026-01-01T16:40:00+00:00"),
+    ]
+    supabase = MagicMock()
+
+    with patch("scripts.raw_payload_retention.fetch_batch", side_effect=[rows[:1], rows[1:], []]):
+        result = process_city(
+            supabase,
+            1,
+            cutoff_iso="2026-03-01T00:00:00+00:00",
+            batch_size=1,
+            max_batches=10,
+            payload_mode="compact",
+            apply=True,
+        )
+
+    table = supabase.table.return_value
+    table.delete.return_value.eq.return_value.eq.assert_called_once_with(
+        "reading_timestamp", "2026-01-01T16:10:00+00:00"
+    )
+    assert table.update.call_args.args[0]["raw_api_response"]["_compacted"] is True
+    rpc_name, params = supabase.rpc.call_args.args
+    assert rpc_name == "refresh_air_quality_rollups_for_range"
+    assert params["p_from"] == "2026-01-01T16:10:00+00:00"
+    assert result.rows_downsampled == 1
+    assert not result.truncated
+
+
+def test_max_batches_marks_city_truncated():
+    with patch(
+        "scripts.raw_payload_retention.fetch_batch",
+        return_value=[make_row("2026-01-01T16:00:00+00:00")],
+    ):
+        result = process_city(
+            MagicMock(),
+            1,
+            cutoff_iso="2026-03-01T00:00:00+00:00",
+            batch_size=1,
+            max_batches=2,
+            payload_mode="compact",
+            apply=False,
+        )
+
+    assert result.truncated is True
+    assert result.batches == 2
+
+
+def test_unreferenced_payloads_are_deleted_in_batches_after_the_grace_period():
+    supabase = MagicMock()
+    supabase.rpc.return_value.execute.side_effect = [
+        MagicMock(data={"payloads": 2, "bytes": 900}),
+        MagicMock(data={"payloads": 1, "bytes": 400}),
+    ]
+
+    report = delete_unreferenced_payloads(
+        supabase,
+        now_utc=datetime(2026, 6, 10, 12, 0, tzinfo=timezone.utc),
+        batch_size=2,
+        max_batches=10,
+        apply=True,
+    )
+
+    rpc_name, params = supabase.rpc.call_args.args
+    assert rpc_name == "delete_unreferenced_raw_payloads"
+    assert params == {"p_created_before": "2026-06-09T12:00:00+00:00", "p_limit": 2, "p_apply": True}
+    assert report["unreferenced_payloads"] == 3
+    assert report["bytes_reclaimed_estimate"] == 1300
+    assert report["batches"] == 2
+    assert report["truncated"] is False
+
+
+def test_dry_run_counts_unreferenced_payloads_in_one_call():
+    supabase = MagicMock()
+    supabase.rpc.return_value.execute.return_value.data = {"payloads": 5000, "bytes": 10}
+
+    report = delete_unreferenced_payloads(
+        supabase,
+        now_utc=datetime(2026, 6, 10, 12, 0, tzinfo=timezone.utc),
+        batch_size=500,
+        max_batches=10,
+        apply=False,
+    )
+
+    supabase.rpc.assert_called_once()
+    assert supabase.rpc.call_args.args[1]["p_apply"] is False
+    assert report["unreferenced_payloads"] == 5000
+
+
+def test_hashed_store_payloads_are_compacted_in_place_under_their_hash():
+    stored = [{"hash": "a" * 64, "payload": WAQI_RAW}, {"hash": "b" * 64, "payload": compact_raw_api_response(WAQI_RAW)}]
+    supabase = MagicMock()
+
+    with patch("scripts.raw_payload_retention.fetch_stored_payload_batch", side_effect=[stored]) as fetch_mock:
+        report = compact_stored_payloads(
+            supabase,
+            cutoff_iso="2026-03-01T00:00:00+00:00",
+            batch_size=500,
+            max_batches=10,
+            apply=True,
+        )
+
+    fetch_mock.assert_called_once()
+    table = supabase.table.return_value
+    assert supabase.table.call_args.args == ("raw_payloads",)
+    assert table.update.call_args.args[0] == {"payload": compact_raw_api_response(WAQI_RAW)}
+    table.update.return_value.eq.assert_called_once_with("hash", "a" * 64)
+    assert report["rows_scanned"] == 2
+    assert report["payloads_compacted"] == 1
+    assert report["bytes_reclaimed_estimate"] > 0
@@ -0,0 +1,101 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import raw_payload_store
+from utils import canonical_json_sha256
+
+
+SHARED_PAYLOAD = {"aqi": 87, "idx": 6495, "time": {"iso": "2026-05-05T12:00:00-06:00"}}
+OTHER_PAYLOAD = {"aqi": 40, "idx": 6492, "time": {"iso": "2026-05-05T12:00:00-06:00"}}
+
+
+@pytest.fixture(autouse=True)
+def hashed_store(monkeypatch):
+    monkeypatch.setenv("PIPELINE_RAW_PAYLOAD_STORE", "hashed")
+
+
+def build_readings():
+    # Garcia and García map to the same WAQI station and return the same payload.
+    return [
+        {"city_id": 7, "raw_api_response": dict(SHARED_PAYLOAD)},
+        {"city_id": 8, "raw_api_response": dict(SHARED_PAYLOAD)},
+        {"city_id": 1, "raw_api_response": dict(OTHER_PAYLOAD)},
+    ]
+
+
+def build_supabase(stored_hashes=()):
+    supabase = MagicMock()
+    table = supabase.table.return_value
+    table.select.return_value.in_.return_value.execute.return_value.data = [
+        {"hash": hash_value} for hash_value in stored_hashes
+    ]
+    return supabase, table
+
+
+def test_store_sends_each_new_payload_once_and_references_it_by_hash():
+    supabase, table = build_supabase()
+    readings = build_readings()
+
+    raw_payload_store.store_raw_payloads(readings, supabase)
+
+    sent_rows = table.upsert.call_args.args[0]
+    assert sorted(row["hash"] for row in sent_rows) == sorted(
+        [canonical_json_sha256(SHARED_PAYLOAD), canonical_json_sha256(OTHER_PAYLOAD)]
+    )
+    assert table.upsert.call_args.kwargs["on_conflict"] == "hash"
+    assert readings[0]["raw_payload_hash"] == readings[1]["raw_payload_hash"] == canonical_json_sha256(SHARED_PAYLOAD)
+    assert all(reading["raw_api_response"] is None for reading in readings)
+    assert raw_payload_store.get_raw_payload_store_snapshot()["payloads_sent"] == 2
+
+
+def test_store_skips_payloads_already_stored_or_seen_this_run():
+    supabase, table = build_supabase(stored_hashes=[canonical_json_sha256(SHARED_PAYLOAD)])
+
+    raw_payload_store.store_raw_payloads(build_readings(), supabase)
+    assert [row["hash"] for row in table.upsert.call_args.args[0]] == [canonical_json_sha256(OTHER_PAYLOAD)]
+
+    supabase.reset_mock()
+    readings = build_readings()
+    raw_payload_store.store_raw_payloads(readings, supabase)
+
+    supabase.table.assert_not_called()
+    assert readings[2]["raw_payload_hash"] == canonical_json_sha256(OTHER_PAYLOAD)
+    assert raw_payload_store.get_raw_payload_store_snapshot()["payloads_reused"] == 3
+
+
+def test_store_error_keeps_payload_inline():
+    supabase, table = build_supabase()
+    table.upsert.return_value.execute.side_effect = Exception("relation raw_payloads does not exist")
+    readings = build_readings()
+
+    raw_payload_store.store_raw_payloads(readings, supabase)
+
+    assert readings[0]["raw_api_response"] == SHARED_PAYLOAD
+    assert "raw_payload_hash" not in readings[0]
+    assert raw_payload_store.get_raw_payload_store_snapshot()["store_errors"] == 1
+
+
+def test_inline_mode_does_not_touch_raw_payloads(monkeypatch):
+    monkeypatch.setenv("PIPELINE_RAW_PAYLOAD_STORE", "inline")
+    supabase, _ = build_supabase()
+    readings = build_readings()
+
+    raw_payload_store.store_raw_payloads(readings, supabase)
+
+    supabase.table.assert_not_called()
+    assert readings[0]["raw_api_response"] == SHARED_PAYLOAD
+
+
+def test_store_async_references_payload_by_hash():
+    supabase = MagicMock()
+    table = supabase.table.return_value
+    table.select.return_value.in_.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+    table.upsert.return_value.execute = AsyncMock()
+    readings = build_readings()[:1]
+
+    asyncio.run(raw_payload_store.store_raw_payloads_async(readings, supabase))
+
+    table.upsert.return_value.execute.assert_awaited_once()
+    assert readings[0]["raw_payload_hash"] == canonical_json_sha256(SHARED_PAYLOAD)
@@ -0,0 +1,82 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import reading_dedupe
+
+
+def build_supabase(rows):
+    supabase = MagicMock()
+    supabase.rpc.return_value.execute.return_value.data = rows
+    return supabase
+
+
+def success_fetch(city_id=1, timestamp="2026-05-25T01:00:00+00:00"):
+    return {
+        "city_id": city_id,
+        "status": "success",
+        "municipio": "Monterrey",
+        "provider": "waqi",
+        "provider_station_id": "6492",
+        "reading_timestamp_iso": timestamp,
+    }
+
+
+@pytest.fixture(autouse=True)
+def dedupe_on(monkeypatch):
+    monkeypatch.setenv("PIPELINE_READING_DEDUPE", "on")
+
+
+def test_prepare_loads_latest_timestamp_per_city_in_one_call():
+    supabase = build_supabase([
+        {"city_id": 1, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+        {"city_id": 4, "reading_timestamp": "2026-05-25T00:00:00Z"},
+        {"city_id": 9, "reading_timestamp": None},
+    ])
+
+    snapshot = reading_dedupe.prepare_reading_dedupe(supabase)
+
+    assert snapshot == {"mode": "on", "status": "success", "cities": 2}
+    supabase.rpc.assert_called_once_with("get_latest_air_quality_per_city")
+    assert reading_dedupe.get_latest_stored_timestamp(4).isoformat() == "2026-05-25T00:00:00+00:00"
+
+
+def test_reading_not_newer_than_stored_is_skipped_as_unchanged_upstream():
+    reading_dedupe.prepare_reading_dedupe(
+        build_supabase([{"city_id": 1, "reading_timestamp": "2026-05-25T01:00:00+00:00"}])
+    )
+
+    same = reading_dedupe.dedupe_fetch_result(success_fetch(timestamp="2026-05-24T19:00:00-06:00"))
+    newer = reading_dedupe.dedupe_fetch_result(success_fetch(timestamp="2026-05-25T02:00:00+00:00"))
+    unknown_city = reading_dedupe.dedupe_fetch_result(success_fetch(city_id=4))
+
+    assert same["status"] == "skipped"
+    assert same["skipReason"] == "unchanged_upstream"
+    assert same["upstream_timestamp_iso"] == "2026-05-24T19:00:00-06:00"
+    assert newer["status"] == "success"
+    assert unknown_city["status"] == "success"
+
+
+def test_failed_load_disables_dedupe():
+    supabase = MagicMock()
+    supabase.rpc.return_value.execute.side_effect = Exception("timeout")
+
+    snapshot = reading_dedupe.prepare_reading_dedupe(supabase)
+
+    assert snapshot["status"] == "fetch_failed"
+    assert reading_dedupe.dedupe_fetch_result(success_fetch())["status"] == "success"
+
+
+def test_dedupe_off_skips_the_query(monkeypatch):
+    monkeypatch.setenv("PIPELINE_READING_DEDUPE", "off")
+    supabase = build_supabase([])
+
+    assert reading_dedupe.prepare_reading_dedupe(supabase) == {"mode": "off", "status": "disabled"}
+    supabase.rpc.assert_not_called()
+
+
+def test_invalid_dedupe_mode_raises(monkeypatch):
+    monkeypatch.setenv("PIPELINE_READING_DEDUPE", "maybe")
+
+    with pytest.raises(EnvironmentError, match="PIPELINE_READING_DEDUPE invalido"):
+        reading_dedupe.get_dedupe_mode()
@@ -0,0 +1,95 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import rollups
+
+
+CITY_RESULTS = [
+    {"city_id": 1, "reading_inserted": True, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+    {"city_id": 4, "reading_inserted": False, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+    {"city_id": 6, "reading_inserted": True, "reading_timestamp": "2026-05-25T00:00:00+00:00"},
+    {"city_id": 9, "needed_update": False},
+]
+
+
+@pytest.fixture(autouse=True)
+def rollups_on(monkeypatch):
+    monkeypatch.setenv("PIPELINE_ROLLUPS", "on")
+
+
+def test_collect_inserted_readings_keeps_only_inserted_rows():
+    assert rollups.collect_inserted_readings(CITY_RESULTS + CITY_RESULTS[:1]) == [
+        {"city_id": 1, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+        {"city_id": 6, "reading_timestamp": "2026-05-25T00:00:00+00:00"},
+    ]
+
+
+def test_collect_inserted_readings_adds_rows_updated_by_the_run():
+    extra = [
+        {"city_id": 1, "reading_timestamp": "2026-05-25T01:00:00+00:00"},
+        {"city_id": 8, "reading_timestamp": "2026-05-24T23:00:00+00:00"},
+    ]
+
+    assert [reading["city_id"] for reading in rollups.collect_inserted_readings(CITY_RESULTS, extra)] == [1, 6, 8]
+
+
+def test_refresh_rollups_sends_only_this_runs_readings():
+    supabase = MagicMock()
+    supabase.rpc.return_value.execute.return_value.data = {"cities": 2, "hourly_buckets": 2, "daily_buckets": 2}
+
+    summary = rollups.refresh_rollups(CITY_RESULTS, supabase)
+
+    rpc_name, params = supabase.rpc.call_args.args
+    assert rpc_name == "refresh_air_quality_rollups"
+    assert [reading["city_id"] for reading in params["p_readings"]] == [1, 6]
+    assert summary == {
+        "mode": "on",
+        "status": "success",
+        "readings": 2,
+        "retried": 0,
+        "hourly_buckets": 2,
+        "daily_buckets": 2,
+    }
+
+
+def test_refresh_rollups_skips_rpc_without_new_readings():
+    supabase = MagicMock()
+
+    assert rollups.refresh_rollups(CITY_RESULTS[3:], supabase)["status"] == "no_new_readings"
+    supabase.rpc.assert_not_called()
+
+
+def test_failed_refresh_is_reported_not_raised():
+    supabase = MagicMock()
+    supabase.rpc.return_value.execute.side_effect = Exception("function does not exist")
+
+    summary = rollups.refresh_rollups(CITY_RESULTS, supabase)
+
+    assert summary["status"] == "failed"
+    assert summary["error"] == "function does not exist"
+
+
+def test_failed_refresh_is_retried_by_the_next_run():
+    failing = MagicMock()
+    failing.rpc.return_value.execute.side_effect = Exception("statement timeout")
+    rollups.refresh_rollups(CITY_RESULTS, failing)
+
+    supabase = MagicMock()
+    supabase.rpc.return_value.execute.return_value.data = {}
+    next_run = [{"city_id": 8, "reading_inserted": True, "reading_timestamp": "2026-05-25T02:00:00+00:00"}]
+    summary = rollups.refresh_rollups(next_run, supabase)
+
+    _, params = supabase.rpc.call_args.args
+    assert [reading["city_id"] for reading in params["p_readings"]] == [8, 1, 6]
+    assert summary["retried"] == 2
+    assert rollups.load_pending_readings() == []
+
+
+def test_rollups_off_and_invalid_mode(monkeypatch):
+    monkeypatch.setenv("PIPELINE_ROLLUPS", "off")
+    assert rollups.refresh_rollups(CITY_RESULTS, MagicMock()) == {"mode": "off", "status": "disabled"}
+
+    monkeypatch.setenv("PIPELINE_ROLLUPS", "sometimes")
+    with pytest.raises(EnvironmentError, match="PIPELINE_ROLLUPS invalido"):
+        rollups.get_rollup_mode()
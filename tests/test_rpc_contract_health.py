@@ -10,6 +10,7 @@ from scripts.rpc_contract_health import (
     DEFAULT_EXPECTED_ACTIVE_CITY_IDS,
     EXPECTED_COLUMNS,
     FreshnessThresholds,
+    compare_rpc_rows,
     evaluate_rpc_contract,
     fetch_rpc_rows,
     main,
@@ -184,3 +185,31 @@ def test_main_exit_codes_for_healthy_degraded_unhealthy_and_config_error(capsys)
 
     captured = capsys.readouterr()
     assert "SUPABASE_SERVICE_ROLE_KEY" not in captured.out
+
+
+def test_compare_rpc_rows_reports_missing_and_mismatched_cities():
+    rows = make_all_rows()
+    cached_rows = [dict(row) for row in rows[1:]]
+    cached_rows[0]["aqi_us"] = 99
+
+    differences = compare_rpc_rows(rows, cached_rows)
+
+    assert differences == [
+        "city_id 1 missing from get_latest_air_quality_per_city_cached",
+        "city_id 4 differs in get_latest_air_quality_per_city_cached: aqi_us",
+    ]
+    assert compare_rpc_rows(rows, [dict(row) for row in reversed(rows)]) == []
+
+
+def test_main_is_unhealthy_when_cached_rpc_diverges(capsys):
+    rows = make_runtime_rows()
+    stale_cached = [dict(row) for row in rows]
+    stale_cached[0]["reading_timestamp"] = "2026-01-01T00:00:00+00:00"
+
+    def fetch(rpc_name="get_latest_air_quality_per_city"):
+        return stale_cached if rpc_name == "get_latest_air_quality_per_city_cached" else rows
+
+    with patch("scripts.rpc_contract_health.fetch_rpc_rows", side_effect=fetch):
+        assert main(["--json-only"]) == 1
+
+    assert '"cached_rpc_matches": false' in capsys.readouterr().out
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+import pytest
+
+import scheduler
+
+
+def test_order_cities_by_staleness_puts_never_updated_and_failing_cities_first():
+    cities = [
+        {"id": 1, "last_update_status": "success", "last_successful_update_at": "2026-05-25T02:00:00Z"},
+        {"id": 2, "last_update_status": "success", "last_successful_update_at": "2026-05-25T00:00:00Z"},
+        {"id": 3, "last_update_status": "error", "last_successful_update_at": "2026-05-25T00:00:00Z"},
+        {"id": 4, "last_update_status": None, "last_successful_update_at": None},
+        {"id": 5, "last_update_status": "success", "last_successful_update_at": "2026-05-24T18:00:00"},
+    ]
+
+    ordered = scheduler.order_cities_by_staleness(cities)
+
+    assert [city["id"] for city in ordered] == [4, 5, 3, 2, 1]
+
+
+def test_percentile_uses_nearest_rank():
+    assert scheduler.percentile([], 0.95) is None
+    assert scheduler.percentile([3.0], 0.95) == 3.0
+    assert scheduler.percentile([float(value) for value in range(1, 21)], 0.95) == 19.0
+
+
+def test_unlimited_budget_always_starts_cities():
+    budget = scheduler.RunBudget(None)
+
+    assert budget.can_start_city() is True
+    assert budget.remaining_seconds() is None
+
+
+def test_budget_uses_default_estimate_until_latencies_are_observed():
+    with patch("scheduler.time.perf_counter", return_value=100.0):
+        budget = scheduler.RunBudget(40.0, started_at=90.0)
+        assert budget.can_start_city() is True
+
+        budget.record_city_latency(35.0)
+        assert budget.can_start_city() is False
+
+
+def test_budget_stays_exhausted_after_refusing_a_city():
+    clock = {"now": 0.0}
+    with patch("scheduler.time.perf_counter", side_effect=lambda: clock["now"]):
+        budget = scheduler.RunBudget(60.0)
+        budget.record_city_latency(20.0)
+        clock["now"] = 45.0
+        assert budget.can_start_city() is False
+
+        budget.record_city_latency(1.0)
+        budget.record_city_latency(1.0)
+        assert budget.can_start_city() is False
+
+    assert budget.snapshot()["budget_exhausted"] is True
+
+
+def test_record_outcome_latency_ignores_up_to_date_skips():
+    budget = scheduler.RunBudget(60.0)
+
+    scheduler.record_outcome_latency(budget, {"result": {"needed_update": False}, "elapsed_seconds": 0.01})
+    scheduler.record_outcome_latency(budget, {"result": {"needed_update": True}, "elapsed_seconds": 4.0})
+
+    assert budget.p95_latency() == 4.0
+
+
+def test_get_max_runtime_seconds_rejects_invalid_values(monkeypatch):
+    monkeypatch.delenv("PIPELINE_MAX_RUNTIME_SECONDS", raising=False)
+    assert scheduler.get_max_runtime_seconds() is None
+
+    monkeypatch.setenv("PIPELINE_MAX_RUNTIME_SECONDS", "-5")
+    with pytest.raises(EnvironmentError, match="PIPELINE_MAX_RUNTIME_SECONDS"):
+        scheduler.get_max_runtime_seconds()
@@ -1,4 +1,5 @@
 import socket
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -19,6 +20,39 @@ def test_get_supabase_client(mock_create_client, mock_getaddrinfo, monkeypatch):
     mock_create_client.assert_called_once_with('https://example-project.supabase.co', 'test_key')
 
 
+@patch('supabase_client.socket.getaddrinfo')
+@patch('supabase_client.create_client')
+def test_get_supabase_client_is_cached_per_process(mock_create_client, mock_getaddrinfo, monkeypatch):
+    """Repeated and concurrent callers share one validated client."""
+    monkeypatch.setenv('SUPABASE_URL', 'https://example-project.supabase.co')
+    monkeypatch.setenv('SUPABASE_SERVICE_ROLE_KEY', 'test_key')
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        clients = list(executor.map(lambda _: supabase_client.get_supabase_client(), range(8)))
+
+    assert all(client is clients[0] for client in clients)
+    mock_getaddrinfo.assert_called_once()
+    mock_create_client.assert_called_once()
+
+    supabase_client.reset_supabase_client()
+    supabase_client.get_supabase_client()
+    assert mock_create_client.call_count == 2
+
+
+@patch('supabase_client.socket.getaddrinfo')
+@patch('supabase_client.create_client')
+def test_get_supabase_client_rebuilds_when_credentials_change(mock_create_client, mock_getaddrinfo, monkeypatch):
+    monkeypatch.setenv('SUPABASE_URL', 'https://example-project.supabase.co')
+    monkeypatch.setenv('SUPABASE_SERVICE_ROLE_KEY', 'test_key')
+    supabase_client.get_supabase_client()
+
+    monkeypatch.setenv('SUPABASE_SERVICE_ROLE_KEY', 'rotated_key')
+    supabase_client.get_supabase_client()
+
+    assert mock_create_client.call_args.args == ('https://example-project.supabase.co', 'rotated_key')
+    assert mock_create_client.call_count == 2
+
+
 @patch('supabase_client.socket.getaddrinfo')
 def test_validate_supabase_url_rejects_postgres_host(mock_getaddrinfo):
     with pytest.raises(ValueError, match='no parece una API URL de Supabase'):
@@ -37,10 +37,25 @@ def test_update_city_success(mock_supabase_client, success_fetch_result):
     assert result['cityStatusUpdated'] == True
     assert result['insertError'] is None
     assert result['updateError'] is None
-    mock_supabase_client.table.return_value.insert.assert_called_once()
+    mock_supabase_client.table.return_value.upsert.assert_called_once()
+    upsert_kwargs = mock_supabase_client.table.return_value.upsert.call_args.kwargs
+    assert upsert_kwargs['on_conflict'] == 'city_id,reading_timestamp'
+    assert upsert_kwargs['ignore_duplicates'] is True
     mock_supabase_client.table.return_value.update.return_value.eq.assert_called_once_with('id', 1)
 
 
+def test_update_city_repeated_reading_is_not_an_insert_error(mock_supabase_client, success_fetch_result):
+    """An already stored (city_id, reading_timestamp) comes back empty from the upsert."""
+    mock_supabase_client.table.return_value.upsert.return_value.execute.return_value.data = []
+
+    result = update_city(success_fetch_result)
+
+    assert result['readingInserted'] is False
+    assert result['readingDuplicate'] is True
+    assert result['insertError'] is None
+    assert result['cityStatusUpdated'] is True
+
+
 def test_update_city_maps_successful_weather_context(mock_supabase_client, success_fetch_result):
     success_fetch_result['weather_context'] = {
         'status': 'success',
@@ -57,7 +72,7 @@ def test_update_city_maps_successful_weather_context(mock_supabase_client, succe
     result = update_city(success_fetch_result)
 
     assert result['readingInserted'] is True
-    inserted_payload = mock_supabase_client.table.return_value.insert.call_args.args[0]
+    inserted_payload = mock_supabase_client.table.return_value.upsert.call_args.args[0]
     assert inserted_payload['weather_temperature_c'] == 28
     assert inserted_payload['weather_humidity_percent'] == 50
     assert inserted_payload['weather_wind_speed_kmh'] == 12.5
@@ -78,7 +93,7 @@ def test_update_city_ignores_failed_weather_context(mock_supabase_client, succes
     result = update_city(success_fetch_result)
 
     assert result['readingInserted'] is True
-    inserted_payload = mock_supabase_client.table.return_value.insert.call_args.args[0]
+    inserted_payload = mock_supabase_client.table.return_value.upsert.call_args.args[0]
     assert 'weather_temperature_c' not in inserted_payload
     assert 'weather_provider' not in inserted_payload
 
@@ -95,7 +110,7 @@ def test_update_city_fetch_error(mock_supabase_client):
     assert result['cityStatusUpdated'] == True # Status is updated to error
     assert result['insertError'] is None
     assert result['updateError'] is None
-    mock_supabase_client.table.return_value.insert.assert_not_called()
+    mock_supabase_client.table.return_value.upsert.assert_not_called()
     mock_supabase_client.table.return_value.update.return_value.eq.assert_called_once_with('id', 2)
 
 
@@ -108,7 +123,7 @@ def test_update_city_validation_failure(mock_supabase_client, success_fetch_resu
     assert result['readingInserted'] is False
     assert result['cityStatusUpdated'] is True
     assert result['validationErrors'] is not None
-    mock_supabase_client.table.return_value.insert.assert_not_called()
+    mock_supabase_client.table.return_value.upsert.assert_not_called()
 
 def test_update_city_skip(mock_supabase_client):
     """Test update_city when the result indicates a skip."""
@@ -122,5 +137,68 @@ def test_update_city_skip(mock_supabase_client):
     assert result['cityStatusUpdated'] == True # Status is updated to skipped
     assert result['insertError'] is None
     assert result['updateError'] is None
-    mock_supabase_client.table.return_value.insert.assert_not_called()
+    mock_supabase_client.table.return_value.upsert.assert_not_called()
     mock_supabase_client.table.return_value.update.return_value.eq.assert_called_once_with('id', 3)
+
+
+def test_update_city_unchanged_upstream_marks_skip_without_insert(mock_supabase_client):
+    """Unchanged WAQI stations update the city status but never insert a duplicate."""
+    skipped_result = {
+        'city_id': 4,
+        'status': 'skipped',
+        'skipReason': 'unchanged_upstream',
+    }
+    result = update_city(skipped_result)
+
+    assert result['readingInserted'] is False
+    assert result['cityStatusUpdated'] is True
+    mock_supabase_client.table.return_value.upsert.assert_not_called()
+    update_payload = mock_supabase_client.table.return_value.update.call_args.args[0]
+    assert update_payload['last_update_status'] == 'skipped: unchanged_upstream'
+
+
+def test_update_city_rpc_mode_writes_in_one_call(mock_supabase_client, success_fetch_result, monkeypatch):
+    """PIPELINE_WRITE_MODE=rpc sends reading, status and log in one ingest RPC call."""
+    monkeypatch.setenv('PIPELINE_WRITE_MODE', 'rpc')
+    mock_supabase_client.rpc.return_value.execute.return_value.data = {
+        'readingInserted': True,
+        'cityStatusUpdated': True,
+    }
+
+    with patch('update_city.log_pipeline_event') as log_event:
+        result = update_city(success_fetch_result)
+
+    assert result['readingInserted'] is True
+    assert result['cityStatusUpdated'] is True
+    rpc_name, params = mock_supabase_client.rpc.call_args.args
+    assert rpc_name == 'ingest_air_quality_reading'
+    assert params['payload']['reading']['aqi_us'] == 50
+    assert params['payload']['city_status']['last_update_status'] == 'success'
+    mock_supabase_client.table.assert_not_called()
+    log_event.assert_not_called()
+
+
+def test_update_city_rpc_mode_failure_marks_both_writes_failed(mock_supabase_client, success_fetch_result, monkeypatch):
+    monkeypatch.setenv('PIPELINE_WRITE_MODE', 'rpc')
+    mock_supabase_client.rpc.return_value.execute.side_effect = Exception('permission denied')
+
+    result = update_city(success_fetch_result)
+
+    assert result['readingInserted'] is False
+    assert result['cityStatusUpdated'] is False
+    assert result['insertError'] == 'permission denied'
+    assert result['updateError'] == 'permission denied'
+
+
+def test_update_city_hashed_raw_payload_store_writes_hash_instead_of_jsonb(mock_supabase_client, success_fetch_result, monkeypatch):
+    monkeypatch.setenv('PIPELINE_RAW_PAYLOAD_STORE', 'hashed')
+    success_fetch_result['api_raw_response'] = {'aqi': 50, 'idx': 6492}
+
+    result = update_city(success_fetch_result)
+
+    assert result['readingInserted'] is True
+    tables = [call.args[0] for call in mock_supabase_client.table.call_args_list]
+    assert tables.index('raw_payloads') < tables.index('air_quality_readings')
+    inserted_payload = mock_supabase_client.table.return_value.upsert.call_args.args[0]
+    assert inserted_payload['raw_api_response'] is None
+    assert len(inserted_payload['raw_payload_hash']) == 64
@@ -1,6 +1,6 @@
 import pytest
 from datetime import datetime, timedelta, timezone
-from utils import check_if_update_needed, UPDATE_INTERVAL_MINUTES, compute_inter_city_delay, validate_reading_payload
+from utils import check_if_update_needed, UPDATE_INTERVAL_MINUTES, compute_inter_city_delay, validate_reading_payload, canonical_json_sha256
 
 @pytest.fixture
 def base_city():
@@ -104,3 +104,12 @@ def test_validate_reading_payload_failure():
     result = validate_reading_payload(reading)
     assert result['valid'] is False
     assert 'aqi_us_out_of_range' in result['reasons']
+
+
+def test_canonical_json_sha256_ignores_key_order_and_whitespace():
+    first = canonical_json_sha256({"b": [1, 2], "a": {"y": "México", "x": 1.5}})
+    second = canonical_json_sha256({"a": {"x": 1.5, "y": "México"}, "b": [1, 2]})
+
+    assert first == second
+    assert len(first) == 64
+    assert canonical_json_sha256({"a": 1}) != canonical_json_sha256({"a": 2})
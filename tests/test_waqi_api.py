@@ -1,5 +1,11 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import pytest
+
+import rate_limiter
+import utils
 import waqi_api
 
 
@@ -102,9 +108,44 @@ def test_normalize_waqi_payload_success():
     assert result["clima"]["humedad_relativa"] == 46
     assert result["clima"]["velocidad_viento_ms"] == 2.1
     assert result["clima"]["direccion_viento_deg"] == 90
+    assert result["api_raw_response"]["aqi"] == 87
+    assert result["api_raw_response"]["iaqi"] == SUCCESS_WAQI_PAYLOAD["data"]["iaqi"]
+
+
+def test_normalize_waqi_payload_stores_projection_with_full_payload_hash():
+    data = {
+        **SUCCESS_WAQI_PAYLOAD["data"],
+        "idx": 6493,
+        "city": {"geo": [25.74167, -100.30222], "name": "San Nicolas", "url": "https://aqicn.org/x"},
+        "attributions": [{"url": "https://example.org", "name": "SINAICA"}],
+        "forecast": {"daily": {"pm25": [{"avg": 80, "day": "2026-05-05"}] * 8}},
+        "debug": {"sync": "2026-05-05T18:10:00+09:00"},
+    }
+
+    result = waqi_api.normalize_waqi_payload({"status": "ok", "data": data}, "Guadalupe", 12, "6493")
+    stored = result["api_raw_response"]
+
+    assert set(stored) == {"aqi", "idx", "dominentpol", "iaqi", "time", "city", "_projection"}
+    assert stored["city"] == {"geo": [25.74167, -100.30222]}
+    assert stored["_projection"]["full_sha256"] == utils.canonical_json_sha256(data)
+    assert len(json.dumps(stored)) < len(json.dumps(data))
+
+
+def test_normalize_waqi_payload_full_mode_keeps_entire_data(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WAQI_RAW_PAYLOAD_MODE", "full")
+
+    result = waqi_api.normalize_waqi_payload(SUCCESS_WAQI_PAYLOAD, "Guadalupe", 12, "6494")
+
     assert result["api_raw_response"] == SUCCESS_WAQI_PAYLOAD["data"]
 
 
+def test_raw_payload_mode_rejects_unknown_value(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WAQI_RAW_PAYLOAD_MODE", "everything")
+
+    with pytest.raises(EnvironmentError):
+        waqi_api.get_raw_payload_mode()
+
+
 def test_fetch_air_quality_data_missing_token_fails_closed():
     result = waqi_api.fetch_air_quality_data(
         api_name="San Nicolas de los Garza",
@@ -233,7 +274,7 @@ def test_fetch_air_quality_data_success_does_not_log_token():
     response.raise_for_status.return_value = None
     response.json.return_value = SUCCESS_WAQI_PAYLOAD
 
-    with patch("waqi_api.requests.get", return_value=response) as mock_get:
+    with patch("waqi_api.http_get", return_value=response) as mock_get:
         result = waqi_api.fetch_air_quality_data(
             api_name="San Nicolas de los Garza",
             city_id=11,
@@ -244,3 +285,213 @@ def test_fetch_air_quality_data_success_does_not_log_token():
     mock_get.assert_called_once()
     _, kwargs = mock_get.call_args
     assert kwargs["params"] == {"token": "secret-token"}
+
+
+def test_fetch_air_quality_data_async_reuses_normalizer():
+    response = MagicMock()
+    response.status_code = 200
+    response.raise_for_status.return_value = None
+    response.json.return_value = SUCCESS_WAQI_PAYLOAD
+    client = MagicMock()
+    client.get = AsyncMock(return_value=response)
+
+    result = asyncio.run(
+        waqi_api.fetch_air_quality_data_async(
+            client,
+            api_name="San Nicolas de los Garza",
+            city_id=11,
+            waqi_api_token="secret-token",
+        )
+    )
+
+    expected = waqi_api.normalize_waqi_payload(
+        raw_api_data=SUCCESS_WAQI_PAYLOAD,
+        api_name="San Nicolas de los Garza",
+        city_id=11,
+        station_id="6493",
+    )
+    assert result == expected
+    _, kwargs = client.get.call_args
+    assert kwargs["params"] == {"token": "secret-token"}
+
+
+def test_waqi_over_quota_payload_counts_as_throttle():
+    rate_limiter.reset_provider_limiters()
+
+    waqi_api.report_waqi_quota_signal({"status": "error", "data": "Over quota"})
+    waqi_api.report_waqi_quota_signal({"status": "error", "data": "Unknown station"})
+
+    assert rate_limiter.get_provider_limiter("waqi").throttles == 1
+
+
+BOUNDS_PAYLOAD = {
+    "status": "ok",
+    "data": [
+        {"uid": 6493, "aqi": "87", "station": {"time": "2026-05-05T12:00:00-06:00"}},
+        {"uid": 6494, "aqi": "61", "station": {"time": "2026-05-05T13:00:00-06:00"}},
+        {"uid": 999, "aqi": "-", "station": {}},
+    ],
+}
+
+
+def make_response(payload):
+    response = MagicMock()
+    response.status_code = 200
+    response.headers = {}
+    response.raise_for_status.return_value = None
+    response.json.return_value = payload
+    return response
+
+
+def test_parse_bounds_payload_maps_station_uid_to_timestamp():
+    station_times = waqi_api.parse_bounds_payload(BOUNDS_PAYLOAD)
+
+    assert station_times == {
+        "6493": "2026-05-05T12:00:00-06:00",
+        "6494": "2026-05-05T13:00:00-06:00",
+    }
+    assert waqi_api.parse_bounds_payload({"status": "error", "data": "Over quota"}) is None
+
+
+def test_bounds_params_cover_nuevo_leon_box():
+    assert waqi_api.build_bounds_params("secret-token") == {
+        "latlng": "25.0,-101.0,26.5,-99.0",
+        "token": "secret-token",
+    }
+
+
+def test_bounds_mode_skips_detail_fetch_for_unchanged_stations(monkeypatch, tmp_path):
+    state_path = tmp_path / "waqi_stations.json"
+    state_path.write_text('{"6493": "2026-05-05T12:00:00-06:00", "6494": "2026-05-05T12:00:00-06:00"}')
+    monkeypatch.setenv("PIPELINE_WAQI_FETCH_MODE", "bounds")
+    monkeypatch.setenv("PIPELINE_WAQI_STATE_PATH", str(state_path))
+
+    with patch("waqi_api.http_get", return_value=make_response(BOUNDS_PAYLOAD)) as mock_get:
+        snapshot = waqi_api.prepare_bounds_snapshot("secret-token")
+    assert snapshot == {"mode": "bounds", "status": "success", "stations": 2}
+    assert mock_get.call_args.args[0] == waqi_api.WAQI_BOUNDS_URL
+
+    with patch("waqi_api.http_get", return_value=make_response(SUCCESS_WAQI_PAYLOAD)) as mock_get:
+        unchanged = waqi_api.fetch_air_quality_data("San Nicolas de los Garza", 11, "secret-token")
+        advanced = waqi_api.fetch_air_quality_data("Guadalupe", 12, "secret-token")
+
+    assert unchanged["status"] == "skipped"
+    assert unchanged["skipReason"] == "unchanged_upstream"
+    assert advanced["status"] == "success"
+    mock_get.assert_called_once()
+
+    # A fetch alone does not advance the state; the stored write does.
+    waqi_api.save_station_state()
+    assert waqi_api.load_station_state(state_path)["6494"] == "2026-05-05T12:00:00-06:00"
+    waqi_api.record_station_detail_fetched("6494")
+    waqi_api.save_station_state()
+    assert waqi_api.load_station_state(state_path)["6494"] == "2026-05-05T13:00:00-06:00"
+    waqi_api.reset_bounds_snapshot()
+
+
+def test_force_update_fetches_unchanged_bounds_stations(monkeypatch, tmp_path):
+    state_path = tmp_path / "waqi_stations.json"
+    state_path.write_text('{"6493": "2026-05-05T12:00:00-06:00"}')
+    monkeypatch.setenv("PIPELINE_WAQI_FETCH_MODE", "bounds")
+    monkeypatch.setenv("PIPELINE_WAQI_STATE_PATH", str(state_path))
+
+    with patch("waqi_api.http_get", return_value=make_response(BOUNDS_PAYLOAD)):
+        waqi_api.prepare_bounds_snapshot("secret-token", force_update=True)
+    with patch("waqi_api.http_get", return_value=make_response(SUCCESS_WAQI_PAYLOAD)) as mock_get:
+        result = waqi_api.fetch_air_quality_data("San Nicolas de los Garza", 11, "secret-token")
+
+    assert result["status"] == "success"
+    mock_get.assert_called_once()
+    waqi_api.reset_bounds_snapshot()
+
+
+def test_bounds_fetch_failure_falls_back_to_detail_fetch(monkeypatch, tmp_path):
+    state_path = tmp_path / "waqi_stations.json"
+    state_path.write_text('{"6493": "2026-05-05T12:00:00-06:00"}')
+    monkeypatch.setenv("PIPELINE_WAQI_FETCH_MODE", "bounds")
+    monkeypatch.setenv("PIPELINE_WAQI_STATE_PATH", str(state_path))
+
+    with patch("waqi_api.http_get", side_effect=TimeoutError("bounds timeout")):
+        snapshot = waqi_api.prepare_bounds_snapshot("secret-token")
+    assert snapshot["status"] == "fetch_failed"
+
+    with patch("waqi_api.http_get", return_value=make_response(SUCCESS_WAQI_PAYLOAD)) as mock_get:
+        result = waqi_api.fetch_air_quality_data("San Nicolas de los Garza", 11, "secret-token")
+
+    assert result["status"] == "success"
+    mock_get.assert_called_once()
+    waqi_api.reset_bounds_snapshot()
+
+
+def test_feed_mode_does_not_call_bounds_endpoint():
+    with patch("waqi_api.http_get") as mock_get:
+        snapshot = waqi_api.prepare_bounds_snapshot("secret-token")
+
+    assert snapshot == {"mode": "feed", "status": "disabled"}
+    mock_get.assert_not_called()
+
+
+SHARED_STATION_CITIES = [
+    {"id": 7, "api_name": "Garcia"},
+    {"id": 8, "api_name": "García"},
+    {"id": 11, "api_name": "San Nicolas de los Garza"},
+]
+
+
+def test_station_fetch_plan_fetches_shared_station_once_and_fans_out():
+    plan = waqi_api.prepare_station_fetch_plan(SHARED_STATION_CITIES)
+    assert plan["stations"] == 2
+    assert plan["shared_stations"] == {"6495": [7, 8]}
+
+    with patch("waqi_api.http_get", return_value=make_response(SUCCESS_WAQI_PAYLOAD)) as mock_get:
+        first = waqi_api.fetch_air_quality_data("Garcia", 7, "secret-token")
+        second = waqi_api.fetch_air_quality_data("García", 8, "secret-token")
+
+    mock_get.assert_called_once()
+    assert first["status"] == second["status"] == "success"
+    assert (first["city_id"], second["city_id"]) == (7, 8)
+    assert second["municipio"] == "García"
+    assert second["sharedFetchCityId"] == 7
+    assert "sharedFetchCityId" not in first
+    assert waqi_api.get_shared_fetch_city_ids() == [8]
+
+
+def test_shared_station_is_not_skipped_as_unchanged_after_its_first_fetch(monkeypatch, tmp_path):
+    state_path = tmp_path / "waqi_stations.json"
+    state_path.write_text('{"6495": "2026-05-05T11:00:00-06:00"}')
+    monkeypatch.setenv("PIPELINE_WAQI_FETCH_MODE", "bounds")
+    monkeypatch.setenv("PIPELINE_WAQI_STATE_PATH", str(state_path))
+    bounds = {"status": "ok", "data": [{"uid": 6495, "station": {"time": "2026-05-05T12:00:00-06:00"}}]}
+
+    with patch("waqi_api.http_get", return_value=make_response(bounds)):
+        waqi_api.prepare_bounds_snapshot("secret-token")
+    waqi_api.prepare_station_fetch_plan(SHARED_STATION_CITIES)
+
+    with patch("waqi_api.http_get", return_value=make_response(SUCCESS_WAQI_PAYLOAD)) as mock_get:
+        results = [
+            waqi_api.fetch_air_quality_data("Garcia", 7, "secret-token"),
+            waqi_api.fetch_air_quality_data("García", 8, "secret-token"),
+        ]
+
+    mock_get.assert_called_once()
+    assert [result["status"] for result in results] == ["success", "success"]
+
+
+def test_station_fetch_plan_async_awaits_one_shared_fetch():
+    client = MagicMock()
+    client.get = AsyncMock(return_value=make_response(SUCCESS_WAQI_PAYLOAD))
+    waqi_api.prepare_station_fetch_plan(SHARED_STATION_CITIES)
+
+    async def run():
+        return await asyncio.gather(
+            waqi_api.fetch_air_quality_data_async(client, "Garcia", 7, "secret-token"),
+            waqi_api.fetch_air_quality_data_async(client, "García", 8, "secret-token"),
+            waqi_api.fetch_air_quality_data_async(client, "San Nicolas de los Garza", 11, "secret-token"),
+        )
+
+    results = asyncio.run(run())
+
+    assert client.get.await_count == 2
+    assert [result["city_id"] for result in results] == [7, 8, 11]
+    assert results[1]["sharedFetchCityId"] == 7
+    assert waqi_api.get_shared_fetch_city_ids() == [8]
@@ -0,0 +1,137 @@
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import weather_cache
+from scripts.weather_history_backfill import City, fetch_open_meteo_hours
+from weather_context import fetch_weather_context, reset_weather_prefetch
+
+
+ARCHIVE_PAYLOAD = {
+    "hourly": {
+        "time": ["2026-03-01T00:00", "2026-03-01T01:00"],
+        "temperature_2m": [18.2, 17.9],
+        "relative_humidity_2m": [60, 62],
+        "wind_speed_10m": [7.2, 6.8],
+        "wind_direction_10m": [120, 125],
+        "wind_gusts_10m": [14.0, 12.5],
+    }
+}
+
+
+@pytest.fixture(autouse=True)
+def cache_on(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_CACHE", "on")
+
+
+def make_response(payload):
+    response = MagicMock()
+    response.status_code = 200
+    response.headers = {}
+    response.raise_for_status.return_value = None
+    response.json.return_value = payload
+    return response
+
+
+def test_cache_round_trip_counts_hits_and_misses(tmp_path):
+    cache = weather_cache.WeatherCache(tmp_path / "cache.sqlite3", max_entries=10)
+
+    assert cache.get("k") is None
+    cache.put("k", "forecast", {"current": {"temperature_2m": 28.5}}, ttl_seconds=60)
+
+    assert cache.get("k") == {"current": {"temperature_2m": 28.5}}
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+    assert cache.stats["writes"] == 1
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = weather_cache.WeatherCache(tmp_path / "cache.sqlite3", max_entries=10)
+    with patch("weather_cache.time.time", return_value=1000.0):
+        cache.put("k", "forecast", {"v": 1}, ttl_seconds=60)
+    with patch("weather_cache.time.time", return_value=1061.0):
+        assert cache.get("k") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = weather_cache.WeatherCache(tmp_path / "cache.sqlite3", max_entries=2)
+    with patch("weather_cache.time.time", side_effect=[1.0, 2.0, 3.0, 4.0]):
+        cache.put("a", "archive", {"v": "a"}, ttl_seconds=3600)
+        cache.put("b", "archive", {"v": "b"}, ttl_seconds=3600)
+        assert cache.get("a") == {"v": "a"}
+        cache.put("c", "archive", {"v": "c"}, ttl_seconds=3600)
+
+    assert cache.entries() == 2
+    assert cache.stats["evictions"] == 1
+    with patch("weather_cache.time.time", return_value=5.0):
+        assert cache.get("b") is None
+        assert cache.get("a") == {"v": "a"}
+
+
+def test_cache_key_rounds_coordinates_and_ignores_param_order():
+    first = weather_cache.build_cache_key("archive", {"latitude": 25.686612, "longitude": -100.31611, "hourly": "t"})
+    second = weather_cache.build_cache_key("archive", {"hourly": "t", "longitude": -100.3161, "latitude": 25.6866})
+
+    assert first == second
+    assert first != weather_cache.build_cache_key("archive", {"latitude": 25.6866, "longitude": -100.3161}, "2026-05-25T01:00Z")
+
+
+def test_archive_ttl_is_long_only_for_settled_ranges():
+    today = date(2026, 6, 1)
+
+    assert weather_cache.archive_ttl_seconds("2026-05-01", today) == weather_cache.SETTLED_ARCHIVE_TTL_SECONDS
+    assert weather_cache.archive_ttl_seconds("2026-05-30", today) == weather_cache.RECENT_ARCHIVE_TTL_SECONDS
+
+
+def test_forecast_fetch_is_served_from_disk_on_the_next_run():
+    payload = {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}}
+
+    with patch("weather_context.http_get", return_value=make_response(payload)) as get_mock:
+        first = fetch_weather_context(25.67, -100.31)
+        reset_weather_prefetch()  # next run: the in-run cache is empty
+        second = fetch_weather_context(25.67, -100.31)
+
+    get_mock.assert_called_once()
+    assert first["weather_temperature_c"] == second["weather_temperature_c"] == 28.5
+    assert weather_cache.get_weather_cache_stats()["hits"] == 1
+
+
+def test_backfill_archive_window_is_downloaded_once():
+    city = City(1, "Monterrey", 25.6866, -100.3161)
+
+    with patch("scripts.weather_history_backfill.http_get", return_value=make_response(ARCHIVE_PAYLOAD)) as get_mock:
+        first = fetch_open_meteo_hours(city, "2026-03-01", "2026-03-01")
+        second = fetch_open_meteo_hours(city, "2026-03-01", "2026-03-01")
+
+    get_mock.assert_called_once()
+    assert first == second
+    assert len(first) == 2
+
+
+def test_unreadable_cache_file_falls_back_to_the_network(tmp_path, monkeypatch):
+    broken = tmp_path / "broken.sqlite3"
+    broken.write_bytes(b"not a sqlite database" * 100)
+    monkeypatch.setenv("PIPELINE_WEATHER_CACHE_PATH", str(broken))
+    city = City(1, "Monterrey", 25.6866, -100.3161)
+
+    with patch("scripts.weather_history_backfill.http_get", return_value=make_response(ARCHIVE_PAYLOAD)) as get_mock:
+        hours = fetch_open_meteo_hours(city, "2026-03-01", "2026-03-01")
+
+    get_mock.assert_called_once()
+    assert len(hours) == 2
+
+
+def test_archive_payload_without_hourly_series_is_not_cached():
+    city = City(1, "Monterrey", 25.6866, -100.3161)
+    error_body = {"error": True, "reason": "Parameter 'start_date' is out of allowed range"}
+    responses = [make_response(error_body), make_response(ARCHIVE_PAYLOAD)]
+
+    with patch("scripts.weather_history_backfill.http_get", side_effect=responses) as get_mock:
+        first = fetch_open_meteo_hours(city, "2026-03-01", "2026-03-01")
+        second = fetch_open_meteo_hours(city, "2026-03-01", "2026-03-01")
+
+    assert get_mock.call_count == 2
+    assert first == []
+    assert len(second) == 2
+    assert weather_cache.get_weather_cache_stats()["writes"] == 1
@@ -1,12 +1,27 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+import itertools
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
 
 from weather_context import (
     build_weather_error,
     enrich_with_weather_context,
     fetch_weather_context,
+    fetch_weather_context_async,
+    fetch_weather_context_batch,
+    get_prefetched_weather_context,
+    get_weather_cache_snapshot,
+    get_weather_health_snapshot,
+    get_weather_grid_degrees,
+    get_weather_mode,
     normalize_weather_payload,
     parse_int,
     parse_number,
+    prefetch_weather_contexts,
+    reset_weather_prefetch,
+    weather_cache_key,
 )
 
 
@@ -53,7 +68,7 @@ def test_fetch_weather_context_retries_retryable_http_failures():
     }
 
     with patch(
-        "weather_context.requests.get",
+        "weather_context.http_get",
         side_effect=[failed_response, success_response],
     ) as get_mock, patch("weather_context.time.sleep") as sleep_mock:
         result = fetch_weather_context(25.67, -100.31)
@@ -64,12 +79,37 @@ def test_fetch_weather_context_retries_retryable_http_failures():
     sleep_mock.assert_called_once()
 
 
+def test_fetch_weather_context_async_retries_retryable_http_failures():
+    failed_response = MagicMock()
+    failed_response.status_code = 503
+
+    success_response = MagicMock()
+    success_response.status_code = 200
+    success_response.raise_for_status.return_value = None
+    success_response.json.return_value = {
+        "current": {
+            "time": "2026-05-25T01:00",
+            "temperature_2m": 28.5,
+        }
+    }
+    client = MagicMock()
+    client.get = AsyncMock(side_effect=[failed_response, success_response])
+
+    with patch("weather_context.asyncio.sleep", new=AsyncMock()) as sleep_mock:
+        result = asyncio.run(fetch_weather_context_async(client, 25.67, -100.31))
+
+    assert result["status"] == "success"
+    assert result["weather_temperature_c"] == 28.5
+    assert client.get.call_count == 2
+    sleep_mock.assert_awaited_once()
+
+
 def test_fetch_weather_context_does_not_retry_nonretryable_http_failures():
     response = MagicMock()
     response.status_code = 404
     response.raise_for_status.side_effect = RuntimeError("not found")
 
-    with patch("weather_context.requests.get", return_value=response) as get_mock, patch(
+    with patch("weather_context.http_get", return_value=response) as get_mock, patch(
         "weather_context.time.sleep"
     ) as sleep_mock:
         result = fetch_weather_context(25.67, -100.31)
@@ -87,7 +127,7 @@ def test_fetch_weather_context_does_not_retry_deterministic_payload_errors():
     response.raise_for_status.return_value = None
     response.json.return_value = {"current": None}
 
-    with patch("weather_context.requests.get", return_value=response) as get_mock, patch(
+    with patch("weather_context.http_get", return_value=response) as get_mock, patch(
         "weather_context.time.sleep"
     ) as sleep_mock:
         result = fetch_weather_context(25.67, -100.31)
@@ -180,7 +220,7 @@ def test_fetch_weather_context_handles_non_json_response():
     response.raise_for_status.return_value = None
     response.json.side_effect = ValueError("not json")
 
-    with patch("weather_context.requests.get", return_value=response), patch("weather_context.time.sleep"):
+    with patch("weather_context.http_get", return_value=response), patch("weather_context.time.sleep"):
         result = fetch_weather_context(25.67, -100.31)
 
     assert result["status"] == "error"
@@ -198,4 +238,362 @@ def test_build_weather_error_shape():
         "errorType": "missing_coordinates",
         "message": "lat/lon required",
         "retryable": False,
-    }
\ No newline at end of file
+    }
+
+def make_weather_response(payload, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {}
+    response.raise_for_status.return_value = None
+    response.json.return_value = payload
+    return response
+
+
+def test_fetch_weather_context_batch_uses_one_request_for_all_locations():
+    payload = [
+        {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}},
+        {"current": {"time": "2026-05-25T01:00", "temperature_2m": 30.1}},
+    ]
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        contexts = fetch_weather_context_batch([(25.67, -100.31), (25.75, -100.3)])
+
+    assert [context["weather_temperature_c"] for context in contexts] == [28.5, 30.1]
+    get_mock.assert_called_once()
+    params = get_mock.call_args.kwargs["params"]
+    assert params["latitude"] == "25.67,25.75"
+    assert params["longitude"] == "-100.31,-100.3"
+
+
+def test_fetch_weather_context_batch_falls_back_only_for_invalid_entries():
+    batch_payload = [
+        {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}},
+        {"current": {"time": "2026-05-25T01:00", "temperature_2m": 999}},
+    ]
+    single_payload = {"current": {"time": "2026-05-25T01:00", "temperature_2m": 29.0}}
+
+    with patch(
+        "weather_context.http_get",
+        side_effect=[make_weather_response(batch_payload), make_weather_response(single_payload)],
+    ) as get_mock:
+        contexts = fetch_weather_context_batch([(25.67, -100.31), (25.75, -100.3), (None, None)])
+
+    assert contexts[0]["weather_temperature_c"] == 28.5
+    assert contexts[1]["weather_temperature_c"] == 29.0
+    assert contexts[2]["errorType"] == "missing_coordinates"
+    assert get_mock.call_count == 2
+    assert get_mock.call_args.kwargs["params"]["latitude"] == 25.75
+
+
+def test_prefetched_context_short_circuits_per_city_fetch():
+    cities = [
+        {"id": 1, "latitude": 25.67, "longitude": -100.31},
+        {"id": 2, "latitude": None, "longitude": None},
+    ]
+    payload = {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}}
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        prefetch_summary = prefetch_weather_contexts(cities)
+        context = fetch_weather_context(25.67, -100.31)
+
+    assert prefetch_summary == {"locations": 1, "success": 1, "errors": 0}
+    assert context["weather_temperature_c"] == 28.5
+    get_mock.assert_called_once()
+
+    reset_weather_prefetch()
+    assert get_prefetched_weather_context(25.67, -100.31) is None
+
+
+def test_cities_in_one_grid_cell_share_a_single_weather_fetch():
+    payload = {
+        "latitude": 25.7,
+        "longitude": -100.3,
+        "elevation": 540.0,
+        "current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5},
+    }
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        monterrey = fetch_weather_context(25.6866, -100.3161)
+        san_nicolas = fetch_weather_context(25.7417, -100.3022)
+
+    get_mock.assert_called_once()
+    # The cell is fetched at the first city's real coordinates, not at the grid node.
+    assert get_mock.call_args.kwargs["params"]["latitude"] == 25.6866
+    assert get_mock.call_args.kwargs["params"]["longitude"] == -100.3161
+    assert monterrey == san_nicolas
+    source = monterrey["weather_source_payload"]
+    assert source["grid_cell"] == {"latitude": 25.7, "longitude": -100.3, "degrees": 0.1}
+    assert source["requested_point"] == {"latitude": 25.6866, "longitude": -100.3161}
+    assert source["grid_point"] == {"latitude": 25.7, "longitude": -100.3, "elevation": 540.0}
+    assert get_weather_cache_snapshot() == {
+        "mode": "current",
+        "grid_degrees": 0.1,
+        "cells": 1,
+        "hits": 1,
+        "series_cells": 0,
+        "hourly_matches": 0,
+        "hourly_fallbacks": 0,
+    }
+
+
+def test_failed_cell_fetch_is_not_retried_by_other_cities_in_the_cell():
+    response = make_weather_response({}, status_code=404)
+    response.raise_for_status.side_effect = RuntimeError("not found")
+
+    with patch("weather_context.http_get", return_value=response) as get_mock:
+        first = fetch_weather_context(25.6866, -100.3161)
+        second = fetch_weather_context(25.7417, -100.3022)
+
+    assert first["status"] == second["status"] == "error"
+    get_mock.assert_called_once()
+
+
+def test_zero_grid_degrees_keeps_exact_coordinates(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_GRID_DEGREES", "0")
+    payload = {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}}
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        fetch_weather_context(25.6866, -100.3161)
+        fetch_weather_context(25.7417, -100.3022)
+
+    assert get_mock.call_count == 2
+    assert get_mock.call_args.kwargs["params"]["latitude"] == 25.7417
+
+
+def test_weather_cache_key_uses_grid_cell_and_utc_hour():
+    now = datetime(2026, 5, 25, 1, 59, tzinfo=timezone.utc)
+
+    assert weather_cache_key(25.6866, -100.3161, now) == (25.7, -100.3, "2026-05-25T01:00Z")
+    assert weather_cache_key(25.6866, -100.3161, now) != weather_cache_key(
+        25.6866, -100.3161, datetime(2026, 5, 25, 2, 0, tzinfo=timezone.utc)
+    )
+
+
+def test_prefetch_sends_one_location_per_grid_cell():
+    cities = [
+        {"id": 1, "latitude": 25.6866, "longitude": -100.3161},
+        {"id": 2, "latitude": 25.7417, "longitude": -100.3022},
+        {"id": 3, "latitude": 25.5, "longitude": -99.99},
+    ]
+    payload = [
+        {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}},
+        {"current": {"time": "2026-05-25T01:00", "temperature_2m": 31.0}},
+    ]
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        prefetch_summary = prefetch_weather_contexts(cities)
+
+    assert prefetch_summary == {"locations": 2, "success": 2, "errors": 0}
+    # One city's real coordinates per cell, the lowest lat/lon so the choice is stable across runs.
+    assert get_mock.call_args.kwargs["params"]["latitude"] == "25.6866,25.5"
+    assert get_mock.call_args.kwargs["params"]["longitude"] == "-100.3161,-99.99"
+    context = get_prefetched_weather_context(25.7417, -100.3022)
+    assert context["weather_temperature_c"] == 28.5
+    assert context["weather_source_payload"]["requested_point"] == {"latitude": 25.6866, "longitude": -100.3161}
+
+
+def test_async_cities_in_one_grid_cell_await_one_fetch():
+    payload = {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}}
+    client = MagicMock()
+    client.get = AsyncMock(return_value=make_weather_response(payload))
+
+    async def run():
+        return await asyncio.gather(
+            fetch_weather_context_async(client, 25.6866, -100.3161),
+            fetch_weather_context_async(client, 25.7417, -100.3022),
+        )
+
+    first, second = asyncio.run(run())
+
+    assert client.get.await_count == 1
+    assert first == second
+
+
+def test_weather_mode_defaults_to_current():
+    assert get_weather_mode() == "current"
+
+
+def test_weather_grid_degrees_rejects_invalid_values(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_GRID_DEGREES", "fine")
+
+    with pytest.raises(EnvironmentError):
+        get_weather_grid_degrees()
+
+
+def make_hourly_series(latitude, temperatures):
+    times = [f"2026-05-25T{hour:02d}:00" for hour in range(len(temperatures))]
+    return {
+        "latitude": latitude,
+        "longitude": -100.3,
+        "hourly_units": {"temperature_2m": "°C"},
+        "hourly": {
+            "time": times,
+            "temperature_2m": temperatures,
+            "relative_humidity_2m": [50] * len(times),
+            "wind_speed_10m": [8.0] * len(times),
+            "wind_direction_10m": [90] * len(times),
+            "wind_gusts_10m": [12.0] * len(times),
+        },
+    }
+
+
+def test_hourly_mode_serves_the_bucket_nearest_the_reading(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_MODE", "hourly")
+    cities = [
+        {"id": 1, "latitude": 25.6866, "longitude": -100.3161},
+        {"id": 2, "latitude": 25.5, "longitude": -100.2},
+    ]
+    payload = [make_hourly_series(25.7, [20.0, 21.0, 22.0, 23.0]), make_hourly_series(25.5, [30.0, 31.0, 32.0, 33.0])]
+    reading = {"status": "success", "reading_timestamp_iso": "2026-05-25T01:40:00+00:00"}
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        prefetch_summary = prefetch_weather_contexts(cities)
+        first = enrich_with_weather_context(reading, canonical_lat=25.6866, canonical_lon=-100.3161)
+        second = enrich_with_weather_context(reading, canonical_lat=25.5, canonical_lon=-100.2)
+
+    get_mock.assert_called_once()
+    params = get_mock.call_args.kwargs["params"]
+    assert params["hourly"].startswith("temperature_2m")
+    assert params["latitude"] == "25.6866,25.5"
+    assert prefetch_summary == {"mode": "hourly", "locations": 2, "success": 2, "errors": 0, "from_disk": 0}
+    assert first["weather_context"]["weather_temperature_c"] == 22.0
+    assert first["weather_context"]["weather_timestamp"] == "2026-05-25T02:00:00+00:00"
+    assert first["weather_context"]["weather_source_payload"]["reading_timestamp"] == "2026-05-25T01:40:00+00:00"
+    assert first["weather_context"]["weather_source_payload"]["requested_point"] == {
+        "latitude": 25.6866,
+        "longitude": -100.3161,
+    }
+    assert second["weather_context"]["weather_temperature_c"] == 32.0
+    assert get_weather_cache_snapshot()["hourly_matches"] == 2
+
+
+def test_hourly_mode_falls_back_to_current_outside_the_series(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_MODE", "hourly")
+    cities = [{"id": 1, "latitude": 25.6866, "longitude": -100.3161}]
+    current_payload = {"current": {"time": "2026-05-25T09:00", "temperature_2m": 27.0}}
+    reading = {"status": "success", "reading_timestamp_iso": "2026-05-25T09:10:00+00:00"}
+
+    with patch(
+        "weather_context.http_get",
+        side_effect=[
+            make_weather_response(make_hourly_series(25.7, [20.0, 21.0])),
+            make_weather_response(current_payload),
+        ],
+    ) as get_mock:
+        prefetch_weather_contexts(cities)
+        result = enrich_with_weather_context(reading, canonical_lat=25.6866, canonical_lon=-100.3161)
+
+    assert get_mock.call_count == 2
+    assert "current" in get_mock.call_args.kwargs["params"]
+    assert result["weather_context"]["weather_temperature_c"] == 27.0
+    assert get_weather_cache_snapshot()["hourly_fallbacks"] == 1
+
+
+def test_hourly_series_is_reused_from_disk_by_the_next_run(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_MODE", "hourly")
+    monkeypatch.setenv("PIPELINE_WEATHER_CACHE", "on")
+    cities = [{"id": 1, "latitude": 25.6866, "longitude": -100.3161}]
+
+    with patch(
+        "weather_context.http_get",
+        return_value=make_weather_response(make_hourly_series(25.7, [20.0, 21.0])),
+    ) as get_mock:
+        prefetch_weather_contexts(cities)
+        next_run_summary = prefetch_weather_contexts(cities)
+
+    get_mock.assert_called_once()
+    assert next_run_summary["from_disk"] == 1
+    assert next_run_summary["success"] == 1
+
+
+def make_waqi_reading(timestamp="2026-05-25T01:00:00+00:00"):
+    return {
+        "status": "success",
+        "reading_timestamp_iso": timestamp,
+        "clima": {
+            "temperatura_c": 27.4,
+            "presion_hpa": 1012,
+            "humedad_relativa": 48.6,
+            "velocidad_viento_ms": 2.5,
+            "direccion_viento_deg": 135,
+        },
+    }
+
+
+def test_weather_circuit_opens_after_consecutive_failures_and_uses_waqi_weather(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_GRID_DEGREES", "0")
+    reading = make_waqi_reading()
+
+    with patch("weather_context.http_get", return_value=make_weather_response({}, status_code=400)) as get_mock:
+        results = [
+            enrich_with_weather_context(reading, canonical_lat=25.0 + index, canonical_lon=-100.0)
+            for index in range(4)
+        ]
+
+    assert get_mock.call_count == 3
+    context = results[3]["weather_context"]
+    assert context["weather_provider"] == "waqi-iaqi"
+    assert context["weather_wind_speed_kmh"] == 9.0
+    assert context["weather_humidity_percent"] == 49
+    assert context["weather_timestamp"] == "2026-05-25T01:00:00+00:00"
+    assert context["weather_source_payload"]["open_meteo_error"] == "circuit_open"
+    health = get_weather_health_snapshot()
+    assert health["circuit_open_reason"] == "consecutive_failures"
+    assert health["skipped_requests"] == 1
+    # The failures before the circuit opened keep their Open-Meteo error.
+    assert [result["weather_context"]["status"] for result in results[:2]] == ["error", "error"]
+    assert health["waqi_fallbacks"] == 2
+
+
+def test_weather_budget_stops_open_meteo_for_the_rest_of_the_run(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_GRID_DEGREES", "0")
+    monkeypatch.setenv("PIPELINE_WEATHER_BUDGET_SECONDS", "3")
+    payload = {"current": {"time": "2026-05-25T01:00", "temperature_2m": 28.5}}
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock, patch(
+        "weather_context.time.perf_counter", side_effect=itertools.count(0.0, 5.0)
+    ):
+        slow = enrich_with_weather_context(make_waqi_reading(), canonical_lat=25.0, canonical_lon=-100.0)
+        skipped = enrich_with_weather_context(make_waqi_reading(), canonical_lat=26.0, canonical_lon=-100.0)
+
+    get_mock.assert_called_once()
+    assert slow["weather_context"]["weather_provider"] == "open-meteo"
+    assert skipped["weather_context"]["weather_provider"] == "waqi-iaqi"
+    assert get_weather_health_snapshot()["circuit_open_reason"] == "budget_exhausted"
+
+
+def test_weather_retry_is_skipped_when_it_would_exceed_the_budget(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_BUDGET_SECONDS", "1")
+
+    with patch("weather_context.http_get", return_value=make_weather_response({}, status_code=502)) as get_mock, patch(
+        "weather_context.time.sleep"
+    ) as sleep_mock:
+        context = fetch_weather_context(25.67, -100.31)
+
+    get_mock.assert_called_once()
+    sleep_mock.assert_not_called()
+    assert context["errorType"] == "fetch_failed"
+
+
+def test_weather_fallback_none_keeps_the_open_meteo_error(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_FALLBACK", "none")
+
+    with patch("weather_context.http_get", return_value=make_weather_response({}, status_code=400)):
+        result = enrich_with_weather_context(make_waqi_reading(), canonical_lat=25.67, canonical_lon=-100.31)
+
+    assert result["weather_context"]["status"] == "error"
+    assert get_weather_health_snapshot()["waqi_fallbacks"] == 0
+
+
+def test_isolated_open_meteo_failure_keeps_its_error_unless_fallback_is_always(monkeypatch):
+    with patch("weather_context.http_get", return_value=make_weather_response({}, status_code=400)):
+        isolated = enrich_with_weather_context(make_waqi_reading(), canonical_lat=25.67, canonical_lon=-100.31)
+        monkeypatch.setenv("PIPELINE_WEATHER_FALLBACK", "always")
+        always = enrich_with_weather_context(make_waqi_reading(), canonical_lat=26.67, canonical_lon=-100.31)
+
+    assert isolated["weather_context"]["errorType"] == "fetch_failed"
+    assert always["weather_context"]["weather_provider"] == "waqi-iaqi"
+    assert always["weather_context"]["weather_source_payload"]["open_meteo_error"] == "fetch_failed"
+    health = get_weather_health_snapshot()
+    assert health["circuit_open_reason"] is None
+    assert health["waqi_fallbacks"] == 1
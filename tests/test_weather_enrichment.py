@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import weather_enrichment
+
+
+# Current weather is keyed by the real UTC hour, so the tests run at "now".
+NOW = datetime.now(timezone.utc)
+THIS_HOUR = NOW.replace(minute=0, second=0, microsecond=0).isoformat()
+TWO_HOURS_AGO = (NOW.replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)).isoformat()
+LONG_AGO = (NOW - timedelta(hours=12)).replace(microsecond=0).isoformat()
+WAQI_WEATHER = {"temperatura_c": 27.4, "humedad_relativa": 48, "velocidad_viento_ms": 2.5, "direccion_viento_deg": 135}
+
+
+@pytest.fixture(autouse=True)
+def deferred_enrichment(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_ENRICHMENT", "deferred")
+
+
+def make_reading(city_id, timestamp=THIS_HOUR, clima=None):
+    return {
+        "status": "success",
+        "city_id": city_id,
+        "reading_timestamp_iso": timestamp,
+        "clima": clima if clima is not None else dict(WAQI_WEATHER),
+    }
+
+
+def make_weather_response(payload, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {}
+    response.raise_for_status.return_value = None
+    response.json.return_value = payload
+    return response
+
+
+def build_supabase(queued=(), updated_readings=()):
+    supabase = MagicMock()
+    table = supabase.table.return_value
+    table.select.return_value.order.return_value.limit.return_value.execute.return_value.data = list(queued)
+    supabase.rpc.return_value.execute.return_value.data = {
+        "updated": len(updated_readings),
+        "updated_readings": list(updated_readings),
+        "failed": 0,
+        "dropped": 0,
+    }
+    return supabase, table
+
+
+def test_drain_enriches_queued_readings_with_one_batched_request():
+    weather_enrichment.enqueue_weather_job(make_reading(1), canonical_lat=25.6866, canonical_lon=-100.3161)
+    weather_enrichment.enqueue_weather_job(make_reading(4), canonical_lat=25.5, canonical_lon=-100.2)
+    # The RPC skipped city 4: its row already had weather.
+    supabase, table = build_supabase(updated_readings=[{"city_id": 1, "reading_timestamp": THIS_HOUR}])
+    payload = [
+        {"current": {"time": THIS_HOUR[:16], "temperature_2m": 28.5}},
+        {"current": {"time": THIS_HOUR[:16], "temperature_2m": 29.5}},
+    ]
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        summary = weather_enrichment.drain_weather_queue(supabase, now=NOW)
+
+    get_mock.assert_called_once()
+    queued_rows = table.upsert.call_args.args[0]
+    assert [row["city_id"] for row in queued_rows] == [1, 4]
+    assert table.upsert.call_args.kwargs["on_conflict"] == "city_id,reading_timestamp"
+    rpc_name, params = supabase.rpc.call_args.args
+    assert rpc_name == "apply_weather_enrichment"
+    assert [row["weather_temperature_c"] for row in params["p_rows"]] == [28.5, 29.5]
+    assert params["p_rows"][0]["weather_backfilled_at"] == NOW.isoformat()
+    assert params["p_failed"] == [] and params["p_expired"] == []
+    assert summary["status"] == "success"
+    assert summary["enriched"] == 1
+    assert weather_enrichment.get_enriched_readings() == [{"city_id": 1, "reading_timestamp": THIS_HOUR}]
+
+
+def test_drain_uses_waqi_weather_when_open_meteo_fails_and_keeps_jobs_without_it():
+    weather_enrichment.enqueue_weather_job(make_reading(1), canonical_lat=25.6866, canonical_lon=-100.3161)
+    weather_enrichment.enqueue_weather_job(make_reading(4, clima={}), canonical_lat=25.5, canonical_lon=-100.2)
+    supabase, _ = build_supabase()
+
+    with patch("weather_context.http_get", return_value=make_weather_response({}, status_code=400)):
+        summary = weather_enrichment.drain_weather_queue(supabase, now=NOW)
+
+    params = supabase.rpc.call_args.args[1]
+    assert [row["weather_provider"] for row in params["p_rows"]] == ["waqi-iaqi"]
+    assert params["p_rows"][0]["weather_wind_speed_kmh"] == 9.0
+    assert params["p_failed"] == [{"city_id": 4, "reading_timestamp": THIS_HOUR, "error": "fetch_failed"}]
+    assert summary["waqi_fallbacks"] == 1
+    assert summary["failed"] == 1
+
+
+def test_drain_picks_up_leftovers_and_expires_old_jobs():
+    queued = [
+        {"city_id": 6, "reading_timestamp": THIS_HOUR, "latitude": 25.7, "longitude": -100.5,
+         "waqi_weather": WAQI_WEATHER},
+        {"city_id": 9, "reading_timestamp": LONG_AGO, "latitude": 25.8, "longitude": -100.2,
+         "waqi_weather": WAQI_WEATHER},
+    ]
+    supabase, table = build_supabase(queued)
+    payload = {"current": {"time": THIS_HOUR[:16], "temperature_2m": 28.5}}
+
+    with patch("weather_context.http_get", return_value=make_weather_response(payload)) as get_mock:
+        summary = weather_enrichment.drain_weather_queue(supabase, now=NOW)
+
+    table.upsert.assert_not_called()
+    get_mock.assert_called_once()
+    params = supabase.rpc.call_args.args[1]
+    assert [row["city_id"] for row in params["p_rows"]] == [6]
+    assert params["p_expired"] == [{"city_id": 9, "reading_timestamp": LONG_AGO}]
+    assert summary["expired"] == 1
+
+
+def hourly_series(start, temperatures):
+    times = [(start + timedelta(hours=offset)).strftime("%Y-%m-%dT%H:%M") for offset in range(len(temperatures))]
+    return {"hourly": {"time": times, "temperature_2m": temperatures}}
+
+
+def test_older_reading_without_a_series_point_stays_queued_instead_of_getting_current_weather():
+    queued = [
+        {"city_id": 6, "reading_timestamp": TWO_HOURS_AGO, "latitude": 25.7, "longitude": -100.5,
+         "waqi_weather": WAQI_WEATHER},
+    ]
+    supabase, _ = build_supabase(queued)
+    # The series starts after the reading, so there is no point to match.
+    series = hourly_series(NOW.replace(minute=0, second=0, microsecond=0), [25.0, 26.0])
+
+    with patch("weather_context.http_get", return_value=make_weather_response(series)) as get_mock:
+        summary = weather_enrichment.drain_weather_queue(supabase, now=NOW)
+
+    get_mock.assert_called_once()
+    assert "current" not in get_mock.call_args.kwargs["params"]
+    params = supabase.rpc.call_args.args[1]
+    assert params["p_rows"] == [] and params["p_failed"] == [] and params["p_expired"] == []
+    assert summary["pending"] == 1
+
+
+def test_hourly_mode_drain_loads_the_series_and_matches_older_readings(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_MODE", "hourly")
+    start = NOW.replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    series = hourly_series(start, [20.0, 21.0, 22.0, 23.0, 24.0, 25.0])
+    queued = [
+        {"city_id": 6, "reading_timestamp": TWO_HOURS_AGO, "latitude": 25.7, "longitude": -100.5,
+         "waqi_weather": WAQI_WEATHER},
+    ]
+    supabase, _ = build_supabase(queued)
+
+    with patch("weather_context.http_get", return_value=make_weather_response(series)) as get_mock:
+        weather_enrichment.drain_weather_queue(supabase, now=NOW)
+
+    get_mock.assert_called_once()
+    assert "hourly" in get_mock.call_args.kwargs["params"]
+    params = supabase.rpc.call_args.args[1]
+    assert [row["weather_temperature_c"] for row in params["p_rows"]] == [21.0]
+
+
+def test_current_mode_drain_matches_a_previous_hour_reading_against_the_series():
+    previous_hour = (NOW.replace(minute=0, second=0, microsecond=0) - timedelta(minutes=50)).isoformat()
+    queued = [
+        {"city_id": 6, "reading_timestamp": previous_hour, "latitude": 25.7, "longitude": -100.5,
+         "waqi_weather": WAQI_WEATHER},
+    ]
+    supabase, _ = build_supabase(queued)
+    start = NOW.replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+    series = hourly_series(start, [20.0, 21.0, 22.0])
+
+    with patch("weather_context.http_get", return_value=make_weather_response(series)) as get_mock:
+        summary = weather_enrichment.drain_weather_queue(supabase, now=NOW)
+
+    get_mock.assert_called_once()
+    assert "hourly" in get_mock.call_args.kwargs["params"]
+    params = supabase.rpc.call_args.args[1]
+    assert [row["weather_temperature_c"] for row in params["p_rows"]] == [21.0]
+    assert [row["weather_provider"] for row in params["p_rows"]] == ["open-meteo"]
+    assert summary["pending"] == 0
+
+
+def test_drain_reports_failure_when_the_queue_is_unavailable():
+    weather_enrichment.enqueue_weather_job(make_reading(1), canonical_lat=25.6866, canonical_lon=-100.3161)
+    supabase, table = build_supabase()
+    table.upsert.return_value.execute.side_effect = RuntimeError("relation does not exist")
+
+    summary = weather_enrichment.drain_weather_queue(supabase, now=NOW)
+
+    assert summary["status"] == "failed"
+    supabase.rpc.assert_not_called()
+
+
+def test_inline_mode_does_not_touch_the_queue(monkeypatch):
+    monkeypatch.setenv("PIPELINE_WEATHER_ENRICHMENT", "inline")
+    supabase = MagicMock()
+
+    assert weather_enrichment.drain_weather_queue(supabase) == {"mode": "inline", "status": "disabled"}
+    supabase.table.assert_not_called()
@@ -1,10 +1,13 @@
 from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
 
 from scripts.weather_history_backfill import (
+    City,
     Reading,
     WeatherHour,
     build_update_payload,
     find_nearest_weather_hour,
+    run_backfill,
     validate_weather,
 )
 
@@ -80,3 +83,33 @@ def test_validate_weather_rejects_invalid_ranges():
         "weather_wind_direction_deg_out_of_range",
         "weather_wind_gust_kmh_negative",
     ]
+
+
+def test_apply_refreshes_rollups_for_the_updated_window():
+    city = City(1, "Monterrey", 25.6866, -100.3161)
+    readings = [
+        Reading(1, datetime(2026, 5, 30, 18, 5, tzinfo=timezone.utc)),
+        Reading(1, datetime(2026, 5, 30, 20, 10, tzinfo=timezone.utc)),
+    ]
+    hours = [
+        WeatherHour(datetime(2026, 5, 30, 18, tzinfo=timezone.utc), 32.0, 48, 12.0, 90, 20.0),
+        WeatherHour(datetime(2026, 5, 30, 20, tzinfo=timezone.utc), 30.0, 52, 10.0, 95, 18.0),
+    ]
+    supabase = MagicMock()
+
+    with patch("scripts.weather_history_backfill.get_supabase_client", return_value=supabase), patch(
+        "scripts.weather_history_backfill.get_active_cities", return_value=[city]
+    ), patch("scripts.weather_history_backfill.get_candidate_readings", return_value=readings), patch(
+        "scripts.weather_history_backfill.fetch_open_meteo_hours", return_value=hours
+    ), patch("scripts.weather_history_backfill.update_reading"), patch("scripts.weather_history_backfill.time.sleep"):
+        report = run_backfill(days=7, batch_size=100, apply=True)
+
+    rpc_name, params = supabase.rpc.call_args.args
+    assert rpc_name == "refresh_air_quality_rollups_for_range"
+    assert params == {
+        "p_city_id": 1,
+        "p_from": "2026-05-30T18:05:00+00:00",
+        "p_to": "2026-05-30T21:10:00+00:00",
+    }
+    assert report["summary"]["updated_rows"] == 2
+    assert report["summary"]["rollup_refresh_errors"] == 0
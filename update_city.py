@@ -1,12 +1,33 @@
+import asyncio
 from datetime import datetime
 import logging
-from supabase_client import get_supabase_client, log_pipeline_event
+import os
+from typing import Any
+
+from bulk_writer import get_active_bulk_writer
+from raw_payload_store import store_raw_payloads, store_raw_payloads_async
+from supabase_client import get_supabase_client, log_pipeline_event, log_pipeline_event_async
 from utils import validate_reading_payload
 
+WRITE_MODE_ENV_VAR = "PIPELINE_WRITE_MODE"
+WRITE_MODES = ("per_city", "bulk", "rpc")
+INGEST_RPC_NAME = "ingest_air_quality_reading"
+# Unique index from 20260602090000_add_air_quality_readings_city_timestamp_unique.sql.
+READING_CONFLICT_COLUMNS = "city_id,reading_timestamp"
+DEFAULT_WRITE_MODE = "per_city"
+
+
+def get_write_mode() -> str:
+    mode = os.getenv(WRITE_MODE_ENV_VAR, DEFAULT_WRITE_MODE).strip().lower()
+    if mode not in WRITE_MODES:
+        raise EnvironmentError(
+            f"{WRITE_MODE_ENV_VAR} invalido: {mode}. Usa {' o '.join(WRITE_MODES)}."
+        )
+    return mode
 
-def update_city(fetch_or_skip_result: dict) -> dict:
-    logging.info("--- Iniciando update_city.py ---")
 
+def build_city_update_plan(fetch_or_skip_result: dict) -> dict:
+    """Decide which reading/city status to write without touching Supabase."""
     city_id = -1
     reading_data_to_insert = None
     city_status_to_update = {}
@@ -81,6 +102,13 @@ def update_city(fetch_or_skip_result: dict) -> dict:
                 'updated_at': datetime.utcnow().isoformat()
             }
             logging.warning(f"Fetch Fallido: {city_status_to_update['last_update_status']}")
+        elif fetch_or_skip_result['status'] == 'skipped':
+            # El proveedor no publico una lectura nueva; no se inserta duplicado.
+            city_status_to_update = {
+                'last_update_status': f"skipped: {fetch_or_skip_result.get('skipReason', 'unknown')}",
+                'updated_at': datetime.utcnow().isoformat()
+            }
+            logging.info(f"Fetch Omitido: {city_status_to_update['last_update_status']}")
         else:
             city_status_to_update = {
                 'last_update_status': 'error: unknown_fetch_result',
@@ -98,29 +126,133 @@ def update_city(fetch_or_skip_result: dict) -> dict:
     else:
         raise ValueError("Input inesperado recibido en fetch_or_skip_result")
 
-    # --- Crear cliente Supabase ---
-    supabase = get_supabase_client()
-    result = {
+    return {
         'city_id': city_id,
+        'city_name': fetch_or_skip_result.get('municipio') or fetch_or_skip_result.get('api_name'),
+        'reading': reading_data_to_insert,
+        'city_status': city_status_to_update,
+        'validation_errors': validation_errors,
+    }
+
+
+def build_update_result(plan: dict) -> dict:
+    return {
+        'city_id': plan['city_id'],
         'readingInserted': False,
         'cityStatusUpdated': False,
         'insertError': None,
         'updateError': None,
-        'validationErrors': validation_errors
+        'validationErrors': plan['validation_errors']
     }
 
-    # --- Insert en air_quality_readings si aplica ---
+
+def apply_reading_upsert_response(result: dict, response_data: Any) -> dict:
+    # ignore_duplicates=True returns no row when the reading was already stored.
+    if response_data:
+        result['readingInserted'] = True
+        logging.info(f"Lectura insertada: {response_data}")
+    else:
+        result['readingDuplicate'] = True
+        logging.info("Lectura ya almacenada para (city_id, reading_timestamp); sin insert.")
+    return result
+
+
+def build_update_log_event(plan: dict, result: dict) -> dict:
+    city_status_to_update = plan['city_status']
+    return {
+        "city_id": plan['city_id'],
+        "city_name": plan['city_name'],
+        "status": city_status_to_update.get('last_update_status') if city_status_to_update else None,
+        "context": "update_city",
+        "details": result
+    }
+
+
+def build_ingest_payload(plan: dict) -> dict:
+    return {
+        'city_id': plan['city_id'],
+        'city_name': plan['city_name'],
+        'reading': plan['reading'],
+        'city_status': plan['city_status'],
+        'validation_errors': plan['validation_errors'],
+    }
+
+
+def apply_ingest_response(plan: dict, result: dict, response_data: Any) -> dict:
+    if isinstance(response_data, dict):
+        result['readingInserted'] = bool(response_data.get('readingInserted'))
+        if response_data.get('readingDuplicate'):
+            result['readingDuplicate'] = True
+        result['cityStatusUpdated'] = bool(response_data.get('cityStatusUpdated'))
+    elif plan['reading']:
+        result['insertError'] = "No data returned from ingest RPC"
+    return result
+
+
+def apply_ingest_error(plan: dict, result: dict, error: Exception) -> dict:
+    # The RPC runs in one transaction: on error neither write happened.
+    if plan['reading']:
+        result['insertError'] = str(error)
+    if plan['city_status']:
+        result['updateError'] = str(error)
+    logging.error(f"Error en RPC {INGEST_RPC_NAME}: {error}")
+    return result
+
+
+def update_city_via_rpc(plan: dict, supabase: Any) -> dict:
+    """Write reading, city status and log event atomically via the ingest RPC."""
+    result = build_update_result(plan)
+    try:
+        response = supabase.rpc(INGEST_RPC_NAME, {'payload': build_ingest_payload(plan)}).execute()
+        apply_ingest_response(plan, result, response.data)
+        logging.info(f"Ingest RPC completado para City ID {plan['city_id']}")
+    except Exception as e:
+        apply_ingest_error(plan, result, e)
+
+    logging.info(result)
+    return result
+
+
+def update_city(fetch_or_skip_result: dict) -> dict:
+    logging.info("--- Iniciando update_city.py ---")
+
+    plan = build_city_update_plan(fetch_or_skip_result)
+    city_id = plan['city_id']
+    reading_data_to_insert = plan['reading']
+    city_status_to_update = plan['city_status']
+
+    # --- Modo bulk: encolar y escribir por lotes ---
+    writer = get_active_bulk_writer()
+    if writer is not None:
+        result = writer.submit(plan, build_update_result(plan))
+        writer.flush_if_due()
+        logging.info("--- Fin update_city.py (encolado en lote) ---")
+        return result
+
+    # --- Crear cliente Supabase ---
+    supabase = get_supabase_client()
+
+    # --- Payload crudo a raw_payloads; la lectura guarda solo el hash ---
+    # Va antes y fuera de la transaccion del RPC (la FK exige el payload); si la
+    # lectura no se escribe, scripts/raw_payload_retention.py borra el huerfano.
+    if reading_data_to_insert:
+        store_raw_payloads([reading_data_to_insert], supabase)
+
+    # --- Modo RPC: reading + city status + log en una transaccion ---
+    if get_write_mode() == 'rpc':
+        return update_city_via_rpc(plan, supabase)
+
+    result = build_update_result(plan)
+
+    # --- Upsert idempotente en air_quality_readings si aplica ---
     if reading_data_to_insert:
         try:
-            response = supabase.table('air_quality_readings').insert(reading_data_to_insert).execute()
-            # La inserción exitosa devuelve datos, así que podemos comprobar eso
-            if response.data:
-                result['readingInserted'] = True
-                logging.info(f"Lectura insertada: {response.data}")
-            else:
-                 # Si no hay datos, podría ser un error no lanzado
-                result['insertError'] = "No data returned from insert"
-                logging.error(f"Error al insertar lectura: No data returned")
+            response = supabase.table('air_quality_readings').upsert(
+                reading_data_to_insert,
+                on_conflict=READING_CONFLICT_COLUMNS,
+                ignore_duplicates=True,
+            ).execute()
+            apply_reading_upsert_response(result, response.data)
         except Exception as e:
             result['insertError'] = str(e)
             logging.error(f"Error al insertar lectura: {e}")
@@ -135,14 +267,64 @@ def update_city(fetch_or_skip_result: dict) -> dict:
             result['updateError'] = str(e)
             logging.error(f"Error al actualizar ciudad: {e}")
 
-    log_pipeline_event({
-        "city_id": city_id,
-        "city_name": fetch_or_skip_result.get('municipio') or fetch_or_skip_result.get('api_name'),
-        "status": city_status_to_update.get('last_update_status') if city_status_to_update else None,
-        "context": "update_city",
-        "details": result
-    })
+    log_pipeline_event(build_update_log_event(plan, result))
 
     logging.info("--- Fin update_city.py ---")
     logging.info(result)
     return result
+
+
+async def update_city_async(fetch_or_skip_result: dict, supabase: Any) -> dict:
+    """Async twin of `update_city` writing through a shared async Supabase client."""
+    logging.info("--- Iniciando update_city async ---")
+
+    plan = build_city_update_plan(fetch_or_skip_result)
+    city_id = plan['city_id']
+    result = build_update_result(plan)
+
+    writer = get_active_bulk_writer()
+    if writer is not None:
+        writer.submit(plan, result)
+        if writer.flush_due():
+            # The bulk writer uses the sync client; keep the event loop free.
+            await asyncio.to_thread(writer.flush)
+        return result
+
+    if plan['reading']:
+        await store_raw_payloads_async([plan['reading']], supabase)
+
+    if get_write_mode() == 'rpc':
+        try:
+            response = await supabase.rpc(INGEST_RPC_NAME, {'payload': build_ingest_payload(plan)}).execute()
+            apply_ingest_response(plan, result, response.data)
+        except Exception as e:
+            apply_ingest_error(plan, result, e)
+        logging.info(result)
+        return result
+
+    if plan['reading']:
+        try:
+            response = await supabase.table('air_quality_readings').upsert(
+                plan['reading'],
+                on_conflict=READING_CONFLICT_COLUMNS,
+                ignore_duplicates=True,
+            ).execute()
+            apply_reading_upsert_response(result, response.data)
+        except Exception as e:
+            result['insertError'] = str(e)
+            logging.error(f"Error al insertar lectura: {e}")
+
+    if plan['city_status']:
+        try:
+            await supabase.table('cities').update(plan['city_status']).eq('id', city_id).execute()
+            result['cityStatusUpdated'] = True
+            logging.info(f"Ciudad actualizada: ID {city_id}")
+        except Exception as e:
+            result['updateError'] = str(e)
+            logging.error(f"Error al actualizar ciudad: {e}")
+
+    await log_pipeline_event_async(supabase, build_update_log_event(plan, result))
+
+    logging.info("--- Fin update_city async ---")
+    logging.info(result)
+    return result
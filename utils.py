@@ -1,4 +1,6 @@
 from datetime import datetime, timedelta, timezone
+import hashlib
+import json
 import logging
 import os
 import random
@@ -80,6 +82,10 @@ def check_if_update_needed(city, force_update=False):
     
     return result
 
+def should_skip_delays() -> bool:
+    return os.getenv("SKIP_PIPELINE_DELAYS", "0").lower() in ("1", "true", "yes")
+
+
 def delay(seconds: float):
     """Sleep helper that can be disabled via SKIP_PIPELINE_DELAYS for tests."""
     import time
@@ -87,14 +93,27 @@ def delay(seconds: float):
     if seconds <= 0:
         return
 
-    skip_sleep = os.getenv("SKIP_PIPELINE_DELAYS", "0").lower() in ("1", "true", "yes")
-    if skip_sleep:
+    if should_skip_delays():
         logging.debug(f"Skipping delay of {seconds}s due to SKIP_PIPELINE_DELAYS")
         return
 
     time.sleep(seconds)
 
 
+async def async_delay(seconds: float):
+    """Async counterpart of `delay` for the asyncio engine."""
+    import asyncio
+
+    if seconds <= 0:
+        return
+
+    if should_skip_delays():
+        logging.debug(f"Skipping async delay of {seconds}s due to SKIP_PIPELINE_DELAYS")
+        return
+
+    await asyncio.sleep(seconds)
+
+
 def compute_inter_city_delay(consecutive_failures: int = 0) -> float:
     """Compute an inter-city delay between 8-15s with exponential backoff and jitter."""
     base = MIN_INTER_CITY_DELAY_SECONDS
@@ -140,4 +159,9 @@ def validate_reading_payload(reading: dict) -> dict:
         if not (-101.0 <= lon <= -99.0):
             reasons.append("longitude_out_of_range")
 
-    return {"valid": len(reasons) == 0, "reasons": reasons}
\ No newline at end of file
+    return {"valid": len(reasons) == 0, "reasons": reasons}
+
+def canonical_json_sha256(value) -> str:
+    """sha256 of `value` as canonical JSON: sorted keys, no whitespace, UTF-8."""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
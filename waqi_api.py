@@ -1,12 +1,33 @@
+import asyncio
+import json
 import logging
+import os
+import threading
 from datetime import datetime, timezone
+from pathlib import Path
 from typing import Any
 
-import requests
+from http_transport import http_get
+from rate_limiter import call_with_rate_control, call_with_rate_control_async, get_provider_limiter
+from utils import canonical_json_sha256
 
 WAQI_BASE_URL = "https://api.waqi.info/feed"
+WAQI_BOUNDS_URL = "https://api.waqi.info/map/bounds/"
 WAQI_TIMEOUT_SECONDS = 45
 
+FETCH_MODE_ENV_VAR = "PIPELINE_WAQI_FETCH_MODE"
+FETCH_MODES = ("feed", "bounds")
+DEFAULT_FETCH_MODE = "feed"
+STATION_STATE_PATH_ENV_VAR = "PIPELINE_WAQI_STATE_PATH"
+DEFAULT_STATION_STATE_PATH = Path(".pipeline_state") / "waqi_stations.json"
+RAW_PAYLOAD_MODE_ENV_VAR = "PIPELINE_WAQI_RAW_PAYLOAD_MODE"
+RAW_PAYLOAD_MODES = ("projection", "full")
+DEFAULT_RAW_PAYLOAD_MODE = "projection"
+# The stored projection keeps what a reading can be re-derived or audited from.
+# forecast, attributions and debug are never read back after insert.
+RAW_PAYLOAD_PROJECTION_KEYS = ("aqi", "idx", "dominentpol", "iaqi", "time")
+RAW_PAYLOAD_PROJECTION_MARKER = "_projection"
+
 NUEVO_LEON_LAT_RANGE = (25.0, 26.5)
 NUEVO_LEON_LON_RANGE = (-101.0, -99.0)
 
@@ -55,6 +76,21 @@ WAQI_STATION_EVIDENCE = {
     "Cadereyta Jimenez": "AQICN public station page for Cadereyta, Monterrey, Nuevo Leon lists Cloud API H10950.",
 }
 
+# Bounds mode state for the current run: station_id -> timestamp reported by
+# /map/bounds/ and station_id -> bounds timestamp of the last detail fetch.
+_bounds_lock = threading.Lock()
+_bounds_station_times: dict[str, str] | None = None
+_fetched_station_times: dict[str, str] = {}
+_bounds_force_refresh = False
+
+# Station fetch plan for the current run. Only stations used by more than one
+# active city get an entry; their first detail fetch is reused by the others.
+_station_plan_lock = threading.Lock()
+_shared_station_locks: dict[str, threading.Lock] = {}
+_shared_station_fetches: dict[str, tuple[dict[str, Any], int]] = {}
+_shared_station_tasks: dict[str, tuple[Any, int]] = {}
+_shared_fetch_city_ids: set[int] = set()
+
 POLLUTANT_MAP = {
     "pm25": "pm25",
     "pm10": "pm10",
@@ -94,11 +130,14 @@ def get_station_mapping_snapshot() -> list[dict[str, Any]]:
     ]
 
 
-def fetch_air_quality_data(api_name: str, city_id: int, waqi_api_token: str | None) -> dict[str, Any]:
-    logging.info("--- Iniciando fetch WAQI para City ID: %s (%s) ---", city_id, api_name)
-
+def resolve_station_id(
+    api_name: str,
+    city_id: int,
+    waqi_api_token: str | None,
+) -> tuple[str | None, dict[str, Any] | None]:
+    """Return (station_id, None) or (None, error_result) before any HTTP call."""
     if not waqi_api_token:
-        return build_error_result(city_id, api_name, "missing_token", "WAQI_API_TOKEN no configurado.")
+        return None, build_error_result(city_id, api_name, "missing_token", "WAQI_API_TOKEN no configurado.")
 
     station_id = WAQI_STATION_BY_API_NAME.get(api_name)
     logging.info(
@@ -109,29 +148,410 @@ def fetch_air_quality_data(api_name: str, city_id: int, waqi_api_token: str | No
     )
 
     if not station_id:
-        return build_error_result(
+        return None, build_error_result(
             city_id,
             api_name,
             "station_not_mapped",
             f"No hay estacion WAQI verificada para api_name={api_name}.",
         )
 
-    url = f"{WAQI_BASE_URL}/@{station_id}/"
+    return station_id, None
+
+
+def build_station_url(station_id: str) -> str:
+    return f"{WAQI_BASE_URL}/@{station_id}/"
+
+
+def get_waqi_fetch_mode() -> str:
+    mode = os.getenv(FETCH_MODE_ENV_VAR, DEFAULT_FETCH_MODE).strip().lower()
+    if mode not in FETCH_MODES:
+        raise EnvironmentError(
+            f"{FETCH_MODE_ENV_VAR} invalido: {mode}. Usa {' o '.join(FETCH_MODES)}."
+        )
+    return mode
+
+
+def get_raw_payload_mode() -> str:
+    mode = os.getenv(RAW_PAYLOAD_MODE_ENV_VAR, DEFAULT_RAW_PAYLOAD_MODE).strip().lower()
+    if mode not in RAW_PAYLOAD_MODES:
+        raise EnvironmentError(
+            f"{RAW_PAYLOAD_MODE_ENV_VAR} invalido: {mode}. Usa {' o '.join(RAW_PAYLOAD_MODES)}."
+        )
+    return mode
+
+
+def project_raw_payload(data: dict[str, Any]) -> dict[str, Any]:
+    """Stored subset of a WAQI `data` object plus the sha256 of the full object."""
+    projection = {key: data[key] for key in RAW_PAYLOAD_PROJECTION_KEYS if key in data}
+    city = data.get("city")
+    if isinstance(city, dict) and "geo" in city:
+        projection["city"] = {"geo": city["geo"]}
+    projection[RAW_PAYLOAD_PROJECTION_MARKER] = {
+        "version": 1,
+        "full_sha256": canonical_json_sha256(data),
+    }
+    return projection
+
+
+def build_stored_raw_payload(data: dict[str, Any]) -> dict[str, Any]:
+    if get_raw_payload_mode() == "full":
+        return data
+    return project_raw_payload(data)
+
+
+def get_station_state_path() -> Path:
+    return Path(os.getenv(STATION_STATE_PATH_ENV_VAR) or DEFAULT_STATION_STATE_PATH)
 
+
+def load_station_state(path: Path | None = None) -> dict[str, str]:
+    state_path = path or get_station_state_path()
     try:
-        response = requests.get(url, params={"token": waqi_api_token}, timeout=WAQI_TIMEOUT_SECONDS)
+        payload = json.loads(state_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        logging.warning("[WAQI] Ignorando estado de estaciones ilegible %s: %s", state_path, error)
+        return {}
+    if not isinstance(payload, dict):
+        return {}
+    return {str(station_id): value for station_id, value in payload.items() if isinstance(value, str)}
+
+
+def build_bounds_params(waqi_api_token: str) -> dict[str, str]:
+    lat_min, lat_max = NUEVO_LEON_LAT_RANGE
+    lon_min, lon_max = NUEVO_LEON_LON_RANGE
+    return {"latlng": f"{lat_min},{lon_min},{lat_max},{lon_max}", "token": waqi_api_token}
+
+
+def parse_bounds_payload(raw_api_data: Any) -> dict[str, str] | None:
+    """Return station_id -> normalized timestamp, or None if the payload is unusable."""
+    if not isinstance(raw_api_data, dict) or raw_api_data.get("status") != "ok":
+        return None
+    stations = raw_api_data.get("data")
+    if not isinstance(stations, list):
+        return None
+
+    station_times = {}
+    for entry in stations:
+        if not isinstance(entry, dict) or entry.get("uid") is None:
+            continue
+        station = entry.get("station") if isinstance(entry.get("station"), dict) else {}
+        timestamp = normalize_timestamp(str(station.get("time") or ""))
+        if timestamp:
+            station_times[str(entry["uid"])] = timestamp
+    return station_times
+
+
+def prepare_bounds_snapshot(waqi_api_token: str | None, force_update: bool = False) -> dict[str, Any]:
+    """Fetch every station in the Nuevo Leon box once per run (bounds mode only).
+
+    Per-city fetches then skip the `/feed/@station/` call when the bounds
+    timestamp has not advanced since the last stored reading of the station.
+    `force_update` fetches every station anyway. If the bounds call fails,
+    every city falls back to its detail fetch.
+    """
+    global _bounds_station_times, _fetched_station_times, _bounds_force_refresh
+
+    mode = get_waqi_fetch_mode()
+    with _bounds_lock:
+        _bounds_station_times = None
+        _fetched_station_times = load_station_state() if mode == "bounds" else {}
+        _bounds_force_refresh = force_update
+    if mode != "bounds" or not waqi_api_token:
+        return {"mode": mode, "status": "disabled"}
+
+    try:
+        response = call_with_rate_control(
+            "waqi",
+            lambda: http_get(
+                WAQI_BOUNDS_URL,
+                params=build_bounds_params(waqi_api_token),
+                timeout=WAQI_TIMEOUT_SECONDS,
+            ),
+        )
+        logging.info("[WAQI] HTTP GET %s status=%s", WAQI_BOUNDS_URL, response.status_code)
+        response.raise_for_status()
+        raw_api_data = response.json()
+        report_waqi_quota_signal(raw_api_data)
+        station_times = parse_bounds_payload(raw_api_data)
+    except Exception as error:
+        logging.error("[WAQI] Error en fetch por bounds; usando fetch por estacion: %s", error)
+        return {"mode": mode, "status": "fetch_failed", "error": str(error)}
+
+    if station_times is None:
+        logging.warning("[WAQI] Respuesta de bounds invalida; usando fetch por estacion.")
+        return {"mode": mode, "status": "invalid_payload"}
+
+    with _bounds_lock:
+        _bounds_station_times = station_times
+    logging.info("[WAQI] Bounds Nuevo Leon: %s estaciones.", len(station_times))
+    return {"mode": mode, "status": "success", "stations": len(station_times)}
+
+
+def get_unchanged_upstream_timestamp(station_id: str) -> str | None:
+    """Return the bounds timestamp when it has not advanced since the last stored reading."""
+    with _bounds_lock:
+        if _bounds_station_times is None or _bounds_force_refresh:
+            return None
+        bounds_time = _bounds_station_times.get(station_id)
+        fetched_time = _fetched_station_times.get(station_id)
+    if not bounds_time or not fetched_time:
+        return None
+    try:
+        advanced = datetime.fromisoformat(bounds_time) > datetime.fromisoformat(fetched_time)
+    except ValueError:
+        return None
+    return None if advanced else bounds_time
+
+
+def record_station_detail_fetched(station_id: str) -> None:
+    """Mark the station current once its reading is stored (inserted or duplicate)."""
+    with _bounds_lock:
+        if _bounds_station_times is None:
+            return
+        bounds_time = _bounds_station_times.get(station_id)
+        if bounds_time:
+            _fetched_station_times[station_id] = bounds_time
+
+
+def save_station_state(path: Path | None = None) -> None:
+    """Persist bounds timestamps of stations whose reading was stored (bounds mode only)."""
+    with _bounds_lock:
+        if _bounds_station_times is None:
+            return
+        state = dict(_fetched_station_times)
+
+    state_path = path or get_station_state_path()
+    try:
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        state_path.write_text(json.dumps(state, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    except OSError as error:
+        logging.warning("[WAQI] No se pudo guardar estado de estaciones en %s: %s", state_path, error)
+
+
+def reset_bounds_snapshot() -> None:
+    global _bounds_station_times, _fetched_station_times, _bounds_force_refresh
+    with _bounds_lock:
+        _bounds_station_times = None
+        _fetched_station_times = {}
+        _bounds_force_refresh = False
+
+
+def build_unchanged_upstream_result(
+    city_id: int,
+    api_name: str,
+    station_id: str,
+    upstream_timestamp: str,
+) -> dict[str, Any]:
+    logging.info(
+        "[WAQI] Estacion @%s sin lectura nueva (%s); omitiendo fetch para City ID %s (%s).",
+        station_id,
+        upstream_timestamp,
+        city_id,
+        api_name,
+    )
+    return {
+        "city_id": city_id,
+        "status": "skipped",
+        "municipio": api_name,
+        "api_name_used": api_name,
+        "provider": "waqi",
+        "provider_station_id": station_id,
+        "skipReason": "unchanged_upstream",
+        "upstream_timestamp_iso": upstream_timestamp,
+    }
+
+
+def prepare_station_fetch_plan(cities: list[dict[str, Any]]) -> dict[str, Any]:
+    """Index active cities by WAQI station so a shared station is fetched once per run."""
+    cities_by_station: dict[str, list[int]] = {}
+    for city in cities:
+        station_id = WAQI_STATION_BY_API_NAME.get(city.get("api_name"))
+        if station_id:
+            cities_by_station.setdefault(station_id, []).append(city.get("id"))
+    shared_stations = {
+        station_id: city_ids for station_id, city_ids in cities_by_station.items() if len(city_ids) > 1
+    }
+
+    reset_station_fetch_plan()
+    with _station_plan_lock:
+        for station_id in shared_stations:
+            _shared_station_locks[station_id] = threading.Lock()
+    if shared_stations:
+        logging.info("[WAQI] Estaciones compartidas por varias ciudades: %s", shared_stations)
+    return {
+        "stations": len(cities_by_station),
+        "shared_stations": shared_stations,
+        "shared_fetch_city_ids": [],
+    }
+
+
+def get_shared_fetch_city_ids() -> list[int]:
+    """Cities served by another city's detail fetch in this run."""
+    with _station_plan_lock:
+        return sorted(_shared_fetch_city_ids)
+
+
+def reset_station_fetch_plan() -> None:
+    with _station_plan_lock:
+        _shared_station_locks.clear()
+        _shared_station_fetches.clear()
+        _shared_station_tasks.clear()
+        _shared_fetch_city_ids.clear()
+
+
+def record_shared_fetch(city_id: int, station_id: str, fetched_for_city_id: int) -> None:
+    logging.info(
+        "[WAQI] City ID %s reutiliza el fetch de @%s hecho para City ID %s.",
+        city_id,
+        station_id,
+        fetched_for_city_id,
+    )
+    with _station_plan_lock:
+        _shared_fetch_city_ids.add(city_id)
+
+
+def fetch_station_detail(station_id: str, waqi_api_token: str) -> dict[str, Any]:
+    """One station detail fetch: {"unchanged_at"}, {"raw_api_data"} or {"error"}."""
+    unchanged_at = get_unchanged_upstream_timestamp(station_id)
+    if unchanged_at:
+        return {"unchanged_at": unchanged_at}
+
+    url = build_station_url(station_id)
+    try:
+        response = call_with_rate_control(
+            "waqi",
+            lambda: http_get(url, params={"token": waqi_api_token}, timeout=WAQI_TIMEOUT_SECONDS),
+        )
         logging.info("[WAQI] HTTP GET %s status=%s", url, response.status_code)
         response.raise_for_status()
         raw_api_data = response.json()
-        return normalize_waqi_payload(
-            raw_api_data=raw_api_data,
-            api_name=api_name,
-            city_id=city_id,
-            station_id=station_id,
+    except Exception as error:
+        return {"error": str(error)}
+    report_waqi_quota_signal(raw_api_data)
+    return {"raw_api_data": raw_api_data}
+
+
+async def fetch_station_detail_async(client: Any, station_id: str, waqi_api_token: str) -> dict[str, Any]:
+    unchanged_at = get_unchanged_upstream_timestamp(station_id)
+    if unchanged_at:
+        return {"unchanged_at": unchanged_at}
+
+    url = build_station_url(station_id)
+    try:
+        response = await call_with_rate_control_async(
+            "waqi",
+            lambda: client.get(url, params={"token": waqi_api_token}, timeout=WAQI_TIMEOUT_SECONDS),
         )
+        logging.info("[WAQI] HTTP GET %s status=%s", url, response.status_code)
+        response.raise_for_status()
+        raw_api_data = response.json()
     except Exception as error:
-        logging.error("[WAQI] Error al obtener datos para City ID %s (%s): %s", city_id, api_name, error)
-        return build_error_result(city_id, api_name, "fetch_failed", str(error), station_id)
+        return {"error": str(error)}
+    report_waqi_quota_signal(raw_api_data)
+    return {"raw_api_data": raw_api_data}
+
+
+def build_station_city_result(
+    station_fetch: dict[str, Any],
+    api_name: str,
+    city_id: int,
+    station_id: str,
+    fetched_for_city_id: int | None = None,
+) -> dict[str, Any]:
+    """Turn one station fetch into this city's result; shared fetches fan out here."""
+    if "unchanged_at" in station_fetch:
+        result = build_unchanged_upstream_result(city_id, api_name, station_id, station_fetch["unchanged_at"])
+    elif "error" in station_fetch:
+        logging.error(
+            "[WAQI] Error al obtener datos para City ID %s (%s): %s",
+            city_id,
+            api_name,
+            station_fetch["error"],
+        )
+        result = build_error_result(city_id, api_name, "fetch_failed", station_fetch["error"], station_id)
+    else:
+        try:
+            result = normalize_waqi_payload(
+                raw_api_data=station_fetch["raw_api_data"],
+                api_name=api_name,
+                city_id=city_id,
+                station_id=station_id,
+            )
+        except Exception as error:
+            logging.error("[WAQI] Error al obtener datos para City ID %s (%s): %s", city_id, api_name, error)
+            result = build_error_result(city_id, api_name, "fetch_failed", str(error), station_id)
+
+    if fetched_for_city_id is not None:
+        result["sharedFetchCityId"] = fetched_for_city_id
+    return result
+
+
+def fetch_air_quality_data(api_name: str, city_id: int, waqi_api_token: str | None) -> dict[str, Any]:
+    logging.info("--- Iniciando fetch WAQI para City ID: %s (%s) ---", city_id, api_name)
+
+    station_id, error_result = resolve_station_id(api_name, city_id, waqi_api_token)
+    if error_result:
+        return error_result
+
+    with _station_plan_lock:
+        station_lock = _shared_station_locks.get(station_id)
+    if station_lock is None:
+        station_fetch = fetch_station_detail(station_id, waqi_api_token)
+        return build_station_city_result(station_fetch, api_name, city_id, station_id)
+
+    # Threads of cities on the same station wait here instead of fetching again.
+    with station_lock:
+        cached = _shared_station_fetches.get(station_id)
+        if cached is None:
+            station_fetch = fetch_station_detail(station_id, waqi_api_token)
+            _shared_station_fetches[station_id] = (station_fetch, city_id)
+            return build_station_city_result(station_fetch, api_name, city_id, station_id)
+
+    station_fetch, fetched_for_city_id = cached
+    record_shared_fetch(city_id, station_id, fetched_for_city_id)
+    return build_station_city_result(station_fetch, api_name, city_id, station_id, fetched_for_city_id)
+
+
+async def fetch_air_quality_data_async(
+    client: Any,
+    api_name: str,
+    city_id: int,
+    waqi_api_token: str | None,
+) -> dict[str, Any]:
+    """Async twin of `fetch_air_quality_data` using a shared `httpx.AsyncClient`."""
+    logging.info("--- Iniciando fetch WAQI async para City ID: %s (%s) ---", city_id, api_name)
+
+    station_id, error_result = resolve_station_id(api_name, city_id, waqi_api_token)
+    if error_result:
+        return error_result
+
+    with _station_plan_lock:
+        shared = station_id in _shared_station_locks
+        cached = _shared_station_tasks.get(station_id)
+        if shared and cached is None:
+            # Later coroutines for this station await the same task.
+            task = asyncio.ensure_future(fetch_station_detail_async(client, station_id, waqi_api_token))
+            _shared_station_tasks[station_id] = (task, city_id)
+    if not shared:
+        station_fetch = await fetch_station_detail_async(client, station_id, waqi_api_token)
+        return build_station_city_result(station_fetch, api_name, city_id, station_id)
+    if cached is None:
+        return build_station_city_result(await task, api_name, city_id, station_id)
+
+    task, fetched_for_city_id = cached
+    station_fetch = await task
+    record_shared_fetch(city_id, station_id, fetched_for_city_id)
+    return build_station_city_result(station_fetch, api_name, city_id, station_id, fetched_for_city_id)
+
+
+def report_waqi_quota_signal(raw_api_data: Any) -> None:
+    """WAQI reports quota exhaustion as HTTP 200 + status=error; treat it as a 429."""
+    if not isinstance(raw_api_data, dict) or raw_api_data.get("status") != "error":
+        return
+    message = str(raw_api_data.get("data") or raw_api_data.get("message") or "").lower()
+    if "quota" in message or "limit" in message:
+        get_provider_limiter("waqi").record_throttle()
 
 
 def normalize_waqi_payload(
@@ -212,7 +632,7 @@ def normalize_waqi_payload(
         },
         "ultima_actualizacion": timestamp,
         "reading_timestamp_iso": timestamp,
-        "api_raw_response": data,
+        "api_raw_response": build_stored_raw_payload(data),
     }
 
 
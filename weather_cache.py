@@ -0,0 +1,257 @@
+"""Persistent SQLite cache for Open-Meteo JSON responses across runs.
+
+Entries are keyed by endpoint, request params (coordinates rounded to 4
+decimals, variables, units, date range) and a time bucket, and expire after a
+TTL. The file is bounded to `PIPELINE_WEATHER_CACHE_MAX_ENTRIES` rows by
+least-recently-used eviction. It lives next to the other local run state in
+`.pipeline_state/`, which the hourly workflow already carries between runs.
+
+Only payloads that parsed and normalized successfully are stored. Any SQLite
+error is logged and the call falls through to the network, so a broken cache
+file never blocks a fetch.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+from utils import canonical_json_sha256
+
+WEATHER_CACHE_ENV_VAR = "PIPELINE_WEATHER_CACHE"
+WEATHER_CACHE_MODES = ("on", "off")
+DEFAULT_WEATHER_CACHE_MODE = "on"
+WEATHER_CACHE_PATH_ENV_VAR = "PIPELINE_WEATHER_CACHE_PATH"
+DEFAULT_WEATHER_CACHE_PATH = Path(".pipeline_state") / "weather_cache.sqlite3"
+MAX_ENTRIES_ENV_VAR = "PIPELINE_WEATHER_CACHE_MAX_ENTRIES"
+DEFAULT_MAX_ENTRIES = 5000
+FORECAST_TTL_ENV_VAR = "PIPELINE_WEATHER_CACHE_TTL_SECONDS"
+# Open-Meteo refreshes `current` every 15 minutes.
+DEFAULT_FORECAST_TTL_SECONDS = 900
+SERIES_TTL_ENV_VAR = "PIPELINE_WEATHER_SERIES_TTL_SECONDS"
+# Hourly series cover the last hours and the next day; refresh them a few times a day.
+DEFAULT_SERIES_TTL_SECONDS = 6 * 3600
+# Archive days settle about five days after the fact; older ranges do not change.
+ARCHIVE_SETTLED_AFTER_DAYS = 7
+SETTLED_ARCHIVE_TTL_SECONDS = 30 * 24 * 3600
+RECENT_ARCHIVE_TTL_SECONDS = 3600
+COORDINATE_PARAMS = ("latitude", "longitude")
+
+_cache_lock = threading.Lock()
+_cache: "WeatherCache | None" = None
+_cache_config: tuple[str, int] | None = None
+
+
+def get_weather_cache_mode() -> str:
+    mode = os.getenv(WEATHER_CACHE_ENV_VAR, DEFAULT_WEATHER_CACHE_MODE).strip().lower()
+    if mode not in WEATHER_CACHE_MODES:
+        raise EnvironmentError(f"{WEATHER_CACHE_ENV_VAR} invalido: {mode}. Usa {' o '.join(WEATHER_CACHE_MODES)}.")
+    return mode
+
+
+def _read_positive_int(env_var: str, default: int) -> int:
+    raw_value = os.getenv(env_var, str(default)).strip()
+    try:
+        value = int(raw_value)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise EnvironmentError(f"{env_var} invalido: {raw_value}. Usa un entero > 0.")
+    return value
+
+
+def get_weather_cache_path() -> Path:
+    return Path(os.getenv(WEATHER_CACHE_PATH_ENV_VAR) or DEFAULT_WEATHER_CACHE_PATH)
+
+
+def get_forecast_ttl_seconds() -> int:
+    return _read_positive_int(FORECAST_TTL_ENV_VAR, DEFAULT_FORECAST_TTL_SECONDS)
+
+
+def get_series_ttl_seconds() -> int:
+    return _read_positive_int(SERIES_TTL_ENV_VAR, DEFAULT_SERIES_TTL_SECONDS)
+
+
+def archive_ttl_seconds(end_date: str, today: date | None = None) -> int:
+    """Long TTL for settled archive ranges, short for ranges reaching the last days."""
+    try:
+        end = date.fromisoformat(str(end_date)[:10])
+    except ValueError:
+        return RECENT_ARCHIVE_TTL_SECONDS
+    settled_before = (today or datetime.now(timezone.utc).date()) - timedelta(days=ARCHIVE_SETTLED_AFTER_DAYS)
+    return SETTLED_ARCHIVE_TTL_SECONDS if end <= settled_before else RECENT_ARCHIVE_TTL_SECONDS
+
+
+def current_hour_bucket(now: datetime | None = None) -> str:
+    return (now or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:00Z")
+
+
+def build_cache_key(endpoint: str, params: dict[str, Any], time_bucket: str | None = None) -> str:
+    key_params = {
+        name: round(float(value), 4) if name in COORDINATE_PARAMS and isinstance(value, (int, float)) else value
+        for name, value in params.items()
+    }
+    return canonical_json_sha256({"endpoint": endpoint, "params": key_params, "bucket": time_bucket})
+
+
+class WeatherCache:
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "create table if not exists weather_cache ("
+                " key text primary key,"
+                " endpoint text not null,"
+                " payload text not null,"
+                " expires_at real not null,"
+                " last_used_at real not null)"
+            )
+            self._connection.execute(
+                "create index if not exists weather_cache_last_used_at on weather_cache (last_used_at)"
+            )
+            self._connection.execute("delete from weather_cache where expires_at <= ?", (time.time(),))
+
+    def get(self, key: str) -> Any | None:
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    "select payload from weather_cache where key = ? and expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is None:
+                    self.stats["misses"] += 1
+                    return None
+                with self._connection:
+                    self._connection.execute("update weather_cache set last_used_at = ? where key = ?", (now, key))
+                payload = json.loads(row[0])
+            except (sqlite3.Error, ValueError) as error:
+                self.stats["errors"] += 1
+                logging.warning("[WeatherCache] Read failed, fetching from Open-Meteo: %s", error)
+                return None
+            self.stats["hits"] += 1
+            return payload
+
+    def put(self, key: str, endpoint: str, payload: Any, ttl_seconds: int) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                with self._connection:
+                    self._connection.execute(
+                        "insert or replace into weather_cache (key, endpoint, payload, expires_at, last_used_at)"
+                        " values (?, ?, ?, ?, ?)",
+                        (key, endpoint, json.dumps(payload, separators=(",", ":")), now + ttl_seconds, now),
+                    )
+                    evicted = self._connection.execute(
+                        "delete from weather_cache where key not in ("
+                        " select key from weather_cache order by last_used_at desc limit ?)",
+                        (self.max_entries,),
+                    ).rowcount
+            except sqlite3.Error as error:
+                self.stats["errors"] += 1
+                logging.warning("[WeatherCache] Write failed: %s", error)
+                return
+            self.stats["writes"] += 1
+            self.stats["evictions"] += max(evicted, 0)
+
+    def entries(self) -> int:
+        with self._lock:
+            return self._connection.execute("select count(*) from weather_cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def get_weather_cache() -> WeatherCache | None:
+    """Process-wide cache, reopened when the path or size limit changes; None when off."""
+    global _cache, _cache_config
+
+    if get_weather_cache_mode() == "off":
+        return None
+    config = (str(get_weather_cache_path()), _read_positive_int(MAX_ENTRIES_ENV_VAR, DEFAULT_MAX_ENTRIES))
+    with _cache_lock:
+        if _cache is not None and _cache_config == config:
+            return _cache
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+        try:
+            _cache = WeatherCache(Path(config[0]), config[1])
+        except (OSError, sqlite3.Error) as error:
+            logging.warning("[WeatherCache] Could not open %s; cache disabled for this run: %s", config[0], error)
+            return None
+        _cache_config = config
+        return _cache
+
+
+def reset_weather_cache() -> None:
+    global _cache, _cache_config
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = None
+        _cache_config = None
+
+
+def get_weather_cache_stats() -> dict[str, Any]:
+    mode = get_weather_cache_mode()
+    with _cache_lock:
+        cache = _cache
+    if mode == "off" or cache is None:
+        return {"mode": mode, "hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+    return {"mode": mode, **cache.stats, "entries": cache.entries()}
+
+
+def read_cached_json(endpoint: str, params: dict[str, Any], time_bucket: str | None = None) -> Any | None:
+    cache = get_weather_cache()
+    if cache is None:
+        return None
+    return cache.get(build_cache_key(endpoint, params, time_bucket))
+
+
+def store_cached_json(
+    endpoint: str,
+    params: dict[str, Any],
+    payload: Any,
+    ttl_seconds: int,
+    time_bucket: str | None = None,
+) -> None:
+    cache = get_weather_cache()
+    if cache is not None:
+        cache.put(build_cache_key(endpoint, params, time_bucket), endpoint, payload, ttl_seconds)
+
+
+def cached_get_json(
+    endpoint: str,
+    params: dict[str, Any],
+    fetch: Callable[[], Any],
+    ttl_seconds: int,
+    time_bucket: str | None = None,
+    *,
+    is_valid: Callable[[Any], bool],
+) -> Any:
+    """Return the cached payload or call `fetch`; `fetch` raises on failure.
+
+    The fetched payload is stored only when `is_valid` accepts it, so an error
+    body or an empty series is not served from disk for the whole TTL.
+    """
+    cached = read_cached_json(endpoint, params, time_bucket)
+    if cached is not None:
+        return cached
+    payload = fetch()
+    if is_valid(payload):
+        store_cached_json(endpoint, params, payload, ttl_seconds, time_bucket)
+    else:
+        logging.warning("[WeatherCache] Not caching invalid payload from %s", endpoint)
+    return payload
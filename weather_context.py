@@ -1,16 +1,29 @@
+import asyncio
 import logging
 import math
+import os
+import threading
 import time
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Callable
 
-import requests
+from http_transport import http_get
+from rate_limiter import call_with_rate_control, call_with_rate_control_async
+from weather_cache import (
+    current_hour_bucket,
+    get_forecast_ttl_seconds,
+    get_series_ttl_seconds,
+    read_cached_json,
+    store_cached_json,
+)
 
 PROVIDER_NAME = "open-meteo"
 FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
 TIMEOUT_SECONDS = 20
 MAX_FETCH_ATTEMPTS = 3
 RETRY_DELAY_SECONDS = 2
+# Open-Meteo accepts comma-separated coordinate lists; keep URLs well short of limits.
+MAX_BATCH_LOCATIONS = 50
 CURRENT_FIELDS = (
     "temperature_2m",
     "relative_humidity_2m",
@@ -19,15 +32,65 @@ CURRENT_FIELDS = (
     "wind_gusts_10m",
 )
 
+# Open-Meteo forecasts are gridded: points closer than the model resolution get
+# the same `current` values, so one request per grid cell and hour is enough.
+GRID_DEGREES_ENV_VAR = "PIPELINE_WEATHER_GRID_DEGREES"
+DEFAULT_GRID_DEGREES = 0.1
 
-def enrich_with_weather_context(
+# `hourly` serves weather from an hourly series fetched a few times a day and
+# matched to the reading timestamp; `current` asks for `current` every run.
+# `current` stays the default until `hourly` has been proven in production.
+WEATHER_MODE_ENV_VAR = "PIPELINE_WEATHER_MODE"
+WEATHER_MODES = ("hourly", "current")
+DEFAULT_WEATHER_MODE = "current"
+HOURLY_PAST_HOURS = 6
+HOURLY_FORECAST_HOURS = 24
+# Inside the series every timestamp is at most 30 minutes from a bucket; a
+# reading farther than that is outside the series and uses `current` instead.
+MAX_HOURLY_MATCH_SECONDS = 30 * 60
+
+# Open-Meteo sits on the per-city critical path. Once this run has spent the
+# budget on it, or seen this many failed fetches in a row, it is skipped for
+# the rest of the run and readings fall back to the WAQI `iaqi` weather.
+WEATHER_BUDGET_ENV_VAR = "PIPELINE_WEATHER_BUDGET_SECONDS"
+DEFAULT_WEATHER_BUDGET_SECONDS = 90.0
+CIRCUIT_FAILURES_ENV_VAR = "PIPELINE_WEATHER_CIRCUIT_FAILURES"
+DEFAULT_CIRCUIT_FAILURES = 3
+WEATHER_FALLBACK_ENV_VAR = "PIPELINE_WEATHER_FALLBACK"
+# `waqi`: WAQI weather only once the circuit is open; `always`: after any failed
+# Open-Meteo context, including a one-off timeout; `none`: keep the error.
+WEATHER_FALLBACK_MODES = ("waqi", "always", "none")
+DEFAULT_WEATHER_FALLBACK = "waqi"
+WAQI_FALLBACK_PROVIDER = "waqi-iaqi"
+MS_TO_KMH = 3.6
+
+# Contexts for this run keyed by (cell lat, cell lon, UTC hour). Filled by
+# `prefetch_weather_contexts` and by per-city fetches on a miss; failed fetches
+# are cached too so cities in a failing cell do not each retry.
+_prefetch_lock = threading.Lock()
+_prefetched_contexts: dict[tuple[float, float, str], dict[str, Any]] = {}
+_cell_locks: dict[tuple[float, float, str], threading.Lock] = {}
+_cell_tasks: dict[tuple[float, float, str], Any] = {}
+_cache_stats = {"hits": 0, "hourly_matches": 0, "hourly_fallbacks": 0}
+# Hourly series payloads for this run keyed by grid cell, with the coordinates
+# they were requested for; only valid series are kept.
+_hourly_series: dict[tuple[float, float], tuple[dict[str, Any], tuple[float, float]]] = {}
+_health_lock = threading.Lock()
+_open_meteo_health: dict[str, Any] = {
+    "spent_seconds": 0.0,
+    "consecutive_failures": 0,
+    "failures": 0,
+    "circuit_open_reason": None,
+    "skipped_requests": 0,
+    "waqi_fallbacks": 0,
+}
+
+
+def resolve_weather_coordinates(
     reading: dict[str, Any],
     canonical_lat: Any = None,
     canonical_lon: Any = None,
-) -> dict[str, Any]:
-    if reading.get("status") != "success":
-        return reading
-
+) -> tuple[Any, Any]:
     reading_coordinates = (
         reading.get("coordenadas")
         if isinstance(reading.get("coordenadas"), dict)
@@ -35,9 +98,38 @@ def enrich_with_weather_context(
     )
     lat = canonical_lat if parse_number(canonical_lat) is not None else reading_coordinates.get("lat")
     lon = canonical_lon if parse_number(canonical_lon) is not None else reading_coordinates.get("lon")
+    return lat, lon
+
+
+def enrich_with_weather_context(
+    reading: dict[str, Any],
+    canonical_lat: Any = None,
+    canonical_lon: Any = None,
+) -> dict[str, Any]:
+    if reading.get("status") != "success":
+        return reading
+
+    lat, lon = resolve_weather_coordinates(reading, canonical_lat, canonical_lon)
+    context = get_hourly_weather_context(lat, lon, reading.get("reading_timestamp_iso"))
+    if context is None:
+        context = fetch_weather_context(lat, lon)
+    return {**reading, "weather_context": apply_weather_fallback(reading, context)}
+
+
+async def enrich_with_weather_context_async(
+    client: Any,
+    reading: dict[str, Any],
+    canonical_lat: Any = None,
+    canonical_lon: Any = None,
+) -> dict[str, Any]:
+    if reading.get("status") != "success":
+        return reading
 
-    context = fetch_weather_context(lat, lon)
-    return {**reading, "weather_context": context}
+    lat, lon = resolve_weather_coordinates(reading, canonical_lat, canonical_lon)
+    context = get_hourly_weather_context(lat, lon, reading.get("reading_timestamp_iso"))
+    if context is None:
+        context = await fetch_weather_context_async(client, lat, lon)
+    return {**reading, "weather_context": apply_weather_fallback(reading, context)}
 
 
 def fetch_weather_context(lat: Any, lon: Any) -> dict[str, Any]:
@@ -46,77 +138,825 @@ def fetch_weather_context(lat: Any, lon: Any) -> dict[str, Any]:
     if parsed_lat is None or parsed_lon is None:
         return build_weather_error("missing_coordinates", "Weather context requires lat/lon.")
 
-    last_error: dict[str, Any] | None = None
+    key = weather_cache_key(parsed_lat, parsed_lon)
+    cached = get_cached_weather_context(key)
+    if cached is not None:
+        return cached
+
+    # Threads for cities in the same cell wait for one fetch instead of racing.
+    with get_cell_lock(key):
+        cached = get_cached_weather_context(key)
+        if cached is not None:
+            return cached
+        point = coordinate_key(parsed_lat, parsed_lon)
+        return store_weather_context(key, fetch_weather_context_uncached(*point), point)
+
+
+def fetch_weather_context_uncached(parsed_lat: int | float, parsed_lon: int | float) -> dict[str, Any]:
+    """Fetch one location, bypassing the in-run cell cache (the on-disk cache still applies)."""
+    disk_cached = read_disk_cached_context(parsed_lat, parsed_lon)
+    if disk_cached is not None:
+        return disk_cached
+    if not is_open_meteo_available():
+        return build_circuit_open_error()
+
+    started_at = time.perf_counter()
+    result: dict[str, Any] = {}
     for attempt in range(1, MAX_FETCH_ATTEMPTS + 1):
         result = fetch_weather_context_once(parsed_lat, parsed_lon, attempt)
         if result.get("status") == "success":
-            return result
+            break
 
-        last_error = result
         should_retry = bool(result.get("retryable"))
-        if not should_retry or attempt >= MAX_FETCH_ATTEMPTS:
-            return result
+        if not should_retry or attempt >= MAX_FETCH_ATTEMPTS or not has_weather_budget_for_retry(started_at):
+            break
 
-        logging.warning(
-            "[Weather] Retrying Open-Meteo fetch after %s/%s retryable failure: %s",
-            attempt,
-            MAX_FETCH_ATTEMPTS,
-            result.get("errorType"),
-        )
+        log_weather_retry(attempt, result)
         time.sleep(RETRY_DELAY_SECONDS)
 
-    return last_error or build_weather_error("fetch_failed", "Unknown weather fetch failure.")
+    record_open_meteo_fetch(result.get("status") == "success", time.perf_counter() - started_at)
+    return result or build_weather_error("fetch_failed", "Unknown weather fetch failure.")
 
 
-def fetch_weather_context_once(
+async def fetch_weather_context_async(client: Any, lat: Any, lon: Any) -> dict[str, Any]:
+    """Async twin of `fetch_weather_context` sharing params, retries and normalization."""
+    parsed_lat = parse_number(lat)
+    parsed_lon = parse_number(lon)
+    if parsed_lat is None or parsed_lon is None:
+        return build_weather_error("missing_coordinates", "Weather context requires lat/lon.")
+
+    key = weather_cache_key(parsed_lat, parsed_lon)
+    cached = get_cached_weather_context(key)
+    if cached is not None:
+        return cached
+
+    # Coroutines for cities in the same cell await one task.
+    with _prefetch_lock:
+        entry = _cell_tasks.get(key)
+        if entry is None:
+            point = coordinate_key(parsed_lat, parsed_lon)
+            entry = (asyncio.ensure_future(fetch_weather_context_uncached_async(client, *point)), point)
+            _cell_tasks[key] = entry
+    task, point = entry
+    return store_weather_context(key, await task, point)
+
+
+async def fetch_weather_context_uncached_async(
+    client: Any,
     parsed_lat: int | float,
     parsed_lon: int | float,
-    attempt: int,
 ) -> dict[str, Any]:
+    disk_cached = read_disk_cached_context(parsed_lat, parsed_lon)
+    if disk_cached is not None:
+        return disk_cached
+    if not is_open_meteo_available():
+        return build_circuit_open_error()
+
+    started_at = time.perf_counter()
+    result: dict[str, Any] = {}
+    for attempt in range(1, MAX_FETCH_ATTEMPTS + 1):
+        try:
+            response = await call_with_rate_control_async(
+                PROVIDER_NAME,
+                lambda: client.get(
+                    FORECAST_URL,
+                    params=build_current_weather_params(parsed_lat, parsed_lon),
+                    timeout=TIMEOUT_SECONDS,
+                ),
+            )
+            result = handle_weather_response(response, attempt, (parsed_lat, parsed_lon))
+        except Exception as error:
+            result = build_weather_error("fetch_failed", str(error), retryable=True)
+
+        if result.get("status") == "success":
+            break
+
+        if (
+            not result.get("retryable")
+            or attempt >= MAX_FETCH_ATTEMPTS
+            or not has_weather_budget_for_retry(started_at)
+        ):
+            break
+
+        log_weather_retry(attempt, result)
+        await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+    record_open_meteo_fetch(result.get("status") == "success", time.perf_counter() - started_at)
+    return result or build_weather_error("fetch_failed", "Unknown weather fetch failure.")
+
+
+def fetch_weather_context_batch(coords: list[tuple[Any, Any]]) -> list[dict[str, Any]]:
+    """Fetch current weather for many locations with one request per chunk.
+
+    Returns one context per input pair, in order. Each array element goes
+    through `normalize_weather_payload`; only entries that fail (or every entry
+    of a chunk whose request failed) are retried with a per-city request.
+    """
+    contexts: list[dict[str, Any] | None] = [None] * len(coords)
+    valid_indexes = []
+    for index, (lat, lon) in enumerate(coords):
+        parsed_lat = parse_number(lat)
+        parsed_lon = parse_number(lon)
+        if parsed_lat is None or parsed_lon is None:
+            contexts[index] = build_weather_error("missing_coordinates", "Weather context requires lat/lon.")
+            continue
+        # Locations cached on disk by an earlier run stay out of the batch.
+        contexts[index] = read_disk_cached_context(parsed_lat, parsed_lon)
+        if contexts[index] is None:
+            valid_indexes.append((index, parsed_lat, parsed_lon))
+
+    for start in range(0, len(valid_indexes), MAX_BATCH_LOCATIONS):
+        chunk = valid_indexes[start:start + MAX_BATCH_LOCATIONS]
+        batch_results = fetch_weather_batch_chunk([(lat, lon) for _, lat, lon in chunk])
+        for (index, lat, lon), result in zip(chunk, batch_results):
+            if result.get("status") != "success":
+                logging.info(
+                    "[Weather] Batch entry %s,%s failed (%s); falling back to a single-location request.",
+                    lat,
+                    lon,
+                    result.get("errorType"),
+                )
+                result = fetch_weather_context_uncached(lat, lon)
+            contexts[index] = result
+
+    return contexts
+
+
+def fetch_weather_batch_chunk(coords: list[tuple[int | float, int | float]]) -> list[dict[str, Any]]:
+    payload, error = request_weather_payload(build_batch_weather_params(coords))
+    if error is not None:
+        return [error] * len(coords)
+
+    contexts = normalize_weather_batch_payload(payload, len(coords))
+    items = payload if isinstance(payload, list) else [payload]
+    for (lat, lon), item, context in zip(coords, items, contexts):
+        if context.get("status") == "success":
+            store_disk_cached_payload(lat, lon, item)
+    return contexts
+
+
+def request_weather_payload(params: dict[str, Any]) -> tuple[Any, dict[str, Any] | None]:
+    """GET the forecast endpoint with retries; (json_payload, None) or (None, weather_error)."""
+    if not is_open_meteo_available():
+        return None, build_circuit_open_error()
+
+    started_at = time.perf_counter()
+    error: dict[str, Any] = {}
+    for attempt in range(1, MAX_FETCH_ATTEMPTS + 1):
+        try:
+            response = call_with_rate_control(
+                PROVIDER_NAME,
+                lambda: http_get(FORECAST_URL, params=params, timeout=TIMEOUT_SECONDS),
+            )
+            payload, error = read_weather_response_payload(response, attempt)
+            if error is None:
+                record_open_meteo_fetch(True, time.perf_counter() - started_at)
+                return payload, None
+        except Exception as error_info:
+            error = build_weather_error("fetch_failed", str(error_info), retryable=True)
+
+        if not error.get("retryable") or attempt >= MAX_FETCH_ATTEMPTS or not has_weather_budget_for_retry(started_at):
+            break
+
+        log_weather_retry(attempt, error)
+        time.sleep(RETRY_DELAY_SECONDS)
+
+    record_open_meteo_fetch(False, time.perf_counter() - started_at)
+    return None, error or build_weather_error("fetch_failed", "Unknown weather fetch failure.")
+
+
+def build_batch_weather_params(
+    coords: list[tuple[int | float, int | float]],
+    build_params: Callable[[int | float, int | float], dict[str, Any]] | None = None,
+) -> dict[str, Any]:
+    params = (build_params or build_current_weather_params)(0, 0)
+    params["latitude"] = ",".join(str(lat) for lat, _ in coords)
+    params["longitude"] = ",".join(str(lon) for _, lon in coords)
+    return params
+
+
+def normalize_weather_batch_payload(payload: Any, expected_locations: int) -> list[dict[str, Any]]:
+    # Open-Meteo returns a bare object when the request has a single location.
+    items = payload if isinstance(payload, list) else [payload]
+    if len(items) != expected_locations:
+        error = build_weather_error(
+            "invalid_payload",
+            f"Weather batch returned {len(items)} locations, expected {expected_locations}.",
+        )
+        return [error] * expected_locations
+
+    return [
+        normalize_weather_payload(item)
+        if isinstance(item, dict)
+        else build_weather_error("invalid_payload", "Weather payload is not an object.")
+        for item in items
+    ]
+
+
+def coordinate_key(lat: int | float, lon: int | float) -> tuple[float, float]:
+    return round(float(lat), 4), round(float(lon), 4)
+
+
+def get_weather_mode() -> str:
+    mode = os.getenv(WEATHER_MODE_ENV_VAR, DEFAULT_WEATHER_MODE).strip().lower()
+    if mode not in WEATHER_MODES:
+        raise EnvironmentError(f"{WEATHER_MODE_ENV_VAR} invalido: {mode}. Usa {' o '.join(WEATHER_MODES)}.")
+    return mode
+
+
+def get_weather_budget_seconds() -> float:
+    raw_value = os.getenv(WEATHER_BUDGET_ENV_VAR, str(DEFAULT_WEATHER_BUDGET_SECONDS)).strip()
+    try:
+        budget = float(raw_value)
+    except ValueError:
+        budget = 0.0
+    if not math.isfinite(budget) or budget <= 0:
+        raise EnvironmentError(f"{WEATHER_BUDGET_ENV_VAR} invalido: {raw_value}. Usa segundos > 0.")
+    return budget
+
+
+def get_circuit_failure_threshold() -> int:
+    raw_value = os.getenv(CIRCUIT_FAILURES_ENV_VAR, str(DEFAULT_CIRCUIT_FAILURES)).strip()
     try:
-        response = requests.get(
-            FORECAST_URL,
-            params={
-                "latitude": parsed_lat,
-                "longitude": parsed_lon,
-                "current": ",".join(CURRENT_FIELDS),
-                "temperature_unit": "celsius",
-                "wind_speed_unit": "kmh",
-                "timeformat": "iso8601",
-                "timezone": "UTC",
+        threshold = int(raw_value)
+    except ValueError:
+        threshold = 0
+    if threshold <= 0:
+        raise EnvironmentError(f"{CIRCUIT_FAILURES_ENV_VAR} invalido: {raw_value}. Usa un entero > 0.")
+    return threshold
+
+
+def get_weather_fallback_mode() -> str:
+    mode = os.getenv(WEATHER_FALLBACK_ENV_VAR, DEFAULT_WEATHER_FALLBACK).strip().lower()
+    if mode not in WEATHER_FALLBACK_MODES:
+        raise EnvironmentError(
+            f"{WEATHER_FALLBACK_ENV_VAR} invalido: {mode}. Usa {' o '.join(WEATHER_FALLBACK_MODES)}."
+        )
+    return mode
+
+
+def open_weather_circuit(reason: str) -> None:
+    """Stop calling Open-Meteo for the rest of the run; caller holds `_health_lock`."""
+    if _open_meteo_health["circuit_open_reason"] is None:
+        _open_meteo_health["circuit_open_reason"] = reason
+        logging.warning(
+            "[Weather] Open-Meteo circuit open (%s) after %.1fs; using WAQI iaqi weather for the rest of the run.",
+            reason,
+            _open_meteo_health["spent_seconds"],
+        )
+
+
+def is_open_meteo_available() -> bool:
+    with _health_lock:
+        if _open_meteo_health["spent_seconds"] >= get_weather_budget_seconds():
+            open_weather_circuit("budget_exhausted")
+        if _open_meteo_health["circuit_open_reason"] is not None:
+            _open_meteo_health["skipped_requests"] += 1
+            return False
+        return True
+
+
+def has_weather_budget_for_retry(started_at: float) -> bool:
+    """Whether a retry of the fetch started at `started_at` still fits the run budget."""
+    with _health_lock:
+        spent = _open_meteo_health["spent_seconds"] + time.perf_counter() - started_at
+    return spent + RETRY_DELAY_SECONDS < get_weather_budget_seconds()
+
+
+def record_open_meteo_fetch(success: bool, seconds: float) -> None:
+    with _health_lock:
+        _open_meteo_health["spent_seconds"] += seconds
+        if success:
+            _open_meteo_health["consecutive_failures"] = 0
+        else:
+            _open_meteo_health["consecutive_failures"] += 1
+            _open_meteo_health["failures"] += 1
+            if _open_meteo_health["consecutive_failures"] >= get_circuit_failure_threshold():
+                open_weather_circuit("consecutive_failures")
+        if _open_meteo_health["spent_seconds"] >= get_weather_budget_seconds():
+            open_weather_circuit("budget_exhausted")
+
+
+def build_circuit_open_error() -> dict[str, Any]:
+    with _health_lock:
+        reason = _open_meteo_health["circuit_open_reason"]
+    return {
+        "status": "error",
+        "provider": PROVIDER_NAME,
+        "errorType": "circuit_open",
+        "message": f"Open-Meteo skipped for the rest of the run: {reason}.",
+        "retryable": False,
+    }
+
+
+def get_weather_health_snapshot() -> dict[str, Any]:
+    with _health_lock:
+        return {
+            **_open_meteo_health,
+            "spent_seconds": round(_open_meteo_health["spent_seconds"], 3),
+            "budget_seconds": get_weather_budget_seconds(),
+            "fallback": get_weather_fallback_mode(),
+        }
+
+
+def is_weather_circuit_open() -> bool:
+    with _health_lock:
+        return _open_meteo_health["circuit_open_reason"] is not None
+
+
+def apply_weather_fallback(reading: dict[str, Any], context: dict[str, Any]) -> dict[str, Any]:
+    """Replace a failed Open-Meteo context with the reading's own WAQI weather when it has any.
+
+    In the default `waqi` mode this only happens once the circuit is open (budget
+    spent or too many failures in a row); an isolated failure keeps its error.
+    """
+    if context.get("status") == "success":
+        return context
+    mode = get_weather_fallback_mode()
+    if mode == "none":
+        return context
+    if mode == "waqi" and context.get("errorType") != "circuit_open" and not is_weather_circuit_open():
+        return context
+    fallback = build_waqi_weather_context(reading, context.get("errorType"))
+    if fallback is None:
+        return context
+    with _health_lock:
+        _open_meteo_health["waqi_fallbacks"] += 1
+    return fallback
+
+
+def build_waqi_weather_context(reading: dict[str, Any], reason: Any = None) -> dict[str, Any] | None:
+    """Degraded context from the WAQI `iaqi` fields that `normalize_waqi_payload` puts in `clima`.
+
+    WAQI reports wind in m/s and has no gusts; `weather_provider` is
+    `WAQI_FALLBACK_PROVIDER` so these rows can be told apart from Open-Meteo ones.
+    """
+    clima = reading.get("clima") if isinstance(reading.get("clima"), dict) else {}
+    wind_speed_ms = parse_number(clima.get("velocidad_viento_ms"))
+    context = {
+        "status": "success",
+        "weather_temperature_c": parse_number(clima.get("temperatura_c")),
+        "weather_humidity_percent": parse_int(clima.get("humedad_relativa")),
+        "weather_wind_speed_kmh": round(wind_speed_ms * MS_TO_KMH, 2) if wind_speed_ms is not None else None,
+        "weather_wind_direction_deg": parse_int(clima.get("direccion_viento_deg")),
+        "weather_wind_gust_kmh": None,
+        "weather_provider": WAQI_FALLBACK_PROVIDER,
+        "weather_timestamp": normalize_timestamp(reading.get("reading_timestamp_iso")),
+        "weather_source_payload": {
+            "iaqi": {
+                "t": clima.get("temperatura_c"),
+                "h": clima.get("humedad_relativa"),
+                "w": clima.get("velocidad_viento_ms"),
+                "wd": clima.get("direccion_viento_deg"),
+                "p": clima.get("presion_hpa"),
             },
-            timeout=TIMEOUT_SECONDS,
+            "degraded": True,
+            "open_meteo_error": reason,
+        },
+    }
+    has_weather_value = any(
+        context[key] is not None
+        for key in (
+            "weather_temperature_c",
+            "weather_humidity_percent",
+            "weather_wind_speed_kmh",
+            "weather_wind_direction_deg",
         )
-        status_code = response.status_code
+    )
+    if not has_weather_value or validate_weather_context(context):
+        return None
+    return context
+
+
+def get_weather_grid_degrees() -> float:
+    raw_value = os.getenv(GRID_DEGREES_ENV_VAR, str(DEFAULT_GRID_DEGREES)).strip()
+    try:
+        degrees = float(raw_value)
+    except ValueError:
+        degrees = -1.0
+    if not math.isfinite(degrees) or degrees < 0 or degrees > 1:
+        raise EnvironmentError(
+            f"{GRID_DEGREES_ENV_VAR} invalido: {raw_value}. Usa grados entre 0 y 1 (0 desactiva)."
+        )
+    return degrees
+
+
+def snap_to_grid(lat: int | float, lon: int | float) -> tuple[float, float]:
+    """Nearest grid node for `lat`/`lon`; exact coordinates when the grid is 0."""
+    degrees = get_weather_grid_degrees()
+    if degrees == 0:
+        return coordinate_key(lat, lon)
+    return coordinate_key(round(lat / degrees) * degrees, round(lon / degrees) * degrees)
+
+
+def select_cell_points(locations: list[dict]) -> dict[tuple[float, float], tuple[float, float]]:
+    """Grid cell -> coordinates to request for it.
+
+    A cell is fetched at the real coordinates of one of its cities, not at the
+    grid node. The city with the lowest lat/lon is used, so a cell is requested
+    (and cached on disk) at the same point every run whatever the city order.
+    """
+    points: dict[tuple[float, float], tuple[float, float]] = {}
+    for location in locations:
+        lat = parse_number(location.get("latitude"))
+        lon = parse_number(location.get("longitude"))
+        if lat is None or lon is None:
+            continue
+        cell = snap_to_grid(lat, lon)
+        point = coordinate_key(lat, lon)
+        if cell not in points or point < points[cell]:
+            points[cell] = point
+    return points
+
+
+def weather_cache_key(
+    lat: int | float,
+    lon: int | float,
+    now: datetime | None = None,
+) -> tuple[float, float, str]:
+    hour = (now or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:00Z")
+    return (*snap_to_grid(lat, lon), hour)
+
+
+def prefetch_weather_contexts(cities: list[dict]) -> dict[str, Any]:
+    """Batch-fetch weather for cities with canonical coordinates before the city loop.
+
+    Cities are grouped by grid cell, so the batch carries one location per cell
+    (see `select_cell_points`). Enrichment later reads these contexts instead
+    of issuing one request per city. Cities without coordinates keep the
+    per-city path using the coordinates of their reading.
+
+    In `hourly` mode the hourly series of each cell is loaded instead; see
+    `prefetch_hourly_weather_series`.
+    """
+    reset_weather_prefetch()
+    if get_weather_mode() == "hourly":
+        return prefetch_hourly_weather_series(cities)
+
+    points = list(select_cell_points(cities).values())
+    if not points:
+        return {"locations": 0, "success": 0, "errors": 0}
+
+    contexts = fetch_weather_context_batch(points)
+    for point, context in zip(points, contexts):
+        store_weather_context(weather_cache_key(*point), context, point)
+
+    success = sum(1 for context in contexts if context.get("status") == "success")
+    logging.info("[Weather] Batch prefetch: %s/%s grid cells succeeded.", success, len(points))
+    return {"locations": len(points), "success": success, "errors": len(points) - success}
+
+
+def prefetch_hourly_weather_series(cities: list[dict]) -> dict[str, Any]:
+    """Load the hourly series of every grid cell, from disk when cached, else in batches.
+
+    A series covers `HOURLY_PAST_HOURS` back and `HOURLY_FORECAST_HOURS` ahead and
+    stays on disk for `PIPELINE_WEATHER_SERIES_TTL_SECONDS`, so most runs make no
+    weather request. Cells whose series cannot be fetched use `current` per city.
+    """
+    cells = select_cell_points(cities)
+
+    from_disk = 0
+    missing = []
+    for cell, point in cells.items():
+        payload = read_cached_json(FORECAST_URL, build_hourly_weather_params(*point))
+        if is_hourly_series(payload):
+            store_hourly_series(cell, payload, point)
+            from_disk += 1
+        else:
+            missing.append((cell, point))
+
+    for start in range(0, len(missing), MAX_BATCH_LOCATIONS):
+        chunk = missing[start:start + MAX_BATCH_LOCATIONS]
+        for (cell, point), payload in zip(chunk, fetch_hourly_series_chunk([point for _, point in chunk])):
+            if payload is not None:
+                store_hourly_series(cell, payload, point)
+
+    with _prefetch_lock:
+        success = len(_hourly_series)
+    logging.info(
+        "[Weather] Hourly series prefetch: %s/%s grid cells ready, %s from the disk cache.",
+        success,
+        len(cells),
+        from_disk,
+    )
+    return {
+        "mode": "hourly",
+        "locations": len(cells),
+        "success": success,
+        "errors": len(cells) - success,
+        "from_disk": from_disk,
+    }
+
+
+def fetch_hourly_series_chunk(coords: list[tuple[float, float]]) -> list[dict[str, Any] | None]:
+    """Hourly series per location, None where the request or the entry failed."""
+    payload, error = request_weather_payload(build_batch_weather_params(coords, build_hourly_weather_params))
+    if error is not None:
+        return [None] * len(coords)
+
+    items = payload if isinstance(payload, list) else [payload]
+    if len(items) != len(coords):
+        logging.warning(
+            "[Weather] invalid_payload: Weather series batch returned %s locations, expected %s.",
+            len(items),
+            len(coords),
+        )
+        return [None] * len(coords)
+
+    series = []
+    for (lat, lon), item in zip(coords, items):
+        if not is_hourly_series(item):
+            logging.warning("[Weather] missing_hourly: Weather series for %s,%s has no hourly arrays.", lat, lon)
+            series.append(None)
+            continue
+        store_cached_json(FORECAST_URL, build_hourly_weather_params(lat, lon), item, get_series_ttl_seconds())
+        series.append(item)
+    return series
+
+
+def is_hourly_series(payload: Any) -> bool:
+    hourly = payload.get("hourly") if isinstance(payload, dict) else None
+    return isinstance(hourly, dict) and isinstance(hourly.get("time"), list) and bool(hourly["time"])
+
+
+def store_hourly_series(cell: tuple[float, float], payload: dict[str, Any], point: tuple[float, float]) -> None:
+    with _prefetch_lock:
+        _hourly_series[cell] = (payload, point)
+
+
+def get_hourly_weather_context(lat: Any, lon: Any, reading_timestamp: Any = None) -> dict[str, Any] | None:
+    """Context from the cell's hourly series at the bucket nearest the reading.
+
+    None in `current` mode, or when the cell has no series or the reading falls
+    outside it; the caller then fetches `current` weather.
+    """
+    if get_weather_mode() != "hourly":
+        return None
+    return find_hourly_weather_context(lat, lon, reading_timestamp)
+
+
+def find_hourly_weather_context(lat: Any, lon: Any, reading_timestamp: Any = None) -> dict[str, Any] | None:
+    """Match against a series loaded by `prefetch_hourly_weather_series`, whatever the weather mode."""
+    parsed_lat = parse_number(lat)
+    parsed_lon = parse_number(lon)
+    if parsed_lat is None or parsed_lon is None:
+        return None
+
+    cell = snap_to_grid(parsed_lat, parsed_lon)
+    with _prefetch_lock:
+        payload, point = _hourly_series.get(cell, (None, None))
+    target = normalize_timestamp(reading_timestamp) or datetime.now(timezone.utc).isoformat()
+    context = match_hourly_weather(payload, target) if payload is not None else None
+    with _prefetch_lock:
+        _cache_stats["hourly_matches" if context is not None else "hourly_fallbacks"] += 1
+    if context is None:
         logging.info(
-            "[Weather] HTTP GET attempt=%s/%s status=%s",
-            attempt,
-            MAX_FETCH_ATTEMPTS,
-            status_code,
+            "[Weather] No hourly series point for %s,%s at %s; fetching current weather.",
+            cell[0],
+            cell[1],
+            target,
         )
-        if should_retry_status(status_code):
-            return build_weather_error(
-                "fetch_failed",
-                f"Retryable HTTP status {status_code}",
-                retryable=True,
-            )
-        if is_nonretryable_client_error_status(status_code):
-            return build_weather_error(
-                "fetch_failed",
-                f"Non-retryable HTTP status {status_code}",
-                retryable=False,
-            )
-        response.raise_for_status()
-        payload = response.json()
-    except ValueError as error:
-        return build_weather_error("invalid_json", str(error))
+        return None
+    return with_grid_cell(context, cell, point)
+
+
+def match_hourly_weather(payload: dict[str, Any], reading_timestamp: str) -> dict[str, Any] | None:
+    """Normalize the hourly bucket nearest `reading_timestamp`, or None if none is close enough."""
+    hourly = payload.get("hourly") or {}
+    target = datetime.fromisoformat(reading_timestamp)
+    best: tuple[float, int] | None = None
+    for index, value in enumerate(hourly.get("time") or []):
+        bucket = normalize_timestamp(value)
+        if not bucket:
+            continue
+        distance = abs((datetime.fromisoformat(bucket) - target).total_seconds())
+        if distance <= MAX_HOURLY_MATCH_SECONDS and (best is None or distance < best[0]):
+            best = (distance, index)
+    if best is None:
+        return None
+
+    index = best[1]
+    point = {"time": hourly["time"][index]}
+    for field in CURRENT_FIELDS:
+        values = hourly.get(field)
+        if isinstance(values, list) and index < len(values):
+            point[field] = values[index]
+    context = normalize_weather_payload({**payload, "current": point, "current_units": payload.get("hourly_units")})
+    if context.get("status") != "success":
+        return None
+
+    source = context["weather_source_payload"]
+    context["weather_source_payload"] = {
+        "hourly": source["current"],
+        "hourly_units": source["current_units"],
+        "reading_timestamp": reading_timestamp,
+        **({"grid_point": source["grid_point"]} if "grid_point" in source else {}),
+    }
+    return context
+
+
+def get_cell_lock(key: tuple[float, float, str]) -> threading.Lock:
+    with _prefetch_lock:
+        return _cell_locks.setdefault(key, threading.Lock())
+
+
+def get_cached_weather_context(key: tuple[float, float, str]) -> dict[str, Any] | None:
+    with _prefetch_lock:
+        context = _prefetched_contexts.get(key)
+        if context is not None:
+            _cache_stats["hits"] += 1
+    return dict(context) if context is not None else None
+
+
+def store_weather_context(
+    key: tuple[float, float, str],
+    context: dict[str, Any],
+    point: tuple[float, float] | None = None,
+) -> dict[str, Any]:
+    """Cache `context` for its grid cell and return a copy; the first stored context wins."""
+    context = with_grid_cell(context, key[:2], point)
+    with _prefetch_lock:
+        stored = _prefetched_contexts.setdefault(key, context)
+    return dict(stored)
+
+
+def with_grid_cell(
+    context: dict[str, Any],
+    cell: tuple[float, float],
+    point: tuple[float, float] | None = None,
+) -> dict[str, Any]:
+    """Record the grid cell and the coordinates requested for it in a successful context."""
+    if context.get("status") != "success":
+        return context
+    source = {
+        **(context.get("weather_source_payload") or {}),
+        "grid_cell": {"latitude": cell[0], "longitude": cell[1], "degrees": get_weather_grid_degrees()},
+    }
+    if point is not None:
+        source["requested_point"] = {"latitude": point[0], "longitude": point[1]}
+    return {**context, "weather_source_payload": source}
+
+
+def get_prefetched_weather_context(lat: int | float, lon: int | float) -> dict[str, Any] | None:
+    return get_cached_weather_context(weather_cache_key(lat, lon))
+
+
+def get_weather_cache_snapshot() -> dict[str, Any]:
+    with _prefetch_lock:
+        return {
+            "mode": get_weather_mode(),
+            "grid_degrees": get_weather_grid_degrees(),
+            "cells": len(_prefetched_contexts),
+            "hits": _cache_stats["hits"],
+            "series_cells": len(_hourly_series),
+            "hourly_matches": _cache_stats["hourly_matches"],
+            "hourly_fallbacks": _cache_stats["hourly_fallbacks"],
+        }
+
+
+def reset_weather_prefetch() -> None:
+    with _prefetch_lock:
+        _prefetched_contexts.clear()
+        _cell_locks.clear()
+        _cell_tasks.clear()
+        _hourly_series.clear()
+        for key in _cache_stats:
+            _cache_stats[key] = 0
+    reset_weather_health()
+
+
+def reset_weather_health() -> None:
+    with _health_lock:
+        _open_meteo_health.update(
+            spent_seconds=0.0,
+            consecutive_failures=0,
+            failures=0,
+            circuit_open_reason=None,
+            skipped_requests=0,
+            waqi_fallbacks=0,
+        )
+
+
+def log_weather_retry(attempt: int, result: dict[str, Any]) -> None:
+    logging.warning(
+        "[Weather] Retrying Open-Meteo fetch after %s/%s retryable failure: %s",
+        attempt,
+        MAX_FETCH_ATTEMPTS,
+        result.get("errorType"),
+    )
+
+
+def build_current_weather_params(parsed_lat: int | float, parsed_lon: int | float) -> dict[str, Any]:
+    return {
+        "latitude": parsed_lat,
+        "longitude": parsed_lon,
+        "current": ",".join(CURRENT_FIELDS),
+        "temperature_unit": "celsius",
+        "wind_speed_unit": "kmh",
+        "timeformat": "iso8601",
+        "timezone": "UTC",
+    }
+
+
+def build_hourly_weather_params(parsed_lat: int | float, parsed_lon: int | float) -> dict[str, Any]:
+    return {
+        "latitude": parsed_lat,
+        "longitude": parsed_lon,
+        "hourly": ",".join(CURRENT_FIELDS),
+        "past_hours": HOURLY_PAST_HOURS,
+        "forecast_hours": HOURLY_FORECAST_HOURS,
+        "temperature_unit": "celsius",
+        "wind_speed_unit": "kmh",
+        "timeformat": "iso8601",
+        "timezone": "UTC",
+    }
+
+
+def fetch_weather_context_once(
+    parsed_lat: int | float,
+    parsed_lon: int | float,
+    attempt: int,
+) -> dict[str, Any]:
+    try:
+        response = call_with_rate_control(
+            PROVIDER_NAME,
+            lambda: http_get(
+                FORECAST_URL,
+                params=build_current_weather_params(parsed_lat, parsed_lon),
+                timeout=TIMEOUT_SECONDS,
+            ),
+        )
+        return handle_weather_response(response, attempt, (parsed_lat, parsed_lon))
     except Exception as error:
         return build_weather_error("fetch_failed", str(error), retryable=True)
 
+
+def handle_weather_response(
+    response: Any,
+    attempt: int,
+    coords: tuple[int | float, int | float] | None = None,
+) -> dict[str, Any]:
+    """Classify a requests/httpx response into a weather context or error."""
+    payload, error = read_weather_response_payload(response, attempt)
+    if error is not None:
+        return error
+
     if not isinstance(payload, dict):
         return build_weather_error("invalid_payload", "Weather payload is not an object.")
 
-    return normalize_weather_payload(payload)
+    context = normalize_weather_payload(payload)
+    if coords is not None and context.get("status") == "success":
+        store_disk_cached_payload(coords[0], coords[1], payload)
+    return context
+
+
+def read_disk_cached_context(lat: int | float, lon: int | float) -> dict[str, Any] | None:
+    payload = read_cached_json(FORECAST_URL, build_current_weather_params(lat, lon), current_hour_bucket())
+    if not isinstance(payload, dict):
+        return None
+    context = normalize_weather_payload(payload)
+    return context if context.get("status") == "success" else None
+
+
+def store_disk_cached_payload(lat: int | float, lon: int | float, payload: dict[str, Any]) -> None:
+    store_cached_json(
+        FORECAST_URL,
+        build_current_weather_params(lat, lon),
+        payload,
+        get_forecast_ttl_seconds(),
+        current_hour_bucket(),
+    )
+
+
+def read_weather_response_payload(response: Any, attempt: int) -> tuple[Any, dict[str, Any] | None]:
+    """Return (json_payload, None) or (None, weather_error) for one HTTP response."""
+    status_code = response.status_code
+    logging.info(
+        "[Weather] HTTP GET attempt=%s/%s status=%s",
+        attempt,
+        MAX_FETCH_ATTEMPTS,
+        status_code,
+    )
+    if should_retry_status(status_code):
+        return None, build_weather_error(
+            "fetch_failed",
+            f"Retryable HTTP status {status_code}",
+            retryable=True,
+        )
+    if is_nonretryable_client_error_status(status_code):
+        return None, build_weather_error(
+            "fetch_failed",
+            f"Non-retryable HTTP status {status_code}",
+            retryable=False,
+        )
+
+    try:
+        response.raise_for_status()
+        return response.json(), None
+    except ValueError as error:
+        return None, build_weather_error("invalid_json", str(error))
+    except Exception as error:
+        return None, build_weather_error("fetch_failed", str(error), retryable=True)
 
 
 def should_retry_status(status_code: int | None) -> bool:
@@ -158,6 +998,13 @@ def normalize_weather_payload(payload: dict[str, Any]) -> dict[str, Any]:
             "current_units": payload.get("current_units"),
         },
     }
+    if payload.get("latitude") is not None and payload.get("longitude") is not None:
+        # Grid point Open-Meteo actually used for the requested coordinates.
+        context["weather_source_payload"]["grid_point"] = {
+            "latitude": payload.get("latitude"),
+            "longitude": payload.get("longitude"),
+            "elevation": payload.get("elevation"),
+        }
 
     errors = validate_weather_context(context)
     if errors:
@@ -0,0 +1,294 @@
+"""Deferred weather enrichment of inserted readings.
+
+With `PIPELINE_WEATHER_ENRICHMENT=deferred`, cities insert their AQI reading
+without waiting for Open-Meteo and leave a job with the reading's coordinates
+and WAQI `clima`. After every city is written, `drain_weather_queue`:
+
+1. upserts this run's jobs into `weather_enrichment_queue`, so a failed drain
+   leaves them for the next run,
+2. loads the pending jobs, including leftovers of earlier runs,
+3. loads weather for their grid cells and matches each job to it. Readings
+   from before the current UTC hour always use the hourly series, even with
+   `PIPELINE_WEATHER_MODE=current`, because the drain of a later run can never
+   give them `current` weather; older jobs without a series point stay queued.
+   Current-hour readings follow the weather mode (WAQI `iaqi` weather once
+   the Open-Meteo circuit is open),
+4. sends everything to `apply_weather_enrichment`, which fills the `weather_*`
+   columns and `weather_backfilled_at` and removes the finished jobs in one
+   transaction.
+
+Jobs for readings older than the hourly series are dropped; the history
+backfill script covers those rows.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from postgrest.types import ReturnMethod
+
+from supabase_client import get_supabase_client
+from weather_context import (
+    HOURLY_PAST_HOURS,
+    WAQI_FALLBACK_PROVIDER,
+    apply_weather_fallback,
+    build_weather_error,
+    find_hourly_weather_context,
+    get_cached_weather_context,
+    get_weather_mode,
+    normalize_timestamp,
+    parse_number,
+    prefetch_hourly_weather_series,
+    prefetch_weather_contexts,
+    resolve_weather_coordinates,
+    weather_cache_key,
+)
+
+WEATHER_ENRICHMENT_ENV_VAR = "PIPELINE_WEATHER_ENRICHMENT"
+WEATHER_ENRICHMENT_MODES = ("inline", "deferred")
+DEFAULT_WEATHER_ENRICHMENT_MODE = "inline"
+QUEUE_TABLE = "weather_enrichment_queue"
+APPLY_RPC_NAME = "apply_weather_enrichment"
+MAX_DRAIN_JOBS = 500
+MAX_JOB_ATTEMPTS = 3
+MAX_JOB_AGE_HOURS = HOURLY_PAST_HOURS
+WEATHER_COLUMNS = (
+    "weather_temperature_c",
+    "weather_humidity_percent",
+    "weather_wind_speed_kmh",
+    "weather_wind_direction_deg",
+    "weather_wind_gust_kmh",
+    "weather_provider",
+    "weather_timestamp",
+    "weather_source_payload",
+)
+
+_jobs_lock = threading.Lock()
+_pending_jobs: dict[tuple[int, str], dict[str, Any]] = {}
+_enriched_readings: list[dict[str, Any]] = []
+
+
+def get_weather_enrichment_mode() -> str:
+    mode = os.getenv(WEATHER_ENRICHMENT_ENV_VAR, DEFAULT_WEATHER_ENRICHMENT_MODE).strip().lower()
+    if mode not in WEATHER_ENRICHMENT_MODES:
+        raise EnvironmentError(
+            f"{WEATHER_ENRICHMENT_ENV_VAR} invalido: {mode}. Usa {' o '.join(WEATHER_ENRICHMENT_MODES)}."
+        )
+    return mode
+
+
+def is_weather_enrichment_deferred() -> bool:
+    return get_weather_enrichment_mode() == "deferred"
+
+
+def reset_weather_enrichment() -> None:
+    with _jobs_lock:
+        _pending_jobs.clear()
+        _enriched_readings.clear()
+
+
+def job_key(job: dict[str, Any]) -> tuple[int, str] | None:
+    timestamp = normalize_timestamp(job.get("reading_timestamp"))
+    if job.get("city_id") is None or timestamp is None:
+        return None
+    return int(job["city_id"]), timestamp
+
+
+def enqueue_weather_job(
+    reading: dict[str, Any],
+    canonical_lat: Any = None,
+    canonical_lon: Any = None,
+) -> None:
+    """Remember a written reading for the end-of-run drain."""
+    lat, lon = resolve_weather_coordinates(reading, canonical_lat, canonical_lon)
+    job = {
+        "city_id": reading.get("city_id"),
+        "reading_timestamp": reading.get("reading_timestamp_iso"),
+        "latitude": parse_number(lat),
+        "longitude": parse_number(lon),
+        "waqi_weather": reading.get("clima") if isinstance(reading.get("clima"), dict) else None,
+    }
+    key = job_key(job)
+    if key is None:
+        return
+    with _jobs_lock:
+        _pending_jobs[key] = {**job, "reading_timestamp": key[1]}
+
+
+def take_pending_jobs() -> list[dict[str, Any]]:
+    with _jobs_lock:
+        jobs = list(_pending_jobs.values())
+        _pending_jobs.clear()
+    return jobs
+
+
+def get_enriched_readings() -> list[dict[str, Any]]:
+    """(city_id, reading_timestamp) of rows the last drain filled, for the rollup refresh."""
+    with _jobs_lock:
+        return list(_enriched_readings)
+
+
+def merge_jobs(queued: list[dict[str, Any]], run_jobs: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    jobs: dict[tuple[int, str], dict[str, Any]] = {}
+    for job in [*queued, *run_jobs]:
+        key = job_key(job)
+        if key is not None:
+            jobs.setdefault(key, {**job, "city_id": key[0], "reading_timestamp": key[1]})
+    return list(jobs.values())
+
+
+def is_expired(job: dict[str, Any], now: datetime) -> bool:
+    reading_time = datetime.fromisoformat(job["reading_timestamp"])
+    return reading_time < now - timedelta(hours=MAX_JOB_AGE_HOURS)
+
+
+def is_current_hour(job: dict[str, Any], now: datetime) -> bool:
+    reading_time = datetime.fromisoformat(job["reading_timestamp"]).astimezone(timezone.utc)
+    return reading_time.replace(minute=0, second=0, microsecond=0) == now.replace(minute=0, second=0, microsecond=0)
+
+
+def job_location(job: dict[str, Any]) -> dict[str, Any]:
+    return {"latitude": job.get("latitude"), "longitude": job.get("longitude")}
+
+
+def build_weather_contexts(jobs: list[dict[str, Any]], now: datetime) -> list[dict[str, Any] | None]:
+    """One context per job, or None for a job to leave queued.
+
+    Weather for the jobs' grid cells is loaded first in batches. A job takes
+    the hourly series point nearest its reading; without one, `current` weather
+    is used only when the reading is from the current UTC hour, so an older
+    reading is never stamped with weather from now. In `current` mode the
+    series is loaded only for the older jobs.
+    """
+    hourly = get_weather_mode() == "hourly"
+    prefetch_weather_contexts([job_location(job) for job in jobs if hourly or is_current_hour(job, now)])
+    older = [job_location(job) for job in jobs if not is_current_hour(job, now)]
+    if not hourly and older:
+        prefetch_hourly_weather_series(older)
+    resolved: list[dict[str, Any] | None] = []
+    for job in jobs:
+        lat, lon = job.get("latitude"), job.get("longitude")
+        current_hour = is_current_hour(job, now)
+        if lat is None or lon is None:
+            context = build_weather_error("missing_coordinates", "Weather context requires lat/lon.")
+        else:
+            context = None
+            if hourly or not current_hour:
+                context = find_hourly_weather_context(lat, lon, job["reading_timestamp"])
+            if context is None and current_hour:
+                context = get_cached_weather_context(weather_cache_key(lat, lon))
+        if context is None:
+            resolved.append(None)
+            continue
+        reading = {"clima": job.get("waqi_weather") or {}, "reading_timestamp_iso": job["reading_timestamp"]}
+        resolved.append(apply_weather_fallback(reading, context))
+    return resolved
+
+
+def build_enrichment_row(job: dict[str, Any], context: dict[str, Any], backfilled_at: str) -> dict[str, Any]:
+    return {
+        "city_id": job["city_id"],
+        "reading_timestamp": job["reading_timestamp"],
+        **{column: context.get(column) for column in WEATHER_COLUMNS},
+        "weather_backfilled_at": backfilled_at,
+    }
+
+
+def build_queue_row(job: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "city_id": job["city_id"],
+        "reading_timestamp": job["reading_timestamp"],
+        "latitude": job.get("latitude"),
+        "longitude": job.get("longitude"),
+        "waqi_weather": job.get("waqi_weather"),
+    }
+
+
+def drain_weather_queue(supabase: Any = None, now: datetime | None = None) -> dict[str, Any]:
+    mode = get_weather_enrichment_mode()
+    if mode == "inline":
+        return {"mode": mode, "status": "disabled"}
+
+    run_jobs = take_pending_jobs()
+    summary: dict[str, Any] = {"mode": mode, "status": "success", "enqueued": len(run_jobs)}
+    try:
+        client = supabase or get_supabase_client()
+        if run_jobs:
+            client.table(QUEUE_TABLE).upsert(
+                [build_queue_row(job) for job in run_jobs],
+                on_conflict="city_id,reading_timestamp",
+                returning=ReturnMethod.minimal,
+            ).execute()
+        response = (
+            client.table(QUEUE_TABLE)
+            .select("city_id, reading_timestamp, latitude, longitude, waqi_weather")
+            .order("reading_timestamp", desc=True)
+            .limit(MAX_DRAIN_JOBS)
+            .execute()
+        )
+    except Exception as error:
+        logging.error("[WEATHER] No se pudo leer la cola %s: %s", QUEUE_TABLE, error)
+        return {**summary, "status": "failed", "error": str(error)}
+
+    queued = response.data if isinstance(response.data, list) else []
+    jobs = merge_jobs(queued, run_jobs)
+    if not jobs:
+        return {**summary, "status": "no_pending_jobs", "jobs": 0}
+    current_time = now or datetime.now(timezone.utc)
+    expired = [job for job in jobs if is_expired(job, current_time)]
+    live_jobs = [job for job in jobs if not is_expired(job, current_time)]
+
+    backfilled_at = current_time.isoformat()
+    rows: list[dict[str, Any]] = []
+    failed: list[dict[str, Any]] = []
+    pending = 0
+    for job, context in zip(live_jobs, build_weather_contexts(live_jobs, current_time)):
+        if context is None:
+            pending += 1
+        elif context.get("status") == "success":
+            rows.append(build_enrichment_row(job, context, backfilled_at))
+        else:
+            failed.append({**build_job_reference(job), "error": context.get("errorType")})
+
+    try:
+        response = client.rpc(
+            APPLY_RPC_NAME,
+            {
+                "p_rows": rows,
+                "p_failed": failed,
+                "p_expired": [build_job_reference(job) for job in expired],
+                "p_max_attempts": MAX_JOB_ATTEMPTS,
+            },
+        ).execute()
+    except Exception as error:
+        logging.error("[WEATHER] No se pudo aplicar el clima diferido: %s", error)
+        return {**summary, "status": "failed", "jobs": len(jobs), "error": str(error)}
+
+    applied = response.data if isinstance(response.data, dict) else {}
+    updated_readings = applied.get("updated_readings") if isinstance(applied.get("updated_readings"), list) else []
+    with _jobs_lock:
+        # Only rows the RPC changed; rows that already had weather were skipped.
+        _enriched_readings[:] = [build_job_reference(row) for row in updated_readings]
+    logging.info(
+        "[WEATHER] Clima diferido: %s lecturas enriquecidas, %s fallidas, %s pendientes, %s expiradas.",
+        len(updated_readings),
+        len(failed),
+        pending,
+        len(expired),
+    )
+    return {
+        **summary,
+        "jobs": len(jobs),
+        "enriched": len(updated_readings),
+        "waqi_fallbacks": sum(1 for row in rows if row["weather_provider"] == WAQI_FALLBACK_PROVIDER),
+        "failed": len(failed),
+        "pending": pending,
+        "expired": len(expired),
+        "dropped": applied.get("dropped", 0),
+    }
+
+
+def build_job_reference(job: dict[str, Any]) -> dict[str, Any]:
+    return {"city_id": job["city_id"], "reading_timestamp": job["reading_timestamp"]}